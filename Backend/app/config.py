@@ -1,11 +1,26 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Any, Dict, List
 
 class Settings(BaseSettings):
     # Database
     DATABASE_URL: str
     DEBUG: bool = False  # ADD THIS LINE
     
+    # Connection pool, per worker process: keep workers × (size + overflow)
+    # under Postgres max_connections. Statement timeout is Postgres only (0 = none).
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT_SECONDS: float = 30.0
+    DB_POOL_RECYCLE_SECONDS: int = 300
+    DB_POOL_USE_LIFO: bool = True
+    DB_STATEMENT_TIMEOUT_MS: int = 0
+    
+    # Optional read replica for listing endpoints (same pool settings). A user
+    # reads from the primary for READ_YOUR_WRITES_SECONDS after committing a write.
+    READ_REPLICA_URL: str = ""
+    READ_YOUR_WRITES_SECONDS: float = 5.0
+    
     # JWT
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
@@ -14,10 +29,113 @@ class Settings(BaseSettings):
     # Firebase
     FIREBASE_PROJECT_ID: str
     FIREBASE_CREDENTIALS_PATH: str = "./firebase-credentials.json"
+    FIREBASE_SIGNING_KEYS_URL: str = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+    FIREBASE_KEY_REFRESH_AHEAD_SECONDS: float = 300.0
+    # Fetch signing keys at startup; otherwise the first verify fetches them
+    FIREBASE_PREFETCH_KEYS_ON_STARTUP: bool = True
+    FIREBASE_TOKEN_CACHE_MAX_ENTRIES: int = 10_000
+    FIREBASE_VERIFY_WORKERS: int = 4
     
     # API
     API_V1_PREFIX: str = "/api/v1"
     
+    # OpenAI
+    OPENAI_API_KEY: str = ""
+    OPENAI_MODEL: str = "gpt-4o-mini"
+    EMBEDDING_MODEL: str = "text-embedding-3-small"
+    OPENAI_MAX_PROMPT_TOKENS: int = 6000
+    
+    # USD per million tokens
+    OPENAI_PRICING: Dict[str, Dict[str, float]] = {
+        "gpt-4o-mini": {"input": 0.15, "output": 0.60},
+        "gpt-4o": {"input": 2.50, "output": 10.00},
+    }
+    
+    # Model routing: cheapest tier first; classes can cap the tier index
+    MODEL_ROUTING_ENABLED: bool = True
+    OPENAI_MODEL_LADDER: List[Dict[str, Any]] = [
+        {"name": "fast", "model": "gpt-4o-mini", "max_tokens": 500},
+        {"name": "standard", "model": "gpt-4o-mini", "max_tokens": 1000},
+        {"name": "advanced", "model": "gpt-4o", "max_tokens": 1500},
+    ]
+    ROUTING_LONG_QUESTION_TOKENS: int = 150
+    ROUTING_LARGE_CONTEXT_TOKENS: int = 1500
+    ROUTING_DEEP_CONVERSATION_MESSAGES: int = 20
+    
+    # LLM admission control (per worker process)
+    LLM_REQUESTS_PER_MINUTE: int = 500
+    LLM_TOKENS_PER_MINUTE: int = 200_000
+    LLM_MAX_CONCURRENCY: int = 32
+    LLM_MIN_CONCURRENCY: int = 2
+    LLM_TARGET_LATENCY_MS: int = 8000
+    LLM_QUEUE_TIMEOUT_SECONDS: float = 10.0
+    LLM_MAX_QUEUE_PER_CLASS: int = 100
+    
+    # Token quota reservations
+    TOKEN_RESERVATION_TTL_SECONDS: int = 300
+    
+    # Write-behind usage counters (per-process buffer flushed in batches)
+    USAGE_WRITE_BEHIND_ENABLED: bool = False
+    USAGE_FLUSH_INTERVAL_MS: int = 1000
+    USAGE_FLUSH_MAX_EVENTS: int = 200
+    # Buffered usage is journaled here (fsynced) before a turn is acknowledged
+    # and replayed after a crash; empty disables the journal (a crash then
+    # loses the unflushed window)
+    USAGE_JOURNAL_DIR: str = "./usage-journal"
+    # A batch that fails this many writes is moved aside (<segment>.dead)
+    USAGE_FLUSH_MAX_ATTEMPTS: int = 5
+    # Failed batches kept for retry; past this the oldest is moved aside
+    USAGE_MAX_UNSETTLED_BATCHES: int = 20
+    
+    # Membership permission cache (per process; optional Postgres NOTIFY channel for cross-worker invalidation)
+    MEMBERSHIP_CACHE_ENABLED: bool = True
+    MEMBERSHIP_CACHE_TTL_SECONDS: float = 30.0
+    MEMBERSHIP_CACHE_MAX_ENTRIES: int = 50_000
+    MEMBERSHIP_CACHE_NOTIFY_CHANNEL: str = ""
+    
+    # Password hashing (bcrypt cost factor; hashes with another cost are upgraded on login)
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 4
+    
+    # Authenticated-user cache for get_current_user (per process)
+    USER_CACHE_ENABLED: bool = True
+    USER_CACHE_TTL_SECONDS: float = 10.0
+    USER_CACHE_MAX_ENTRIES: int = 10_000
+    
+    # Usage rollups (hourly/daily tables compacted from usage_records)
+    USAGE_ROLLUP_ENABLED: bool = True
+    ROLLUP_INTERVAL_SECONDS: int = 60
+    ROLLUP_SETTLE_SECONDS: int = 30
+    ROLLUP_BATCH_SIZE: int = 5000
+    ROLLUP_MAX_BATCHES_PER_RUN: int = 20
+    
+    # Monthly partitions of usage_records and chat_messages (Postgres). Months
+    # older than a retention are detached (kept as standalone tables for
+    # archiving) or dropped; 0 keeps everything. On SQLite retention deletes rows.
+    PARTITION_MAINTENANCE_ENABLED: bool = True
+    PARTITION_MAINTENANCE_INTERVAL_SECONDS: int = 6 * 3600
+    PARTITION_PREMAKE_MONTHS: int = 3
+    PARTITION_RETENTION_ACTION: str = "detach"
+    USAGE_RECORD_RETENTION_MONTHS: int = 0
+    CHAT_MESSAGE_RETENTION_MONTHS: int = 0
+    
+    # Cold storage for idle sessions: their messages move to one JSONL+zstd
+    # blob per session and come back when the session is opened
+    CHAT_ARCHIVE_ENABLED: bool = False
+    CHAT_ARCHIVE_DIR: str = "./storage/chat_archive"
+    CHAT_ARCHIVE_IDLE_DAYS: int = 90
+    CHAT_ARCHIVE_MIN_MESSAGES: int = 100
+    CHAT_ARCHIVE_BATCH_SIZE: int = 100
+    CHAT_ARCHIVE_INTERVAL_SECONDS: int = 3600
+    
+    # Response cache (opt-in; classes can also switch it off individually)
+    RESPONSE_CACHE_ENABLED: bool = False
+    RESPONSE_CACHE_TTL_SECONDS: int = 3600
+    RESPONSE_CACHE_MAX_ENTRIES_PER_CLASS: int = 256
+    RESPONSE_CACHE_MAX_CLASSES: int = 1000
+    RESPONSE_CACHE_SEMANTIC: bool = False
+    RESPONSE_CACHE_SIMILARITY_THRESHOLD: float = 0.95
+    
     class Config:
         env_file = ".env"
 
@@ -1,25 +1,149 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, sessionmaker
+from typing import Callable, Dict, Optional
+import threading
+import time
 import logging
 
 from app.config import get_settings
+from app.db_metrics import DatabaseMetrics
 from app.models import Base
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
-engine = create_engine(
-    settings.DATABASE_URL,
-    pool_pre_ping=True,
-    pool_recycle=300,
-    echo=settings.DEBUG
-)
+def create_db_engine(url: str, metrics: DatabaseMetrics):
+    """Engine with the configured pool, instrumented for `metrics`"""
+    options = {"pool_pre_ping": True, "echo": settings.DEBUG}
+    parsed = make_url(url)
+    # In-memory SQLite keeps one connection per thread; there is no pool to size
+    if not (parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:")):
+        options.update(
+            poolclass=metrics.pool_class(),
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+            pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
+            pool_use_lifo=settings.DB_POOL_USE_LIFO
+        )
+    if parsed.get_backend_name() == "postgresql" and settings.DB_STATEMENT_TIMEOUT_MS:
+        options["connect_args"] = {"options": f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"}
+    engine = create_engine(url, **options)
+    metrics.attach(engine)
+    return engine
+
+class PrimaryPins:
+    """
+    Users who committed a write recently, and so read from the primary until
+    the replica has had time to catch up. Per process: a worker that didn't
+    see the write routes the user by replica lag alone.
+    """
+
+    def __init__(self, seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.seconds = seconds
+        self.clock = clock
+        self._until: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def pin(self, user_id: int):
+        with self._lock:
+            now = self.clock()
+            # Drop expired pins as we go so the map stays the size of recent writers
+            if len(self._until) > 1000:
+                self._until = {uid: until for uid, until in self._until.items() if until > now}
+            self._until[user_id] = now + self.seconds
+
+    def is_pinned(self, user_id: Optional[int]) -> bool:
+        if user_id is None:
+            return False
+        with self._lock:
+            return self._until.get(user_id, 0) > self.clock()
+
+def _request_user_id(db: Session) -> Optional[int]:
+    request = db.info.get("request")
+    user = getattr(request.state, "current_user", None) if request is not None else None
+    return user.id if user is not None else None
+
+class ReplicaSession(Session):
+    """
+    Session that sends reads to the replica, except for a user pinned to
+    the primary. Anything that writes (flushes, DML statements) goes to
+    the primary, and so does everything after it in the same session.
+    """
+
+    def __init__(self, *args, primary=None, replica=None, pins: PrimaryPins = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.primary = primary
+        self.replica = replica
+        self.pins = pins
+        self.info["read_replica"] = True
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or getattr(clause, "is_dml", False):
+            self.info["wrote"] = True
+        if self.info.get("wrote") or self.pins.is_pinned(_request_user_id(self)):
+            return self.primary
+        return self.replica
+
+def track_writes(session_factory: sessionmaker, pins: PrimaryPins):
+    """Pin the request's user to the primary once a session of `session_factory` commits a write"""
+
+    @event.listens_for(session_factory, "after_flush")
+    def _after_flush(session, flush_context):
+        session.info["wrote"] = True
+
+    @event.listens_for(session_factory, "do_orm_execute")
+    def _on_execute(orm_execute_state):
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            orm_execute_state.session.info["wrote"] = True
+
+    @event.listens_for(session_factory, "after_commit")
+    def _after_commit(session):
+        if session.info.pop("wrote", False):
+            user_id = _request_user_id(session)
+            if user_id is not None:
+                pins.pin(user_id)
+
+engine_metrics = DatabaseMetrics("primary")
+engine = create_db_engine(settings.DATABASE_URL, engine_metrics)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-def get_db():
+replica_metrics: Optional[DatabaseMetrics] = None
+read_engine = None
+ReadSessionLocal: Optional[sessionmaker] = None
+primary_pins = PrimaryPins(settings.READ_YOUR_WRITES_SECONDS)
+
+if settings.READ_REPLICA_URL:
+    replica_metrics = DatabaseMetrics("replica")
+    read_engine = create_db_engine(settings.READ_REPLICA_URL, replica_metrics)
+    ReadSessionLocal = sessionmaker(
+        class_=ReplicaSession, autocommit=False, autoflush=False,
+        primary=engine, replica=read_engine, pins=primary_pins
+    )
+    track_writes(SessionLocal, primary_pins)
+    track_writes(ReadSessionLocal, primary_pins)
+
+def get_db(request: Request = None):
     db = SessionLocal()
+    db.info["request"] = request
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_read_db(request: Request = None):
+    """
+    Session for read-only endpoints: the read replica when one is
+    configured, otherwise the same as get_db
+    """
+    if ReadSessionLocal is None:
+        yield from get_db(request)
+        return
+    db = ReadSessionLocal()
+    db.info["request"] = request
     try:
         yield db
     finally:
@@ -32,4 +156,3 @@ def create_tables():
     except Exception as e:
         logger.error(f"Error creating database tables: {e}")
         raise
-
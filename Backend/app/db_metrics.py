@@ -0,0 +1,177 @@
+"""
+Connection pool and query metrics for a database engine.
+
+`DatabaseMetrics.pool_class()` gives the engine a QueuePool that times how
+long each checkout waits; `attach()` adds event listeners counting
+connections in use and every statement's duration. Statements run inside
+`track_request_queries()` (the HTTP middleware wraps every request in it)
+are also attributed to that request, so the metrics endpoint can report
+queries and database time per request. Numbers are per process.
+"""
+
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+import threading
+import time
+import weakref
+
+# Per-request samples kept for percentiles
+RECENT_REQUESTS = 1000
+
+class RequestQueries:
+    """Statements one request has run so far, per engine"""
+
+    def __init__(self):
+        # engine metrics name -> [statements, seconds]
+        self.by_engine: Dict[str, list] = {}
+
+    def add(self, name: str, seconds: float):
+        totals = self.by_engine.setdefault(name, [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+
+    @property
+    def count(self) -> int:
+        return sum(count for count, _ in self.by_engine.values())
+
+_all_metrics = weakref.WeakSet()
+
+_current_request: ContextVar[Optional[RequestQueries]] = ContextVar("db_request_queries", default=None)
+
+@contextmanager
+def track_request_queries():
+    """Attribute statements run in this context (and tasks/threads it starts) to one request"""
+    queries = RequestQueries()
+    token = _current_request.set(queries)
+    try:
+        yield queries
+    finally:
+        _current_request.reset(token)
+        for metrics in _all_metrics:
+            metrics.record_request(queries)
+
+def _percentile(samples, fraction: float):
+    if not samples:
+        return 0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class DatabaseMetrics:
+    """Checkout waits, connections in use and query counts/time for one engine"""
+
+    def __init__(self, name: str = "primary"):
+        self.name = name
+        self.engine: Optional[Engine] = None
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.checkout_wait_seconds = 0.0
+        self.max_checkout_wait_seconds = 0.0
+        self.in_use = 0
+        self.max_in_use = 0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.requests = 0
+        # (queries, seconds) of recent requests that used this engine
+        self._recent = deque(maxlen=RECENT_REQUESTS)
+        _all_metrics.add(self)
+
+    def pool_class(self):
+        """QueuePool subclass reporting how long each checkout waited to this object"""
+        metrics = self
+
+        class InstrumentedQueuePool(QueuePool):
+            def connect(self):
+                started = time.perf_counter()
+                try:
+                    connection = super().connect()
+                except PoolTimeoutError:
+                    metrics.record_checkout_timeout()
+                    raise
+                metrics.record_checkout_wait(time.perf_counter() - started)
+                return connection
+
+        return InstrumentedQueuePool
+
+    def record_checkout_timeout(self):
+        with self._lock:
+            self.checkout_timeouts += 1
+
+    def record_checkout_wait(self, seconds: float):
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_wait_seconds += seconds
+            self.max_checkout_wait_seconds = max(self.max_checkout_wait_seconds, seconds)
+
+    def attach(self, engine: Engine):
+        """Listen to the engine's pool and statement events"""
+        self.engine = engine
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "checkin", self._on_checkin)
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+        event.listen(engine, "handle_error", self._on_error)
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.in_use = max(0, self.in_use - 1)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._record_query(time.perf_counter() - conn.info["query_started"].pop())
+
+    def _on_error(self, exception_context):
+        started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+        if started:
+            self._record_query(time.perf_counter() - started.pop())
+
+    def _record_query(self, seconds: float):
+        with self._lock:
+            self.queries += 1
+            self.query_seconds += seconds
+        request = _current_request.get()
+        if request is not None:
+            request.add(self.name, seconds)
+
+    def record_request(self, queries: RequestQueries):
+        count, seconds = queries.by_engine.get(self.name, (0, 0.0))
+        with self._lock:
+            self.requests += 1
+            self._recent.append((count, seconds))
+
+    def stats(self) -> Dict[str, float]:
+        pool = self.engine.pool if self.engine is not None else None
+        with self._lock:
+            recent_counts = [count for count, _ in self._recent]
+            recent_ms = [seconds * 1000 for _, seconds in self._recent]
+            return {
+                "pool_size": pool.size() if isinstance(pool, QueuePool) else None,
+                "pool_overflow": pool.overflow() if isinstance(pool, QueuePool) else None,
+                "connections_in_use": self.in_use,
+                "max_connections_in_use": self.max_in_use,
+                "checkouts": self.checkouts,
+                "checkout_timeouts": self.checkout_timeouts,
+                "checkout_wait_ms_avg": round(self.checkout_wait_seconds * 1000 / self.checkouts, 3) if self.checkouts else 0,
+                "checkout_wait_ms_max": round(self.max_checkout_wait_seconds * 1000, 3),
+                "queries": self.queries,
+                "query_ms_total": round(self.query_seconds * 1000, 3),
+                "requests": self.requests,
+                "queries_per_request_p50": _percentile(recent_counts, 0.5),
+                "queries_per_request_p95": _percentile(recent_counts, 0.95),
+                "queries_per_request_max": max(recent_counts, default=0),
+                "query_ms_per_request_p50": round(_percentile(recent_ms, 0.5), 3),
+                "query_ms_per_request_p95": round(_percentile(recent_ms, 0.95), 3),
+            }
@@ -1,11 +1,20 @@
 import firebase_admin
-from firebase_admin import credentials, auth
+from firebase_admin import credentials
 from app.config import get_settings
+from app.services.firebase_tokens import get_firebase_verifier
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+# Verification may wait on a key fetch; keep it off the event loop
+_verify_executor = ThreadPoolExecutor(
+    max_workers=settings.FIREBASE_VERIFY_WORKERS,
+    thread_name_prefix="firebase-verify"
+)
+
 # Initialize Firebase Admin SDK
 def initialize_firebase():
     """Initialize Firebase Admin SDK with service account credentials"""
@@ -36,16 +45,13 @@ def verify_firebase_token(id_token: str) -> dict:
     
     Raises:
         ValueError: If token is invalid or expired
+    
+    Checked against cached signing keys; recently verified tokens are
+    served from cache until they expire (see app/services/firebase_tokens.py)
     """
-    try:
-        decoded_token = auth.verify_id_token(id_token)
-        return decoded_token
-    except auth.InvalidIdTokenError:
-        raise ValueError("Invalid Firebase token")
-    except auth.ExpiredIdTokenError:
-        raise ValueError("Firebase token expired")
-    except Exception as e:
-        logger.error(f"Firebase token verification error: {e}")
-        raise ValueError("Token verification failed")
-
+    return get_firebase_verifier().verify(id_token)
 
+async def verify_firebase_token_async(id_token: str) -> dict:
+    """verify_firebase_token on the verification executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_verify_executor, verify_firebase_token, id_token)
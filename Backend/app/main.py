@@ -1,8 +1,21 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from app.routes import auth
 from app.firebase_admin import initialize_firebase
 from app.config import get_settings
+from app.database import SessionLocal, engine_metrics, replica_metrics
+from app.db_metrics import track_request_queries
+from app.metrics import register_collector, collect_metrics
+from app.services.usage_aggregator import get_usage_aggregator
+from app.services.usage_rollup_service import UsageRollupService, run_rollup_compaction
+from app.services.partition_service import run_partition_maintenance
+from app.services.chat_archive_service import run_chat_archival
+from app.services.admission_control import get_admission_controller
+from app.services.response_cache import get_response_cache
+from app.services.membership_cache import get_membership_cache, MembershipInvalidationListener
+from app.services.user_cache import get_user_cache
+from app.services.firebase_tokens import get_firebase_verifier
+import asyncio
 import logging
 
 # Configure logging
@@ -24,11 +37,38 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Before-Cursor", "X-After-Cursor"],
 )
 
+@app.middleware("http")
+async def track_database_queries(request: Request, call_next):
+    """Attribute each request's queries to it for the database metrics"""
+    with track_request_queries():
+        return await call_next(request)
+
 # Include routers
 app.include_router(auth.router, prefix=f"{settings.API_V1_PREFIX}/auth", tags=["Authentication"])
 
+def _usage_rollup_metrics():
+    db = SessionLocal()
+    try:
+        return UsageRollupService().lag(db)
+    finally:
+        db.close()
+
+register_collector("usage_rollup", _usage_rollup_metrics)
+register_collector("database", engine_metrics.stats)
+if replica_metrics is not None:
+    register_collector("database_replica", replica_metrics.stats)
+register_collector("llm_admission", lambda: get_admission_controller().stats())
+register_collector("response_cache", lambda: get_response_cache().stats())
+register_collector("usage_write_behind", lambda: get_usage_aggregator().stats())
+register_collector("membership_cache", lambda: get_membership_cache().stats())
+register_collector("user_cache", lambda: get_user_cache().stats())
+register_collector("firebase_tokens", lambda: get_firebase_verifier().stats())
+
+membership_listener = None
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize services on startup"""
@@ -42,8 +82,46 @@ async def startup_event():
         logger.error(f"Failed to initialize Firebase: {e}")
         # Don't crash the app, but log the error
     
+    # Load Firebase signing keys before the first login needs them
+    if settings.FIREBASE_PREFETCH_KEYS_ON_STARTUP:
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, get_firebase_verifier().key_cache.prefetch)
+        except Exception as e:
+            logger.error(f"Failed to prefetch Firebase signing keys: {e}")
+    
+    # Periodic flush of write-behind usage counters
+    if settings.USAGE_WRITE_BEHIND_ENABLED:
+        get_usage_aggregator().start()
+    
+    # Cross-worker membership cache invalidation (Postgres only)
+    global membership_listener
+    if settings.MEMBERSHIP_CACHE_ENABLED and settings.MEMBERSHIP_CACHE_NOTIFY_CHANNEL:
+        membership_listener = MembershipInvalidationListener(settings.MEMBERSHIP_CACHE_NOTIFY_CHANNEL)
+        membership_listener.start()
+    
+    # Keep the hourly/daily usage rollups current
+    if settings.USAGE_ROLLUP_ENABLED:
+        asyncio.get_running_loop().create_task(run_rollup_compaction(SessionLocal))
+    
+    # Monthly partitions ahead of the clock, and retention
+    if settings.PARTITION_MAINTENANCE_ENABLED:
+        asyncio.get_running_loop().create_task(run_partition_maintenance(SessionLocal))
+    
+    # Move idle sessions' messages to cold storage
+    if settings.CHAT_ARCHIVE_ENABLED:
+        asyncio.get_running_loop().create_task(run_chat_archival(SessionLocal))
+    
     logger.info("StudHelper API started successfully")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush buffered state before the process exits"""
+    if membership_listener is not None:
+        membership_listener.stop()
+    if settings.USAGE_WRITE_BEHIND_ENABLED:
+        await get_usage_aggregator().stop()
+        logger.info("Flushed buffered usage counters")
+
 @app.get("/")
 async def root():
     return {
@@ -56,4 +134,7 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
-
+@app.get("/metrics")
+async def metrics():
+    # Some collectors query the database; keep them off the event loop
+    return await asyncio.get_running_loop().run_in_executor(None, collect_metrics)
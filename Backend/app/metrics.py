@@ -0,0 +1,28 @@
+"""
+In-process metrics exposed on GET /metrics.
+
+Services register a collector (a zero-argument callable returning a value
+or a dict of values) under a name; the endpoint calls every collector and
+returns the results as JSON. A failing collector is logged and reported as
+null rather than failing the whole response.
+"""
+
+from typing import Any, Callable, Dict
+import logging
+
+logger = logging.getLogger(__name__)
+
+_collectors: Dict[str, Callable[[], Any]] = {}
+
+def register_collector(name: str, collector: Callable[[], Any]):
+    _collectors[name] = collector
+
+def collect_metrics() -> Dict[str, Any]:
+    metrics = {}
+    for name, collector in _collectors.items():
+        try:
+            metrics[name] = collector()
+        except Exception as e:
+            logger.error(f"Metrics collector {name} failed: {e}")
+            metrics[name] = None
+    return metrics
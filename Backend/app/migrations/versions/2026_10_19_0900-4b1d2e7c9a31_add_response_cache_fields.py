@@ -0,0 +1,29 @@
+"""add response cache fields
+
+Revision ID: 4b1d2e7c9a31
+Revises: refactor_user_model
+Create Date: 2026-10-19 09:00:00.000000+02:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b1d2e7c9a31'
+down_revision = 'refactor_user_model'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Per-class cache settings
+    op.add_column('classes', sa.Column('response_cache_enabled', sa.Boolean(), server_default='true', nullable=False))
+    op.add_column('classes', sa.Column('response_cache_ttl_seconds', sa.Integer(), nullable=True))
+    
+    # Flag cached AI answers
+    op.add_column('chat_messages', sa.Column('is_cached', sa.Boolean(), server_default='false', nullable=False))
+
+def downgrade():
+    op.drop_column('chat_messages', 'is_cached')
+    op.drop_column('classes', 'response_cache_ttl_seconds')
+    op.drop_column('classes', 'response_cache_enabled')
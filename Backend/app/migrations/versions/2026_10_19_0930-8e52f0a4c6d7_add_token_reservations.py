@@ -0,0 +1,24 @@
+"""add token reservations to usage trackers
+
+Revision ID: 8e52f0a4c6d7
+Revises: 4b1d2e7c9a31
+Create Date: 2026-10-19 09:30:00.000000+02:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e52f0a4c6d7'
+down_revision = '4b1d2e7c9a31'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('class_usage_trackers', sa.Column('reserved_tokens', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('class_usage_trackers', sa.Column('reserved_until', sa.DateTime(), nullable=True))
+
+def downgrade():
+    op.drop_column('class_usage_trackers', 'reserved_until')
+    op.drop_column('class_usage_trackers', 'reserved_tokens')
@@ -0,0 +1,22 @@
+"""add class max model tier
+
+Revision ID: c3a9d5e1f802
+Revises: 8e52f0a4c6d7
+Create Date: 2026-10-19 10:00:00.000000+02:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3a9d5e1f802'
+down_revision = '8e52f0a4c6d7'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('classes', sa.Column('max_model_tier', sa.Integer(), nullable=True))
+
+def downgrade():
+    op.drop_column('classes', 'max_model_tier')
@@ -0,0 +1,71 @@
+"""add usage rollup tables and usage_records.class_id
+
+Revision ID: 5f7c1b9e2d44
+Revises: c3a9d5e1f802
+Create Date: 2026-10-19 11:00:00.000000+02:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f7c1b9e2d44'
+down_revision = 'c3a9d5e1f802'
+branch_labels = None
+depends_on = None
+
+def _create_rollup_table(name, unique_name):
+    op.create_table(
+        name,
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('bucket_start', sa.DateTime(), nullable=False),
+        sa.Column('class_id', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('model_name', sa.String(), nullable=False),
+        sa.Column('is_sponsored', sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.Column('request_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('input_tokens', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('output_tokens', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('cost', sa.Float(), nullable=False, server_default='0'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('bucket_start', 'class_id', 'user_id', 'model_name', 'is_sponsored', name=unique_name)
+    )
+    op.create_index(op.f(f'ix_{name}_id'), name, ['id'], unique=False)
+    op.create_index(op.f(f'ix_{name}_bucket_start'), name, ['bucket_start'], unique=False)
+
+def upgrade():
+    op.add_column('usage_records', sa.Column('class_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('fk_usage_records_class_id', 'usage_records', 'classes', ['class_id'], ['id'])
+    op.create_index(op.f('ix_usage_records_class_id'), 'usage_records', ['class_id'], unique=False)
+    
+    # Attribute existing chat usage to its session's class
+    op.execute(
+        "UPDATE usage_records SET class_id = "
+        "(SELECT chat_sessions.class_id FROM chat_sessions WHERE chat_sessions.id = usage_records.session_id) "
+        "WHERE session_id IS NOT NULL"
+    )
+    
+    _create_rollup_table('usage_hourly_rollups', '_usage_hourly_bucket_uc')
+    _create_rollup_table('usage_daily_rollups', '_usage_daily_bucket_uc')
+    
+    # Watermark starts at 0, so the first compaction backfills all history
+    op.create_table(
+        'usage_rollup_state',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('last_record_id', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('last_record_timestamp', sa.DateTime(), nullable=True),
+        sa.Column('compacted_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+def downgrade():
+    op.drop_table('usage_rollup_state')
+    for name in ('usage_daily_rollups', 'usage_hourly_rollups'):
+        op.drop_index(op.f(f'ix_{name}_bucket_start'), table_name=name)
+        op.drop_index(op.f(f'ix_{name}_id'), table_name=name)
+        op.drop_table(name)
+    op.drop_index(op.f('ix_usage_records_class_id'), table_name='usage_records')
+    op.drop_constraint('fk_usage_records_class_id', 'usage_records', type_='foreignkey')
+    op.drop_column('usage_records', 'class_id')
@@ -0,0 +1,22 @@
+"""add user token version
+
+Revision ID: 9a6e3c1d7b25
+Revises: 5f7c1b9e2d44
+Create Date: 2026-10-19 12:00:00.000000+02:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a6e3c1d7b25'
+down_revision = '5f7c1b9e2d44'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('users', sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+
+def downgrade():
+    op.drop_column('users', 'token_version')
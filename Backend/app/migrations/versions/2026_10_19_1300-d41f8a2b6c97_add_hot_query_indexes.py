@@ -0,0 +1,45 @@
+"""add composite and partial indexes for hot queries
+
+Revision ID: d41f8a2b6c97
+Revises: 9a6e3c1d7b25
+Create Date: 2026-10-19 13:00:00.000000+02:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41f8a2b6c97'
+down_revision = '9a6e3c1d7b25'
+branch_labels = None
+depends_on = None
+
+# (name, table, columns, partial index predicate for postgres, for sqlite)
+INDEXES = [
+    ('ix_chat_messages_session_timestamp', 'chat_messages', ['session_id', 'timestamp', 'id'], None, None),
+    ('ix_chat_sessions_user_updated_active', 'chat_sessions', ['user_id', 'updated_at'], 'is_active', 'is_active = 1'),
+    ('ix_chat_sessions_user_class_active', 'chat_sessions', ['user_id', 'class_id'], 'is_active', 'is_active = 1'),
+    ('ix_documents_class_scope_status', 'documents', ['class_id', 'scope', 'processing_status'], None, None),
+    ('ix_documents_session_scope', 'documents', ['session_id', 'scope'], 'session_id IS NOT NULL', 'session_id IS NOT NULL'),
+    ('ix_document_chunks_document_chunk_index', 'document_chunks', ['document_id', 'chunk_index'], None, None),
+    ('ix_usage_records_billed_to_timestamp', 'usage_records', ['billed_to_user_id', 'timestamp'], None, None),
+]
+
+def upgrade():
+    # CONCURRENTLY keeps the tables writable while building on Postgres,
+    # which can't run inside the migration transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns, postgresql_where, sqlite_where in INDEXES:
+            op.create_index(
+                name, table, columns,
+                postgresql_where=sa.text(postgresql_where) if postgresql_where else None,
+                sqlite_where=sa.text(sqlite_where) if sqlite_where else None,
+                postgresql_concurrently=True,
+                if_not_exists=True
+            )
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, *_ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
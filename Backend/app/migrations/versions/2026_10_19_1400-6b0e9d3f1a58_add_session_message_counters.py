@@ -0,0 +1,31 @@
+"""add chat session message counters
+
+Revision ID: 6b0e9d3f1a58
+Revises: d41f8a2b6c97
+Create Date: 2026-10-19 14:00:00.000000+02:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6b0e9d3f1a58'
+down_revision = 'd41f8a2b6c97'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('chat_sessions', sa.Column('message_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('chat_sessions', sa.Column('last_message_at', sa.DateTime(), nullable=True))
+    
+    # Backfill from existing messages
+    op.execute("""
+        UPDATE chat_sessions SET
+            message_count = (SELECT COUNT(*) FROM chat_messages WHERE chat_messages.session_id = chat_sessions.id),
+            last_message_at = (SELECT MAX(timestamp) FROM chat_messages WHERE chat_messages.session_id = chat_sessions.id)
+    """)
+
+def downgrade():
+    op.drop_column('chat_sessions', 'last_message_at')
+    op.drop_column('chat_sessions', 'message_count')
@@ -0,0 +1,26 @@
+"""add class_memberships.class_id index
+
+Revision ID: a7c2e4f9b013
+Revises: 6b0e9d3f1a58
+Create Date: 2026-10-19 15:00:00.000000+02:00
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c2e4f9b013'
+down_revision = '6b0e9d3f1a58'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Member counts and member lists look memberships up by class
+    with op.get_context().autocommit_block():
+        op.create_index('ix_class_memberships_class_id', 'class_memberships', ['class_id'],
+                        postgresql_concurrently=True, if_not_exists=True)
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_class_memberships_class_id', table_name='class_memberships',
+                      postgresql_concurrently=True, if_exists=True)
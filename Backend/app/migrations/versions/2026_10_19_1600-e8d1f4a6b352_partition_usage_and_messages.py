@@ -0,0 +1,112 @@
+"""partition usage_records and chat_messages by month
+
+Revision ID: e8d1f4a6b352
+Revises: a7c2e4f9b013
+Create Date: 2026-10-19 16:00:00.000000+02:00
+
+Postgres only: each table is rebuilt as a range-partitioned table on
+"timestamp" with one partition per month (from the oldest row to a few
+months ahead) plus a default partition, and its rows are copied across.
+Each table is locked ACCESS EXCLUSIVE before the rename and stays locked
+until the migration commits, so run it in a maintenance window on large
+installs. PartitionService creates later months and
+applies retention. Other databases keep plain tables.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from datetime import datetime
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8d1f4a6b352'
+down_revision = 'a7c2e4f9b013'
+branch_labels = None
+depends_on = None
+
+PREMAKE_MONTHS = 3
+
+# table -> (indexes as (name, columns), foreign keys as (column, referenced table))
+TABLES = {
+    'usage_records': (
+        [('ix_usage_records_id', 'id'),
+         ('ix_usage_records_class_id', 'class_id'),
+         ('ix_usage_records_billed_to_timestamp', 'billed_to_user_id, "timestamp"')],
+        [('user_id', 'users'), ('session_id', 'chat_sessions'),
+         ('class_id', 'classes'), ('billed_to_user_id', 'users')],
+    ),
+    'chat_messages': (
+        [('ix_chat_messages_id', 'id'),
+         ('ix_chat_messages_session_timestamp', 'session_id, "timestamp", id')],
+        [('session_id', 'chat_sessions')],
+    ),
+}
+
+def _add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def _rebuild(table, partitioned):
+    """Recreate `table` (partitioned by month or plain) with its rows, indexes and keys"""
+    conn = op.get_bind()
+    indexes, foreign_keys = TABLES[table]
+    old = f'{table}_old'
+    sequence = conn.execute(sa.text(f"SELECT pg_get_serial_sequence('{table}', 'id')")).scalar()
+
+    # Nothing may read or write the table between the rename and the copy
+    op.execute(f'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE')
+    columns = ', '.join(f'"{name}"' for name in conn.execute(sa.text(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = :table ORDER BY ordinal_position"
+    ), {'table': table}).scalars())
+    op.execute(f'ALTER TABLE {table} RENAME TO {old}')
+    if sequence:
+        # Keep the id sequence alive when the old table is dropped
+        op.execute(f'ALTER SEQUENCE {sequence} OWNED BY NONE')
+    op.execute(f'UPDATE {old} SET "timestamp" = now() AT TIME ZONE \'utc\' WHERE "timestamp" IS NULL')
+
+    if partitioned:
+        op.execute(f'CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE ("timestamp")')
+        op.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+        oldest = conn.execute(sa.text(f'SELECT min("timestamp") FROM {old}')).scalar()
+        now = datetime.utcnow()
+        month = datetime((oldest or now).year, (oldest or now).month, 1)
+        last = _add_months(datetime(now.year, now.month, 1), PREMAKE_MONTHS)
+        while month <= last:
+            op.execute(
+                f"CREATE TABLE {table}_p{month:%Y%m} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{_add_months(month, 1):%Y-%m-%d}')"
+            )
+            month = _add_months(month, 1)
+    else:
+        op.execute(f'CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS)')
+
+    op.execute(f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {old}')
+    op.execute(f'DROP TABLE {old}')
+
+    op.execute(f'ALTER TABLE {table} ALTER COLUMN "timestamp" SET NOT NULL')
+    # A partitioned table's primary key has to include the partition key
+    primary_key = 'id, "timestamp"' if partitioned else 'id'
+    op.execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY ({primary_key})')
+    if sequence:
+        op.execute(f'ALTER SEQUENCE {sequence} OWNED BY {table}.id')
+    for name, columns in indexes:
+        op.execute(f'CREATE INDEX {name} ON {table} ({columns})')
+    for column, referenced in foreign_keys:
+        op.execute(
+            f'ALTER TABLE {table} ADD CONSTRAINT {table}_{column}_fkey '
+            f'FOREIGN KEY ({column}) REFERENCES {referenced} (id)'
+        )
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in TABLES:
+        _rebuild(table, partitioned=True)
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in TABLES:
+        # Detached partitions (retention) are not brought back
+        _rebuild(table, partitioned=False)
@@ -0,0 +1,25 @@
+"""add chat session cold-storage archive fields
+
+Revision ID: b5c9e2d7f184
+Revises: e8d1f4a6b352
+Create Date: 2026-10-19 17:00:00.000000+02:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5c9e2d7f184'
+down_revision = 'e8d1f4a6b352'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('chat_sessions', sa.Column('archived_at', sa.DateTime(), nullable=True))
+    op.add_column('chat_sessions', sa.Column('archive_key', sa.String(), nullable=True))
+
+def downgrade():
+    # Rehydrate archived sessions first; their messages only exist in the blobs
+    op.drop_column('chat_sessions', 'archive_key')
+    op.drop_column('chat_sessions', 'archived_at')
@@ -0,0 +1,27 @@
+"""add usage_flushed_segments for the write-behind usage journal
+
+Revision ID: d4a8b1e6c920
+Revises: b5c9e2d7f184
+Create Date: 2026-10-20 10:00:00.000000+02:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a8b1e6c920'
+down_revision = 'b5c9e2d7f184'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'usage_flushed_segments',
+        sa.Column('segment_id', sa.String(), nullable=False),
+        sa.Column('flushed_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('segment_id')
+    )
+
+def downgrade():
+    op.drop_table('usage_flushed_segments')
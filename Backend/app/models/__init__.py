@@ -1,8 +1,9 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Float, Boolean, Date, UniqueConstraint
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Float, Boolean, Date, UniqueConstraint, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from datetime import datetime, date
+from datetime import datetime
 import enum
+from app.utils.timezones import quota_today
 from sqlalchemy import Enum
 
 Base = declarative_base()
@@ -31,6 +32,8 @@ class User(Base):
     hashed_password = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     is_active = Column(Boolean, default=True)
+    # Bumped to revoke every access token issued so far (tokens carry it as "ver")
+    token_version = Column(Integer, default=0, server_default='0', nullable=False)
     
     # Firebase authentication fields
     firebase_uid = Column(String, unique=True, nullable=True, index=True)
@@ -54,6 +57,13 @@ class Class(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     is_active = Column(Boolean, default=True)
     
+    # AI response cache settings (managed by class managers)
+    response_cache_enabled = Column(Boolean, default=True)
+    response_cache_ttl_seconds = Column(Integer, nullable=True)  # None = global default
+    
+    # Highest model tier (index into OPENAI_MODEL_LADDER) this class may use
+    max_model_tier = Column(Integer, nullable=True)  # None = no cap
+    
     # Relationships
     owner = relationship("User", back_populates="owned_classes")
     memberships = relationship("ClassMembership", back_populates="class_obj")
@@ -89,6 +99,8 @@ class ClassMembership(Base):
     
     __table_args__ = (
         UniqueConstraint('user_id', 'class_id', name='_user_class_membership_uc'),
+        # Per-class lookups (member counts, member lists); the unique key leads with user_id
+        Index('ix_class_memberships_class_id', 'class_id'),
     )
 
 class ClassUsageTracker(Base):
@@ -105,9 +117,13 @@ class ClassUsageTracker(Base):
     monthly_tokens_used = Column(Integer, default=0)
     
     # Reset tracking (Madrid timezone)
-    last_daily_reset = Column(Date, default=date.today)
-    last_weekly_reset = Column(Date, default=date.today)
-    last_monthly_reset = Column(Date, default=date.today)
+    last_daily_reset = Column(Date, default=quota_today)
+    last_weekly_reset = Column(Date, default=quota_today)
+    last_monthly_reset = Column(Date, default=quota_today)
+    
+    # Tokens reserved by in-flight requests (lapse after reserved_until)
+    reserved_tokens = Column(Integer, default=0)
+    reserved_until = Column(DateTime, nullable=True)
     
     __table_args__ = (
         UniqueConstraint('user_id', 'class_id', name='_user_class_usage_uc'),
@@ -137,6 +153,15 @@ class Document(Base):
     class_obj = relationship("Class", back_populates="documents")
     session = relationship("ChatSession", back_populates="documents")
     chunks = relationship("DocumentChunk", back_populates="document")
+    
+    __table_args__ = (
+        # Class library and the class context window of a chat turn
+        Index('ix_documents_class_scope_status', 'class_id', 'scope', 'processing_status'),
+        # Chat-scoped uploads; class documents have no session
+        Index('ix_documents_session_scope', 'session_id', 'scope',
+              postgresql_where=text('session_id IS NOT NULL'),
+              sqlite_where=text('session_id IS NOT NULL')),
+    )
 
 class DocumentChunk(Base):
     __tablename__ = "document_chunks"
@@ -152,6 +177,10 @@ class DocumentChunk(Base):
     
     # Relationships
     document = relationship("Document", back_populates="chunks")
+    
+    __table_args__ = (
+        Index('ix_document_chunks_document_chunk_index', 'document_id', 'chunk_index'),
+    )
 
 class ChatSession(Base):
     __tablename__ = "chat_sessions"
@@ -164,30 +193,59 @@ class ChatSession(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_active = Column(Boolean, default=True)
     
+    # Maintained by ChatService.send_message so listings don't count messages
+    message_count = Column(Integer, default=0, server_default='0', nullable=False)
+    last_message_at = Column(DateTime, nullable=True)
+    
+    # Set while the session's messages live in cold storage (ChatArchiveService)
+    archived_at = Column(DateTime, nullable=True)
+    archive_key = Column(String, nullable=True)
+    
     # Relationships
     user = relationship("User", back_populates="chat_sessions")
     class_obj = relationship("Class", back_populates="chat_sessions")
     documents = relationship("Document", back_populates="session")
     messages = relationship("ChatMessage", back_populates="session")
+    
+    __table_args__ = (
+        # Sidebar: a user's sessions, most recently updated first
+        Index('ix_chat_sessions_user_updated_active', 'user_id', 'updated_at',
+              postgresql_where=text('is_active'), sqlite_where=text('is_active = 1')),
+        # Concurrent chat limit: active sessions per user and class
+        Index('ix_chat_sessions_user_class_active', 'user_id', 'class_id',
+              postgresql_where=text('is_active'), sqlite_where=text('is_active = 1')),
+    )
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
     
+    # On Postgres the table is partitioned by month and its primary key is
+    # (id, "timestamp"), since a partitioned table's key must include the
+    # partition key (partition_usage_and_messages migration). The model keeps
+    # id alone so SQLite still autoincrements it; create_all builds plain
+    # tables and autogenerate doesn't compare primary keys, so they agree.
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(Integer, ForeignKey("chat_sessions.id"))
     content = Column(Text, nullable=False)
     is_user = Column(Boolean, nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False)  # Partition key on Postgres
     response_time_ms = Column(Integer, nullable=True)
     context_used = Column(Text, nullable=True)
     tokens_used = Column(Integer, default=0)
+    is_cached = Column(Boolean, default=False)  # AI answer served from the response cache
     
     # Relationships
     session = relationship("ChatSession", back_populates="messages")
+    
+    __table_args__ = (
+        # Message history in order; id breaks timestamp ties
+        Index('ix_chat_messages_session_timestamp', 'session_id', 'timestamp', 'id'),
+    )
 
 class UsageRecord(Base):
     __tablename__ = "usage_records"
     
+    # Primary key is (id, "timestamp") on Postgres; see ChatMessage.id
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     model_name = Column(String, nullable=False)
@@ -195,8 +253,9 @@ class UsageRecord(Base):
     input_tokens = Column(Integer, default=0)
     output_tokens = Column(Integer, default=0)
     cost = Column(Float, nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, nullable=False)  # Partition key on Postgres
     session_id = Column(Integer, ForeignKey("chat_sessions.id"), nullable=True)
+    class_id = Column(Integer, ForeignKey("classes.id"), nullable=True, index=True)
     
     # Billing attribution
     billed_to_user_id = Column(Integer, ForeignKey("users.id"))
@@ -205,5 +264,59 @@ class UsageRecord(Base):
     
     # Relationships
     user = relationship("User", back_populates="usage_records", foreign_keys=[user_id])
+    
+    __table_args__ = (
+        # Spend billed to a user over a time range (sponsors pay for members)
+        Index('ix_usage_records_billed_to_timestamp', 'billed_to_user_id', 'timestamp'),
+    )
+
+
+
+class UsageRollupMixin:
+    """Usage summed per time bucket and (class, user, model, sponsorship)"""
+    id = Column(Integer, primary_key=True, index=True)
+    bucket_start = Column(DateTime, nullable=False, index=True)  # UTC
+    class_id = Column(Integer, nullable=False, default=0)  # 0 = not attributed to a class (keeps the key non-null)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    model_name = Column(String, nullable=False)
+    is_sponsored = Column(Boolean, nullable=False, default=False)
+    
+    request_count = Column(Integer, nullable=False, default=0)
+    input_tokens = Column(Integer, nullable=False, default=0)
+    output_tokens = Column(Integer, nullable=False, default=0)
+    cost = Column(Float, nullable=False, default=0.0)
+
+class UsageHourlyRollup(UsageRollupMixin, Base):
+    __tablename__ = "usage_hourly_rollups"
+    
+    __table_args__ = (
+        UniqueConstraint('bucket_start', 'class_id', 'user_id', 'model_name', 'is_sponsored',
+                         name='_usage_hourly_bucket_uc'),
+    )
 
+class UsageDailyRollup(UsageRollupMixin, Base):
+    __tablename__ = "usage_daily_rollups"
+    
+    __table_args__ = (
+        UniqueConstraint('bucket_start', 'class_id', 'user_id', 'model_name', 'is_sponsored',
+                         name='_usage_daily_bucket_uc'),
+    )
+
+class UsageRollupState(Base):
+    """Compaction watermark: usage records up to last_record_id are in the rollups"""
+    __tablename__ = "usage_rollup_state"
+    
+    id = Column(Integer, primary_key=True)
+    last_record_id = Column(Integer, nullable=False, default=0)
+    last_record_timestamp = Column(DateTime, nullable=True)
+    compacted_at = Column(DateTime, nullable=True)
 
+class UsageFlushedSegment(Base):
+    """
+    Usage journal segments whose batch is committed; written in the same
+    transaction, so a segment left on disk by a crash isn't replayed twice
+    """
+    __tablename__ = "usage_flushed_segments"
+    
+    segment_id = Column(String, primary_key=True)
+    flushed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
@@ -1,11 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy import tuple_
 from sqlalchemy.orm import Session
-from typing import List
-from app.database import get_db
+from typing import List, Optional
+from app.database import get_db, get_read_db
 from app.schemas import ChatSessionCreate, ChatSessionResponse, MessageCreate, MessageResponse, ChatResponse, UserResponse
-from app.services.permission_service import PermissionService
+from app.services.permission_service import PermissionService, TokenLimitExceeded
 from app.services.chat_service import ChatService
+from app.services.chat_archive_service import ChatArchiveService
+from app.services.admission_control import LLMOverloadedError
 from app.utils.security import get_current_user
+from app.utils.pagination import encode_cursor, decode_cursor
 import logging
 
 router = APIRouter()
@@ -32,7 +36,7 @@ async def create_chat_session(
         chat_service = ChatService()
         session = await chat_service.create_session(db, current_user.id, session_data)
         
-        logger.info(f"Chat session created: {session.title} by {current_user.username}")
+        logger.info(f"Chat session created: {session.title} by user {current_user.id}")
         return session
         
     except HTTPException:
@@ -43,31 +47,48 @@ async def create_chat_session(
 
 @router.get("/sessions", response_model=List[ChatSessionResponse])
 async def get_user_sessions(
+    response: Response,
     current_user: UserResponse = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db),
+    limit: Optional[int] = Query(None, ge=1, le=200),
+    cursor: Optional[str] = None
 ):
-    """Get user's chat sessions"""
+    """
+    Get user's chat sessions, most recently updated first.
+    
+    With `limit`, returns one page and sets X-Next-Cursor when there are
+    more; pass it back as `cursor` for the next page. Without `limit`,
+    returns every session.
+    """
     try:
-        from app.models import ChatSession, ChatMessage
+        from app.models import ChatSession
         
-        sessions = db.query(ChatSession).filter(
+        query = db.query(ChatSession).filter(
             ChatSession.user_id == current_user.id,
             ChatSession.is_active == True
-        ).order_by(ChatSession.updated_at.desc()).all()
+        )
+        
+        if cursor:
+            try:
+                updated_at, session_id = decode_cursor(cursor, 2)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            query = query.filter(tuple_(ChatSession.updated_at, ChatSession.id) < (updated_at, session_id))
         
-        result = []
-        for session in sessions:
-            # Count messages
-            message_count = db.query(ChatMessage).filter(
-                ChatMessage.session_id == session.id
-            ).count()
-            
-            session_response = ChatSessionResponse.model_validate(session)
-            session_response.message_count = message_count
-            result.append(session_response)
+        query = query.order_by(ChatSession.updated_at.desc(), ChatSession.id.desc())
+        if limit is None:
+            sessions = query.all()
+        else:
+            # One extra row tells us whether there is a next page
+            sessions = query.limit(limit + 1).all()
+            if len(sessions) > limit:
+                sessions = sessions[:limit]
+                response.headers["X-Next-Cursor"] = encode_cursor(sessions[-1].updated_at, sessions[-1].id)
         
-        return result
+        return [ChatSessionResponse.model_validate(session) for session in sessions]
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error getting user sessions: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -80,7 +101,7 @@ async def get_session_details(
 ):
     """Get chat session details"""
     try:
-        from app.models import ChatSession, ChatMessage
+        from app.models import ChatSession
         
         session = db.query(ChatSession).filter(
             ChatSession.id == session_id,
@@ -91,15 +112,7 @@ async def get_session_details(
         if not session:
             raise HTTPException(status_code=404, detail="Chat session not found")
         
-        # Count messages
-        message_count = db.query(ChatMessage).filter(
-            ChatMessage.session_id == session.id
-        ).count()
-        
-        result = ChatSessionResponse.model_validate(session)
-        result.message_count = message_count
-        
-        return result
+        return ChatSessionResponse.model_validate(session)
         
     except HTTPException:
         raise
@@ -128,9 +141,18 @@ async def send_message(
         if not session:
             raise HTTPException(status_code=404, detail="Chat session not found")
         
-        # Check permissions
+        # Restore an archived session before writing to it, so the new turn
+        # follows its history and the archive is never left stale
+        if session.archived_at is not None:
+            restored = ChatArchiveService().rehydrate(db, session)
+            logger.info(f"Rehydrated {restored} archived messages for session {session_id}")
+        
+        # Check permissions (the loaded context is reused for billing and quota accounting)
         permission_service = PermissionService()
-        can_chat, reason = await permission_service.can_user_chat(db, current_user.id, session.class_id)
+        auth_context = await permission_service.get_chat_context(db, current_user.id, session.class_id)
+        can_chat, reason = await permission_service.can_user_chat(
+            db, current_user.id, session.class_id, auth_context
+        )
         if not can_chat:
             if "limit reached" in reason.lower():
                 raise HTTPException(status_code=429, detail=reason)
@@ -139,13 +161,24 @@ async def send_message(
         
         # Send message and get AI response
         chat_service = ChatService()
-        chat_response = await chat_service.send_message(db, session, message_data.content, current_user.id)
+        chat_response = await chat_service.send_message(
+            db, session, message_data.content, current_user.id, auth_context
+        )
         
-        logger.info(f"Message sent in session {session_id} by {current_user.username}")
+        logger.info(f"Message sent in session {session_id} by user {current_user.id}")
         return chat_response
         
     except HTTPException:
         raise
+    except TokenLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except LLMOverloadedError as e:
+        logger.warning(f"AI service overloaded for session {session_id}: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="AI service is busy. Please try again shortly.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         logger.error(f"Error sending message: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -153,12 +186,24 @@ async def send_message(
 @router.get("/sessions/{session_id}/messages", response_model=List[MessageResponse])
 async def get_session_messages(
     session_id: int,
+    response: Response,
     current_user: UserResponse = Depends(get_current_user),
-    db: Session = Depends(get_db),
-    limit: int = 50,
-    offset: int = 0
+    db: Session = Depends(get_read_db),
+    primary_db: Session = Depends(get_db),
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    offset: Optional[int] = Query(None, ge=0)
 ):
-    """Get messages from a chat session"""
+    """
+    Get messages from a chat session, oldest first within the page.
+    
+    Without parameters returns the newest `limit` messages. Page towards
+    older messages with the X-Before-Cursor header as `before`, towards newer
+    ones with X-After-Cursor as `after`; each header is only set if there are
+    messages in that direction. `offset` keeps the old behaviour (from the
+    first message) for existing clients.
+    """
     try:
         from app.models import ChatSession, ChatMessage
         
@@ -171,10 +216,37 @@ async def get_session_messages(
         if not session:
             raise HTTPException(status_code=404, detail="Chat session not found")
         
-        # Get messages
-        messages = db.query(ChatMessage).filter(
-            ChatMessage.session_id == session_id
-        ).order_by(ChatMessage.timestamp.asc()).offset(offset).limit(limit).all()
+        # Idle sessions may have been moved to cold storage; bring them back on
+        # open. That's a write, so it happens on the primary, and the restored
+        # messages are read from there too: the replica won't have them yet.
+        if session.archived_at is not None:
+            db = primary_db
+            session = db.query(ChatSession).filter(ChatSession.id == session_id).first()
+            restored = ChatArchiveService().rehydrate(db, session)
+            logger.info(f"Rehydrated {restored} archived messages for session {session_id}")
+        
+        if offset is not None and before is None and after is None:
+            messages = db.query(ChatMessage).filter(
+                ChatMessage.session_id == session_id
+            ).order_by(ChatMessage.timestamp.asc(), ChatMessage.id.asc()).offset(offset).limit(limit).all()
+            return [MessageResponse.model_validate(msg) for msg in messages]
+        
+        if before is not None and after is not None:
+            raise HTTPException(status_code=400, detail="Use either before or after, not both")
+        try:
+            before_key = tuple(decode_cursor(before, 2)) if before else None
+            after_key = tuple(decode_cursor(after, 2)) if after else None
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        chat_service = ChatService()
+        messages, before_cursor, after_cursor = chat_service.get_messages_page(
+            db, session_id, limit, before=before_key, after=after_key
+        )
+        if before_cursor:
+            response.headers["X-Before-Cursor"] = before_cursor
+        if after_cursor:
+            response.headers["X-After-Cursor"] = after_cursor
         
         return [MessageResponse.model_validate(msg) for msg in messages]
         
@@ -183,4 +255,3 @@ async def get_session_messages(
     except Exception as e:
         logger.error(f"Error getting session messages: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
-
@@ -1,9 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
 from typing import List
 from app.database import get_db
-from app.schemas import ClassCreate, ClassResponse, JoinClassRequest, UserResponse
+from app.schemas import ClassCreate, ClassResponse, JoinClassRequest, ClassSettingsUpdate, UserResponse
 from app.services.permission_service import PermissionService
+from app.services.response_cache import get_response_cache
+from app.services.model_router import get_model_router
+from app.services.membership_cache import invalidate_membership, invalidate_class_memberships
 from app.utils.security import get_current_user
 import logging
 import string
@@ -16,6 +20,24 @@ def generate_class_code() -> str:
     """Generate a unique 8-character class code"""
     return ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(8))
 
+def member_count_column():
+    """Member count of the Class row in the same query (correlated subquery)"""
+    from app.models import Class, ClassMembership
+    return select(func.count(ClassMembership.id)).where(
+        ClassMembership.class_id == Class.id
+    ).correlate(Class).scalar_subquery().label("member_count")
+
+def load_class_with_member_count(db: Session, class_id: int):
+    """(class, member_count) in one query; (None, 0) if the class doesn't exist"""
+    from app.models import Class
+    row = db.query(Class, member_count_column()).filter(Class.id == class_id).first()
+    return (row[0], row[1]) if row else (None, 0)
+
+def class_response(class_obj, member_count: int) -> ClassResponse:
+    result = ClassResponse.model_validate(class_obj)
+    result.member_count = member_count
+    return result
+
 @router.post("/", response_model=ClassResponse, status_code=status.HTTP_201_CREATED)
 async def create_class(
     class_data: ClassCreate,
@@ -55,13 +77,10 @@ async def create_class(
         db.add(owner_membership)
         db.commit()
         db.refresh(new_class)
+        invalidate_membership(current_user.id, new_class.id)
         
-        # Add member count
-        result = ClassResponse.model_validate(new_class)
-        result.member_count = 1
-        
-        logger.info(f"Class created: {new_class.name} by {current_user.username}")
-        return result
+        logger.info(f"Class created: {new_class.name} by user {current_user.id}")
+        return class_response(new_class, 1)
         
     except Exception as e:
         logger.error(f"Error creating class: {e}")
@@ -77,25 +96,15 @@ async def get_user_classes(
     try:
         from app.models import Class, ClassMembership
         
-        # Get classes where user is a member
-        memberships = db.query(ClassMembership).filter(
-            ClassMembership.user_id == current_user.id
-        ).all()
-        
-        classes = []
-        for membership in memberships:
-            class_obj = membership.class_obj
-            if class_obj.is_active:
-                # Count members
-                member_count = db.query(ClassMembership).filter(
-                    ClassMembership.class_id == class_obj.id
-                ).count()
-                
-                result = ClassResponse.model_validate(class_obj)
-                result.member_count = member_count
-                classes.append(result)
-        
-        return classes
+        # Active classes the user belongs to, with member counts, in one query
+        rows = db.query(Class, member_count_column()).join(
+            ClassMembership, ClassMembership.class_id == Class.id
+        ).filter(
+            ClassMembership.user_id == current_user.id,
+            Class.is_active == True
+        ).order_by(ClassMembership.id).all()
+        
+        return [class_response(class_obj, member_count) for class_obj, member_count in rows]
         
     except Exception as e:
         logger.error(f"Error getting user classes: {e}")
@@ -142,17 +151,13 @@ async def join_class(
         )
         db.add(membership)
         db.commit()
+        invalidate_membership(current_user.id, membership.class_id)
         
-        # Get member count
-        member_count = db.query(ClassMembership).filter(
-            ClassMembership.class_id == class_obj.id
-        ).count()
-        
-        result = ClassResponse.model_validate(class_obj)
-        result.member_count = member_count
+        # Reload the class (expired by the commit) together with its member count
+        class_obj, member_count = load_class_with_member_count(db, membership.class_id)
         
-        logger.info(f"User {current_user.username} joined class {class_obj.name}")
-        return result
+        logger.info(f"User {current_user.id} joined class {class_obj.name}")
+        return class_response(class_obj, member_count)
         
     except HTTPException:
         raise
@@ -176,25 +181,65 @@ async def get_class_details(
         if not membership:
             raise HTTPException(status_code=403, detail="Access denied")
         
-        class_obj = membership.class_obj
-        if not class_obj.is_active:
+        class_obj, member_count = load_class_with_member_count(db, class_id)
+        if not class_obj or not class_obj.is_active:
             raise HTTPException(status_code=404, detail="Class not found")
         
-        # Get member count
-        from app.models import ClassMembership
-        member_count = db.query(ClassMembership).filter(
-            ClassMembership.class_id == class_id
-        ).count()
+        return class_response(class_obj, member_count)
         
-        result = ClassResponse.model_validate(class_obj)
-        result.member_count = member_count
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting class details: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.put("/{class_id}/settings", response_model=ClassResponse)
+async def update_class_settings(
+    class_id: int,
+    settings_update: ClassSettingsUpdate,
+    current_user: UserResponse = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Update class-level settings such as the AI response cache and model tier cap (managers only)"""
+    try:
+        permission_service = PermissionService()
+        
+        # Check if current user is manager of this class
+        membership = await permission_service.get_user_membership(db, current_user.id, class_id)
+        if not membership or not membership.is_manager:
+            raise HTTPException(status_code=403, detail="Only class managers can update class settings")
+        
+        from app.models import Class
+        class_obj = db.query(Class).filter(Class.id == class_id).first()
+        if not class_obj or not class_obj.is_active:
+            raise HTTPException(status_code=404, detail="Class not found")
+        
+        update_data = settings_update.model_dump(exclude_unset=True)
+        if update_data.get("response_cache_ttl_seconds") is not None and update_data["response_cache_ttl_seconds"] <= 0:
+            raise HTTPException(status_code=400, detail="Cache TTL must be positive")
         
-        return result
+        max_tier = update_data.get("max_model_tier")
+        if max_tier is not None and not 0 <= max_tier <= get_model_router().top_tier:
+            raise HTTPException(status_code=400, detail=f"Model tier must be between 0 and {get_model_router().top_tier}")
+        
+        for field, value in update_data.items():
+            setattr(class_obj, field, value)
+        
+        db.commit()
+        
+        # Drop cached answers so the new settings apply immediately
+        get_response_cache().invalidate_class(class_id)
+        
+        class_obj, member_count = load_class_with_member_count(db, class_id)
+        
+        logger.info(f"Class settings updated for class {class_id} by user {current_user.id}")
+        return class_response(class_obj, member_count)
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error getting class details: {e}")
+        logger.error(f"Error updating class settings: {e}")
+        db.rollback()
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @router.delete("/{class_id}")
@@ -218,8 +263,9 @@ async def delete_class(
         # Soft delete
         class_obj.is_active = False
         db.commit()
+        invalidate_class_memberships(class_id)
         
-        logger.info(f"Class deleted: {class_obj.name} by {current_user.username}")
+        logger.info(f"Class deleted: {class_obj.name} by user {current_user.id}")
         return {"message": "Class successfully deleted"}
         
     except HTTPException:
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
 from sqlalchemy.orm import Session
 from typing import List
-from app.database import get_db
+from app.database import get_db, get_read_db
 from app.schemas import DocumentResponse, UserResponse
 from app.services.permission_service import PermissionService
 from app.services.document_service import DocumentService
@@ -38,7 +38,7 @@ async def upload_class_document(
             db, file, class_id, current_user.id
         )
         
-        logger.info(f"Class document uploaded: {document.original_filename} by {current_user.username}")
+        logger.info(f"Class document uploaded: {document.original_filename} by user {current_user.id}")
         return document
         
     except HTTPException:
@@ -80,7 +80,7 @@ async def upload_session_document(
             db, file, session_id, session.class_id, current_user.id
         )
         
-        logger.info(f"Session document uploaded: {document.original_filename} by {current_user.username}")
+        logger.info(f"Session document uploaded: {document.original_filename} by user {current_user.id}")
         return document
         
     except HTTPException:
@@ -93,7 +93,7 @@ async def upload_session_document(
 async def get_class_documents(
     class_id: int,
     current_user: UserResponse = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get all documents uploaded to a class"""
     try:
@@ -127,7 +127,7 @@ async def get_class_documents(
 async def get_session_documents(
     session_id: int,
     current_user: UserResponse = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get all documents uploaded to a specific chat session"""
     try:
@@ -190,7 +190,7 @@ async def delete_document(
         document_service = DocumentService()
         await document_service.delete_document(db, document_id)
         
-        logger.info(f"Document deleted: {document.original_filename} by {current_user.username}")
+        logger.info(f"Document deleted: {document.original_filename} by user {current_user.id}")
         return {"message": "Document deleted successfully"}
         
     except HTTPException:
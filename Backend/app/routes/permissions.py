@@ -1,20 +1,45 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from sqlalchemy.orm import Session, joinedload
 from typing import List
-from app.database import get_db
-from app.schemas import MembershipResponse, PermissionUpdate, SponsorshipUpdate, UserResponse
+from app.database import get_db, get_read_db
+from app.schemas import (
+    MembershipResponse, PermissionUpdate, SponsorshipUpdate, UserResponse,
+    BulkPermissionUpdate, BulkUpdateResult, BulkEnrollmentResult
+)
 from app.services.permission_service import PermissionService
+from app.services.membership_admin_service import MembershipAdminService
+from app.services.membership_cache import invalidate_membership, invalidate_class_memberships
 from app.utils.security import get_current_user
 import logging
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+def member_response(membership) -> MembershipResponse:
+    """MembershipResponse for a membership loaded with its user"""
+    user = membership.user
+    return MembershipResponse(
+        id=membership.id,
+        user_id=membership.user_id,
+        user_display_name=user.alias or f"{user.name} {user.surname}",
+        joined_at=membership.joined_at,
+        is_manager=membership.is_manager,
+        can_read=membership.can_read,
+        can_chat=membership.can_chat,
+        max_concurrent_chats=membership.max_concurrent_chats,
+        can_share_class=membership.can_share_class,
+        can_upload_documents=membership.can_upload_documents,
+        is_sponsored=membership.is_sponsored,
+        daily_token_limit=membership.daily_token_limit,
+        weekly_token_limit=membership.weekly_token_limit,
+        monthly_token_limit=membership.monthly_token_limit
+    )
+
 @router.get("/{class_id}/members", response_model=List[MembershipResponse])
 async def get_class_members(
     class_id: int,
     current_user: UserResponse = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Get all members of a class (managers only)"""
     try:
@@ -25,33 +50,16 @@ async def get_class_members(
         if not user_membership or not user_membership.is_manager:
             raise HTTPException(status_code=403, detail="Only class managers can view members")
         
-        from app.models import ClassMembership, User
+        from app.models import ClassMembership
         
-        # Get all memberships with user details
-        memberships = db.query(ClassMembership).join(User).filter(
+        # Users come in the same query rather than one lazy load per member
+        memberships = db.query(ClassMembership).options(
+            joinedload(ClassMembership.user, innerjoin=True)
+        ).filter(
             ClassMembership.class_id == class_id
-        ).all()
-        
-        result = []
-        for membership in memberships:
-            member_data = MembershipResponse(
-                id=membership.id,
-                user_id=membership.user_id,
-                username=membership.user.username,
-                full_name=membership.user.full_name,
-                joined_at=membership.joined_at,
-                is_manager=membership.is_manager,
-                can_read=membership.can_read,
-                can_chat=membership.can_chat,
-                max_concurrent_chats=membership.max_concurrent_chats,
-                can_share_class=membership.can_share_class,
-                can_upload_documents=membership.can_upload_documents,
-                is_sponsored=membership.is_sponsored,
-                daily_token_limit=membership.daily_token_limit,
-                weekly_token_limit=membership.weekly_token_limit,
-                monthly_token_limit=membership.monthly_token_limit
-            )
-            result.append(member_data)
+        ).order_by(ClassMembership.id).all()
+        
+        result = [member_response(membership) for membership in memberships]
         
         return result
         
@@ -98,27 +106,15 @@ async def update_member_permissions(
             if hasattr(target_membership, field):
                 setattr(target_membership, field, value)
         
+        membership_id = target_membership.id
         db.commit()
-        db.refresh(target_membership)
-        
-        # Return updated membership
-        result = MembershipResponse(
-            id=target_membership.id,
-            user_id=target_membership.user_id,
-            username=target_membership.user.username,
-            full_name=target_membership.user.full_name,
-            joined_at=target_membership.joined_at,
-            is_manager=target_membership.is_manager,
-            can_read=target_membership.can_read,
-            can_chat=target_membership.can_chat,
-            max_concurrent_chats=target_membership.max_concurrent_chats,
-            can_share_class=target_membership.can_share_class,
-            can_upload_documents=target_membership.can_upload_documents,
-            is_sponsored=target_membership.is_sponsored,
-            daily_token_limit=target_membership.daily_token_limit,
-            weekly_token_limit=target_membership.weekly_token_limit,
-            monthly_token_limit=target_membership.monthly_token_limit
-        )
+        invalidate_membership(user_id, class_id)
+        
+        # Commit expired the membership; reload it with its user in one query
+        target_membership = db.query(ClassMembership).options(
+            joinedload(ClassMembership.user, innerjoin=True)
+        ).filter(ClassMembership.id == membership_id).one()
+        result = member_response(target_membership)
         
         logger.info(f"Member permissions updated for user {user_id} in class {class_id}")
         return result
@@ -157,6 +153,7 @@ async def update_class_sponsorship(
         })
         
         db.commit()
+        invalidate_class_memberships(class_id)
         
         action = "enabled" if sponsorship_update.is_sponsored else "disabled"
         logger.info(f"Class sponsorship {action} for class {class_id}")
@@ -169,3 +166,65 @@ async def update_class_sponsorship(
         db.rollback()
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@router.post("/{class_id}/members/bulk-update", response_model=BulkUpdateResult)
+async def bulk_update_members(
+    class_id: int,
+    bulk_update: BulkPermissionUpdate,
+    current_user: UserResponse = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Apply one permission or limit change to many members at once (managers only)"""
+    try:
+        permission_service = PermissionService()
+
+        user_membership = await permission_service.get_user_membership(db, current_user.id, class_id)
+        if not user_membership or not user_membership.is_manager:
+            raise HTTPException(status_code=403, detail="Only class managers can update permissions")
+
+        result = await MembershipAdminService().bulk_update(
+            db, class_id, bulk_update.members, bulk_update.changes.model_dump(exclude_unset=True)
+        )
+
+        logger.info(f"Bulk updated {result.updated} memberships in class {class_id}: {', '.join(result.fields)}")
+        return result
+
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error bulk updating members: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.post("/{class_id}/members/import", response_model=BulkEnrollmentResult)
+async def import_members(
+    class_id: int,
+    file: UploadFile = File(...),
+    current_user: UserResponse = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Enrol existing users from a CSV of emails (managers only)"""
+    try:
+        permission_service = PermissionService()
+
+        user_membership = await permission_service.get_user_membership(db, current_user.id, class_id)
+        if not user_membership or not user_membership.is_manager:
+            raise HTTPException(status_code=403, detail="Only class managers can enrol members")
+
+        try:
+            content = (await file.read()).decode("utf-8-sig")
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="CSV must be UTF-8 encoded")
+
+        result = await MembershipAdminService().enroll_emails(db, class_id, content)
+
+        logger.info(f"Imported {result.enrolled} members into class {class_id}")
+        return result
+
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error importing members: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
@@ -1,16 +1,56 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from typing import List
-from app.database import get_db
-from app.schemas import UsageStats, ClassUsageOverview, UsageRecord, UserResponse
+from typing import List, Optional
+from datetime import datetime, timedelta, timezone
+from app.database import get_db, get_read_db
+from app.schemas import UsageStats, ClassUsageOverview, UsageRecord, UserResponse, UsageBucket, UsageHistory
 from app.services.usage_service import UsageService
+from app.services.usage_rollup_service import UsageRollupService, GRANULARITIES, MAX_RANGE, hour_bucket, day_bucket
 from app.services.permission_service import PermissionService
+from app.services.membership_cache import invalidate_membership
 from app.utils.security import get_current_user
 import logging
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Range shown when the caller doesn't pass one
+DEFAULT_RANGE = {
+    "hour": timedelta(hours=48),
+    "day": timedelta(days=30),
+}
+
+def resolve_history_range(granularity: str, start: Optional[datetime], end: Optional[datetime]):
+    """Validate a history request and fill in the default range (UTC)"""
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"Granularity must be one of: {', '.join(GRANULARITIES)}")
+    
+    # Rollup buckets are naive UTC; accept offset-aware input
+    start, end = [
+        value.astimezone(timezone.utc).replace(tzinfo=None) if value and value.tzinfo else value
+        for value in (start, end)
+    ]
+    end = end or datetime.utcnow()
+    start = start or end - DEFAULT_RANGE[granularity]
+    if start >= end:
+        raise HTTPException(status_code=400, detail="Start must be before end")
+    if end - start > MAX_RANGE[granularity]:
+        raise HTTPException(status_code=400, detail=f"Range too long for {granularity} granularity")
+    
+    # Include the bucket the start falls in
+    start = hour_bucket(start) if granularity == "hour" else day_bucket(start)
+    return start, end
+
+def build_history(db: Session, granularity: str, start: datetime, end: datetime,
+                  class_id: Optional[int] = None, user_id: Optional[int] = None) -> UsageHistory:
+    rows = UsageRollupService().get_history(db, granularity, start, end, class_id=class_id, user_id=user_id)
+    return UsageHistory(
+        granularity=granularity,
+        start=start,
+        end=end,
+        buckets=[UsageBucket.model_validate(row) for row in rows]
+    )
+
 @router.get("/my-usage", response_model=List[UsageStats])
 async def get_my_usage(
     current_user: UserResponse = Depends(get_current_user),
@@ -26,13 +66,67 @@ async def get_my_usage(
         logger.error(f"Error getting user usage: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@router.get("/my-usage/history", response_model=UsageHistory)
+async def get_my_usage_history(
+    granularity: str = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    class_id: Optional[int] = None,
+    current_user: UserResponse = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    """Get current user's token usage per hour or day, from the usage rollups"""
+    try:
+        start, end = resolve_history_range(granularity, start, end)
+        return build_history(db, granularity, start, end, class_id=class_id, user_id=current_user.id)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting user usage history: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@router.get("/classes/{class_id}/history", response_model=UsageHistory)
+async def get_class_usage_history(
+    class_id: int,
+    granularity: str = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    user_id: Optional[int] = None,
+    current_user: UserResponse = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    """Get a class's token usage per hour or day, from the usage rollups (managers only)"""
+    try:
+        permission_service = PermissionService()
+        
+        membership = await permission_service.get_user_membership(db, current_user.id, class_id)
+        if not membership or not membership.is_manager:
+            raise HTTPException(status_code=403, detail="Only class managers can view usage statistics")
+        
+        start, end = resolve_history_range(granularity, start, end)
+        return build_history(db, granularity, start, end, class_id=class_id, user_id=user_id)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting class usage history: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @router.get("/classes/{class_id}/members", response_model=List[ClassUsageOverview])
 async def get_class_usage_overview(
     class_id: int,
+    limit: int = 100,
+    offset: int = 0,
+    sort_by: str = "name",
+    order: str = "asc",
     current_user: UserResponse = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    """Get usage overview for all members of a class (managers only)"""
+    """
+    Get usage overview for members of a class (managers only).
+    sort_by: name, daily_usage, weekly_usage, monthly_usage or last_activity
+    """
     try:
         permission_service = PermissionService()
         
@@ -41,8 +135,18 @@ async def get_class_usage_overview(
         if not membership or not membership.is_manager:
             raise HTTPException(status_code=403, detail="Only class managers can view usage statistics")
         
+        if limit < 1 or limit > 500 or offset < 0:
+            raise HTTPException(status_code=400, detail="Limit must be 1-500 and offset non-negative")
+        if order not in ("asc", "desc"):
+            raise HTTPException(status_code=400, detail="Order must be asc or desc")
+        
         usage_service = UsageService()
-        usage_overview = await usage_service.get_class_usage_overview(db, class_id)
+        try:
+            usage_overview = await usage_service.get_class_usage_overview(
+                db, class_id, limit=limit, offset=offset, sort_by=sort_by, descending=order == "desc"
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         return usage_overview
         
     except HTTPException:
@@ -118,6 +222,7 @@ async def update_user_limits(
         target_membership.monthly_token_limit = monthly_limit
         
         db.commit()
+        invalidate_membership(user_id, class_id)
         
         logger.info(f"Token limits updated for user {user_id} in class {class_id}")
         return {
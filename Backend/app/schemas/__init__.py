@@ -61,6 +61,9 @@ class ClassResponse(ClassBase):
     created_at: datetime
     is_active: bool
     member_count: Optional[int] = 0
+    response_cache_enabled: Optional[bool] = True
+    response_cache_ttl_seconds: Optional[int] = None
+    max_model_tier: Optional[int] = None
     
     class Config:
         from_attributes = True
@@ -68,6 +71,11 @@ class ClassResponse(ClassBase):
 class JoinClassRequest(BaseModel):
     class_code: str
 
+class ClassSettingsUpdate(BaseModel):
+    response_cache_enabled: Optional[bool] = None
+    response_cache_ttl_seconds: Optional[int] = None
+    max_model_tier: Optional[int] = None
+
 # Permission schemas
 class PermissionUpdate(BaseModel):
     can_read: Optional[bool] = None
@@ -101,6 +109,27 @@ class MembershipResponse(BaseModel):
 class SponsorshipUpdate(BaseModel):
     is_sponsored: bool
 
+class MemberSelection(BaseModel):
+    """Which members a bulk change applies to: an explicit list, a filter, or both"""
+    user_ids: Optional[List[int]] = None
+    is_sponsored: Optional[bool] = None
+    can_chat: Optional[bool] = None
+    include_managers: bool = False
+
+class BulkPermissionUpdate(BaseModel):
+    members: MemberSelection = MemberSelection()
+    changes: PermissionUpdate
+
+class BulkUpdateResult(BaseModel):
+    updated: int
+    fields: List[str]
+
+class BulkEnrollmentResult(BaseModel):
+    enrolled: int
+    already_members: int
+    unmatched: int  # emails without an active account; not listed on purpose
+    invalid_rows: List[str]
+
 # Document schemas
 class DocumentResponse(BaseModel):
     id: int
@@ -133,6 +162,7 @@ class ChatSessionResponse(BaseModel):
     updated_at: datetime
     is_active: bool
     message_count: Optional[int] = 0
+    last_message_at: Optional[datetime] = None
     
     class Config:
         from_attributes = True
@@ -149,6 +179,7 @@ class MessageResponse(BaseModel):
     response_time_ms: Optional[int]
     context_used: Optional[str]
     tokens_used: int
+    is_cached: Optional[bool] = False
     
     class Config:
         from_attributes = True
@@ -190,4 +221,24 @@ class UsageRecord(BaseModel):
     is_sponsored: bool
     is_overflow: bool
 
+class UsageBucket(BaseModel):
+    bucket_start: datetime
+    class_id: int  # 0 = not attributed to a class
+    user_id: int
+    model_name: str
+    is_sponsored: bool
+    request_count: int
+    input_tokens: int
+    output_tokens: int
+    cost: float
+    
+    class Config:
+        from_attributes = True
+
+class UsageHistory(BaseModel):
+    granularity: str
+    start: datetime
+    end: datetime
+    buckets: List[UsageBucket]
+
 
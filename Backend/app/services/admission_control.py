@@ -0,0 +1,262 @@
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Callable, Deque, Dict, Optional
+from app.config import get_settings
+import asyncio
+import math
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class LLMOverloadedError(Exception):
+    """Raised when a request cannot be admitted to the LLM provider in time"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at a per-minute rate"""
+
+    def __init__(self, per_minute: float, clock: Callable[[], float] = time.monotonic):
+        self.capacity = float(per_minute)
+        self.refill_per_second = per_minute / 60.0
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated_at = clock()
+
+    def _refill(self):
+        now = self.clock()
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_per_second)
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available (0 if available now)"""
+        self._refill()
+        # A single request larger than the bucket can never fit; let it through on a full bucket
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_second
+
+    def take(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float):
+        """Give back tokens that were reserved but not used"""
+        if amount <= 0:
+            return
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+class AIMDWindow:
+    """Additive-increase / multiplicative-decrease concurrency window"""
+
+    def __init__(self, initial: int, minimum: int, maximum: int, target_latency_ms: int,
+                 decrease_factor: float = 0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency_ms = target_latency_ms
+        self.decrease_factor = decrease_factor
+        self._limit = float(min(max(initial, minimum), maximum))
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def on_success(self, latency_ms: float):
+        """Grow by ~1 slot per window of successful calls, shrink if latency degrades"""
+        if latency_ms > self.target_latency_ms:
+            self._decrease()
+            return
+        self._limit = min(self.maximum, self._limit + 1.0 / max(self._limit, 1.0))
+
+    def on_overload(self):
+        """Provider pushed back (429 / overloaded)"""
+        self._decrease()
+
+    def _decrease(self):
+        self._limit = max(float(self.minimum), self._limit * self.decrease_factor)
+
+class _Waiter:
+    __slots__ = ("future", "tokens")
+
+    def __init__(self, future: asyncio.Future, tokens: int):
+        self.future = future
+        self.tokens = tokens
+
+class AdmissionController:
+    """
+    Admission control in front of the LLM provider.
+
+    Requests are admitted when the concurrency window has a free slot and both
+    the requests/min and tokens/min buckets allow it. Otherwise they wait in a
+    per-class FIFO; classes are served round-robin so one busy class cannot
+    starve the others. Waiters that are not admitted within the queue timeout
+    get an LLMOverloadedError carrying a Retry-After hint.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, window: AIMDWindow,
+                 queue_timeout: float, max_queue_per_class: int,
+                 clock: Callable[[], float] = time.monotonic):
+        self.request_bucket = TokenBucket(requests_per_minute, clock)
+        self.token_bucket = TokenBucket(tokens_per_minute, clock)
+        self.window = window
+        self.queue_timeout = queue_timeout
+        self.max_queue_per_class = max_queue_per_class
+        self.clock = clock
+        self.in_flight = 0
+        self._queues: "OrderedDict[Optional[int], Deque[_Waiter]]" = OrderedDict()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def _bucket_wait(self, tokens: int) -> float:
+        return max(self.request_bucket.wait_time(1), self.token_bucket.wait_time(tokens))
+
+    def _admit(self, tokens: int):
+        self.request_bucket.take(1)
+        self.token_bucket.take(tokens)
+        self.in_flight += 1
+
+    def _retry_after(self, tokens: int) -> float:
+        return max(self._bucket_wait(tokens), 1.0)
+
+    async def acquire(self, class_id: Optional[int], tokens: int):
+        """Wait for an admission slot or raise LLMOverloadedError"""
+        if not self._queues and self.in_flight < self.window.limit and self._bucket_wait(tokens) == 0:
+            self._admit(tokens)
+            return
+
+        queue = self._queues.setdefault(class_id, deque())
+        if len(queue) >= self.max_queue_per_class:
+            raise LLMOverloadedError("Too many pending requests for this class", self._retry_after(tokens))
+
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), tokens)
+        queue.append(waiter)
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.future.done():
+                # Admitted right at the deadline, keep the slot
+                return
+            waiter.future.cancel()
+            self._discard(class_id, waiter)
+            raise LLMOverloadedError("AI service is busy, please retry shortly", self._retry_after(tokens))
+        except asyncio.CancelledError:
+            # Client went away while queued; don't leak a slot that was handed over
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release()
+            else:
+                waiter.future.cancel()
+                self._discard(class_id, waiter)
+            raise
+
+    def release(self, used_tokens: Optional[int] = None, reserved_tokens: int = 0):
+        """Free a concurrency slot and refund unused token reservation"""
+        self.in_flight = max(0, self.in_flight - 1)
+        if used_tokens is not None:
+            self.token_bucket.refund(reserved_tokens - used_tokens)
+        self._dispatch()
+
+    def _discard(self, class_id: Optional[int], waiter: _Waiter):
+        queue = self._queues.get(class_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            pass
+        if not queue:
+            del self._queues[class_id]
+
+    def _dispatch(self):
+        """Admit queued waiters round-robin across classes while capacity allows"""
+        while self._queues and self.in_flight < self.window.limit:
+            class_id, queue = next(iter(self._queues.items()))
+            waiter = queue[0]
+            if waiter.future.done():
+                queue.popleft()
+                if not queue:
+                    del self._queues[class_id]
+                continue
+
+            wait = self._bucket_wait(waiter.tokens)
+            if wait > 0:
+                self._schedule_wakeup(wait)
+                return
+
+            queue.popleft()
+            # Rotate this class to the back so other classes get the next slot
+            del self._queues[class_id]
+            if queue:
+                self._queues[class_id] = queue
+            self._admit(waiter.tokens)
+            waiter.future.set_result(None)
+
+    def _schedule_wakeup(self, delay: float):
+        if self._wakeup is not None and not self._wakeup.cancelled():
+            return
+        loop = asyncio.get_running_loop()
+
+        def wake():
+            self._wakeup = None
+            self._dispatch()
+
+        self._wakeup = loop.call_later(delay, wake)
+
+    @asynccontextmanager
+    async def slot(self, class_id: Optional[int], tokens: int):
+        """
+        Hold an admission slot for the duration of a provider call.
+
+        The caller reports actual usage through `ticket["used_tokens"]` and
+        provider push-back by raising LLMOverloadedError inside the block.
+        """
+        await self.acquire(class_id, tokens)
+        ticket = {"used_tokens": None}
+        started = self.clock()
+        try:
+            yield ticket
+        except LLMOverloadedError:
+            self.window.on_overload()
+            logger.warning(f"LLM provider overloaded, concurrency window now {self.window.limit}")
+            raise
+        else:
+            self.window.on_success((self.clock() - started) * 1000)
+        finally:
+            self.release(ticket["used_tokens"], tokens)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "concurrency_limit": self.window.limit,
+            "request_tokens_available": round(self.request_bucket.tokens, 2),
+            "llm_tokens_available": round(self.token_bucket.tokens, 2),
+        }
+
+@lru_cache()
+def get_admission_controller() -> AdmissionController:
+    settings = get_settings()
+    window = AIMDWindow(
+        initial=settings.LLM_MAX_CONCURRENCY,
+        minimum=settings.LLM_MIN_CONCURRENCY,
+        maximum=settings.LLM_MAX_CONCURRENCY,
+        target_latency_ms=settings.LLM_TARGET_LATENCY_MS
+    )
+    return AdmissionController(
+        requests_per_minute=settings.LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute=settings.LLM_TOKENS_PER_MINUTE,
+        window=window,
+        queue_timeout=settings.LLM_QUEUE_TIMEOUT_SECONDS,
+        max_queue_per_class=settings.LLM_MAX_QUEUE_PER_CLASS
+    )
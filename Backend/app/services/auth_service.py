@@ -1,8 +1,9 @@
 from sqlalchemy.orm import Session
 from app.models import User
 from app.schemas import UserCreate, UserUpdate, UserResponse, Token
-from app.utils.security import get_password_hash, verify_password, create_access_token, validate_password_strength
-from app.firebase_admin import verify_firebase_token
+from app.utils.security import hash_password, verify_and_update_password, create_access_token, validate_password_strength
+from app.firebase_admin import verify_firebase_token_async
+from app.services.user_cache import invalidate_user
 from datetime import timedelta
 from app.config import get_settings
 from typing import Optional
@@ -32,7 +33,7 @@ class AuthService:
             raise ValueError(f"Password does not meet requirements: {', '.join(password_validation['errors'])}")
         
         # Create new user
-        hashed_password = get_password_hash(user_data.password)
+        hashed_password = await hash_password(user_data.password)
         new_user = User(
             email=user_data.email,
             name=user_data.name,
@@ -59,13 +60,18 @@ class AuthService:
             raise ValueError("Account is deactivated")
         if not user.hashed_password:
             raise ValueError("This account uses social login. Please sign in with Google or Microsoft.")
-        if not verify_password(password, user.hashed_password):
+        valid, new_hash = await verify_and_update_password(password, user.hashed_password)
+        if not valid:
             raise ValueError("Incorrect password")
+        if new_hash:
+            # BCRYPT_ROUNDS changed since this hash was made
+            user.hashed_password = new_hash
+            db.commit()
         
         # Create JWT token with user.id as subject
         access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
-            data={"sub": str(user.id)}, expires_delta=access_token_expires
+            data={"sub": str(user.id), "ver": user.token_version}, expires_delta=access_token_expires
         )
         
         user_response = UserResponse.model_validate(user)
@@ -87,7 +93,7 @@ class AuthService:
         """
         # Step 1: Verify Firebase token
         try:
-            decoded_token = verify_firebase_token(id_token)
+            decoded_token = await verify_firebase_token_async(id_token)
         except ValueError as e:
             raise ValueError(f"Firebase authentication failed: {str(e)}")
         
@@ -118,6 +124,7 @@ class AuthService:
             user.email_verified = email_verified
             db.commit()
             db.refresh(user)
+            invalidate_user(user.id)
             logger.info(f"Existing Firebase user logged in: {email}")
         else:
             # Check if email already exists (user switching from email/password to OAuth)
@@ -131,6 +138,7 @@ class AuthService:
                 user.email_verified = email_verified
                 db.commit()
                 db.refresh(user)
+                invalidate_user(user.id)
             else:
                 # New user - create account
                 # Use provided name/surname or parse from display_name
@@ -161,7 +169,7 @@ class AuthService:
         # Step 3: Create JWT token with user.id as subject
         access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
-            data={"sub": str(user.id)}, expires_delta=access_token_expires
+            data={"sub": str(user.id), "ver": user.token_version}, expires_delta=access_token_expires
         )
         
         user_response = UserResponse.model_validate(user)
@@ -196,6 +204,7 @@ class AuthService:
         
         db.commit()
         db.refresh(user)
+        invalidate_user(user_id)
         
         user_response = UserResponse.model_validate(user)
         user_response.display_name = self._get_display_name(user)
@@ -207,8 +216,10 @@ class AuthService:
         if not user:
             raise ValueError("User not found")
         
-        # Soft delete by deactivating
+        # Soft delete by deactivating, and revoke every token issued so far
         user.is_active = False
+        user.token_version = User.token_version + 1
         db.commit()
+        invalidate_user(user_id)
 
 
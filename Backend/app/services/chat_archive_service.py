@@ -0,0 +1,177 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import DateTime, delete, func, insert, update
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+from app.config import get_settings
+from app.models import ChatSession, ChatMessage
+import asyncio
+import json
+import logging
+import os
+import zstandard
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+_MESSAGE_COLUMNS = list(ChatMessage.__table__.columns)
+
+def _encode_message(row) -> Dict[str, Any]:
+    values = {}
+    for column in _MESSAGE_COLUMNS:
+        value = getattr(row, column.key)
+        values[column.key] = value.isoformat() if isinstance(value, datetime) else value
+    return values
+
+def _decode_message(values: Dict[str, Any]) -> Dict[str, Any]:
+    for column in _MESSAGE_COLUMNS:
+        if isinstance(column.type, DateTime) and values.get(column.key) is not None:
+            values[column.key] = datetime.fromisoformat(values[column.key])
+    return values
+
+class ChatArchiveService:
+    """
+    Moves the messages of idle sessions out of chat_messages into one
+    compressed JSONL blob per session, and back when the session is opened.
+
+    The session row stays behind as the stub: `archived_at` and
+    `archive_key` say where its messages are, and its counters are left
+    alone. Messages keep their ids, so cursors handed out before archiving
+    still work after rehydration.
+    """
+
+    def __init__(self, storage_dir: str = None):
+        self.storage_dir = storage_dir or settings.CHAT_ARCHIVE_DIR
+
+    def _archive_key(self, session_id: int) -> str:
+        # Bucketed so no directory grows past ten thousand blobs
+        return f"{session_id // 10000:05d}/{session_id}.jsonl.zst"
+
+    def _path(self, archive_key: str) -> str:
+        return os.path.join(self.storage_dir, archive_key)
+
+    def _write_blob(self, archive_key: str, rows: List[ChatMessage]):
+        payload = "".join(json.dumps(_encode_message(row)) + "\n" for row in rows).encode()
+        path = self._path(archive_key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(zstandard.ZstdCompressor(level=10).compress(payload))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _read_blob(self, archive_key: str) -> List[Dict[str, Any]]:
+        with open(self._path(archive_key), "rb") as f:
+            payload = zstandard.ZstdDecompressor().decompress(f.read())
+        return [_decode_message(json.loads(line)) for line in payload.decode().splitlines() if line]
+
+    def _remove_blob(self, archive_key: str):
+        try:
+            os.remove(self._path(archive_key))
+        except OSError as e:
+            logger.warning(f"Could not remove chat archive {archive_key}: {e}")
+
+    def idle_session_ids(self, db: Session, now: datetime = None) -> List[int]:
+        now = now or datetime.utcnow()
+        cutoff = now - timedelta(days=settings.CHAT_ARCHIVE_IDLE_DAYS)
+        return [session_id for (session_id,) in db.query(ChatSession.id).filter(
+            ChatSession.archived_at.is_(None),
+            ChatSession.message_count >= settings.CHAT_ARCHIVE_MIN_MESSAGES,
+            func.coalesce(ChatSession.last_message_at, ChatSession.updated_at) < cutoff
+        ).order_by(ChatSession.id).limit(settings.CHAT_ARCHIVE_BATCH_SIZE)]
+
+    def archive_session(self, db: Session, session_id: int, now: datetime = None) -> bool:
+        """
+        Write the session's messages to its blob, then mark the session
+        archived and delete them in one transaction. False if the session
+        was written to meanwhile (or is already archived).
+        """
+        now = now or datetime.utcnow()
+        cutoff = now - timedelta(days=settings.CHAT_ARCHIVE_IDLE_DAYS)
+        rows = db.query(ChatMessage).filter(ChatMessage.session_id == session_id).order_by(
+            ChatMessage.timestamp, ChatMessage.id
+        ).all()
+        if not rows:
+            return False
+
+        archive_key = self._archive_key(session_id)
+        self._write_blob(archive_key, rows)
+        archived = False
+        try:
+            # Re-checking idleness in the UPDATE makes a concurrent message win
+            marked = db.execute(update(ChatSession).where(
+                ChatSession.id == session_id,
+                ChatSession.archived_at.is_(None),
+                func.coalesce(ChatSession.last_message_at, ChatSession.updated_at) < cutoff
+            ).values(archived_at=now, archive_key=archive_key).execution_options(synchronize_session=False)).rowcount
+            if not marked:
+                db.rollback()
+                return False
+            db.execute(delete(ChatMessage).where(
+                ChatMessage.session_id == session_id,
+                ChatMessage.id.in_([row.id for row in rows])
+            ).execution_options(synchronize_session=False))
+            db.commit()
+            archived = True
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            # Nothing points at the blob unless the transaction committed
+            if not archived:
+                self._remove_blob(archive_key)
+        db.expunge_all()
+        return True
+
+    def archive_idle_sessions(self, db: Session, now: datetime = None) -> int:
+        archived = 0
+        for session_id in self.idle_session_ids(db, now):
+            try:
+                archived += self.archive_session(db, session_id, now)
+            except Exception as e:
+                logger.error(f"Error archiving chat session {session_id}: {e}")
+        if archived:
+            logger.info(f"Archived {archived} idle chat sessions")
+        return archived
+
+    def rehydrate(self, db: Session, session: ChatSession) -> int:
+        """
+        Put an archived session's messages back into chat_messages. Safe to
+        race: only the request that clears `archived_at` inserts. Returns
+        the number of messages restored.
+        """
+        archive_key = session.archived_at and session.archive_key
+        if not archive_key:
+            return 0
+        messages = self._read_blob(archive_key)
+        try:
+            claimed = db.execute(update(ChatSession).where(
+                ChatSession.id == session.id,
+                ChatSession.archived_at.is_not(None)
+            ).values(archived_at=None, archive_key=None).execution_options(synchronize_session=False)).rowcount
+            if not claimed:
+                db.rollback()
+                db.refresh(session)
+                return 0
+            if messages:
+                db.execute(insert(ChatMessage), messages)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        db.refresh(session)
+        self._remove_blob(archive_key)
+        return len(messages)
+
+async def run_chat_archival(session_factory):
+    """Background loop that moves idle sessions to cold storage"""
+    service = ChatArchiveService()
+    while True:
+        await asyncio.sleep(settings.CHAT_ARCHIVE_INTERVAL_SECONDS)
+        db = session_factory()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, service.archive_idle_sessions, db)
+        except Exception as e:
+            logger.error(f"Chat archival failed: {e}")
+        finally:
+            db.close()
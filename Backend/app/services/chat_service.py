@@ -1,18 +1,28 @@
 from sqlalchemy.orm import Session
-from app.models import ChatSession, ChatMessage, UsageRecord
+from sqlalchemy import func, tuple_
+from app.models import ChatSession, ChatMessage, UsageRecord, Class
 from app.schemas import ChatSessionCreate, ChatSessionResponse, MessageResponse, ChatResponse
-from app.services.openai_service import OpenAIService
-from app.services.permission_service import PermissionService
+from app.services.openai_service import OpenAIService, CompletionResult, calculate_cost
+from app.services.permission_service import PermissionService, ChatAuthContext, TokenLimitExceeded
 from app.services.usage_service import UsageService
+from app.services.response_cache import get_response_cache, hash_prompt, normalize_question
+from app.services.usage_aggregator import get_usage_aggregator, LocalReservation
+from app.config import get_settings
+from app.utils.pagination import encode_cursor
 from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
 import time
 import logging
 
+settings = get_settings()
 logger = logging.getLogger(__name__)
 
 class ChatService:
     def __init__(self):
         self.openai_service = OpenAIService()
+        self.response_cache = get_response_cache()
+        self.usage_aggregator = get_usage_aggregator() if settings.USAGE_WRITE_BEHIND_ENABLED else None
     
     async def create_session(self, db: Session, user_id: int, session_data: ChatSessionCreate) -> ChatSessionResponse:
         """Create a new chat session"""
@@ -31,14 +41,52 @@ class ChatService:
         
         return result
     
-    async def send_message(self, db: Session, session: ChatSession, content: str, user_id: int) -> ChatResponse:
+    async def send_message(self, db: Session, session: ChatSession, content: str, user_id: int,
+                           auth_context: ChatAuthContext = None) -> ChatResponse:
         """Send a message and get AI response"""
         start_time = time.time()
+        permission_service = PermissionService()
+        reservation = None
         
         try:
+            # Membership, class, tracker and billing info are loaded once per request
+            if auth_context is None:
+                auth_context = await permission_service.get_chat_context(db, user_id, session.class_id)
+                if auth_context is None:
+                    raise PermissionError("User not enrolled in this class")
+            class_obj = auth_context.class_obj
+            session_id, class_id = session.id, session.class_id
+            
+            # Resolve billing now: the reservation commit below expires loaded objects
+            billing = await permission_service.determine_billing(db, user_id, class_id, auth_context)
+            
+            # Get context from documents
+            context = await self._get_context_for_session(db, session)
+            
+            # Pick the model tier from cheap local signals
+            routing = self.openai_service.route(
+                content, context,
+                conversation_depth=self._conversation_depth(session),
+                max_tier=class_obj.max_model_tier,
+                class_id=class_id
+            )
+            
+            # Serve repeated questions over the same context from the cache
+            cached_content, question_embedding = await self._get_cached_response(class_obj, content, context, routing.model)
+            is_cached = cached_content is not None
+            
+            if not is_cached:
+                # Hold the worst-case token cost against the user's quota up front
+                reservation, reason = await self._reserve_tokens(
+                    db, permission_service, auth_context, user_id, class_id,
+                    self.openai_service.estimate_tokens(content, context, routing)
+                )
+                if reservation is None:
+                    raise TokenLimitExceeded(reason)
+            
             # Create user message
             user_message = ChatMessage(
-                session_id=session.id,
+                session_id=session_id,
                 content=content,
                 is_user=True,
                 timestamp=datetime.utcnow()
@@ -46,90 +94,153 @@ class ChatService:
             db.add(user_message)
             db.flush()
             
-            # Get context from documents
-            context = await self._get_context_for_session(db, session)
+            if is_cached:
+                completion = CompletionResult(content=cached_content, model=routing.model)
+            else:
+                # Get AI response
+                completion = await self.openai_service.generate_response(
+                    content, context, class_id=class_id, routing=routing
+                )
+                if completion.total_tokens > 0:
+                    await self._cache_response(class_obj, content, context, completion, question_embedding)
             
-            # Get AI response
-            ai_content, tokens_used = await self.openai_service.generate_response(content, context)
+            tokens_used = completion.total_tokens
             
             # Calculate response time
             response_time_ms = int((time.time() - start_time) * 1000)
             
             # Create AI message
             ai_message = ChatMessage(
-                session_id=session.id,
-                content=ai_content,
+                session_id=session_id,
+                content=completion.content,
                 is_user=False,
                 timestamp=datetime.utcnow(),
                 response_time_ms=response_time_ms,
                 context_used=context[:500] if context else None,  # Store first 500 chars
-                tokens_used=tokens_used
+                tokens_used=tokens_used,
+                is_cached=is_cached
             )
             db.add(ai_message)
             
-            # Update session timestamp
+            # Update session timestamp and message counters (one UPDATE with the flush)
             session.updated_at = datetime.utcnow()
+            session.message_count = ChatSession.message_count + 2
+            session.last_message_at = ai_message.timestamp
             
-            db.commit()
-            db.refresh(user_message)
-            db.refresh(ai_message)
+            usage_values = self._usage_record_values(session_id, class_id, user_id, completion, is_cached, billing)
             
-            # Record usage and billing
-            await self._record_usage(db, session, user_id, tokens_used)
+            if self.usage_aggregator is None:
+                # Record usage and billing
+                await self._record_usage(db, usage_values)
+                
+                # Settle the reservation with the actual usage (cache hits are free)
+                if reservation is not None:
+                    await permission_service.reconcile_reservation(db, reservation, tokens_used, commit=False)
+            
+            # Messages, usage record and quota settle in one transaction
+            db.flush()
+            user_response = MessageResponse.model_validate(user_message)
+            ai_response = MessageResponse.model_validate(ai_message)
+            db.commit()
             
-            # Record token usage for limits
-            permission_service = PermissionService()
-            await permission_service.record_token_usage(db, user_id, session.class_id, tokens_used)
+            if self.usage_aggregator is not None:
+                # Write-behind: usage is journaled and buffered, then flushed in batches
+                flush_due = await asyncio.get_running_loop().run_in_executor(
+                    None, self.usage_aggregator.record, user_id, class_id, tokens_used, usage_values, reservation
+                )
+                if flush_due:
+                    asyncio.create_task(self.usage_aggregator.flush())
+            reservation = None
             
             return ChatResponse(
-                user_message=MessageResponse.model_validate(user_message),
-                ai_response=MessageResponse.model_validate(ai_message),
-                cost=self._calculate_cost(tokens_used),
+                user_message=user_response,
+                ai_response=ai_response,
+                cost=self._calculate_cost(completion),
                 response_time_ms=response_time_ms,
                 context_provided=bool(context)
             )
             
         except Exception as e:
             db.rollback()
+            if isinstance(reservation, LocalReservation):
+                self.usage_aggregator.release(reservation)
+            elif reservation is not None:
+                await permission_service.release_reservation(db, reservation)
             logger.error(f"Error in send_message: {e}")
             raise
     
+    def get_messages_page(self, db: Session, session_id: int, limit: int,
+                          before: Optional[Tuple[datetime, int]] = None,
+                          after: Optional[Tuple[datetime, int]] = None
+                          ) -> Tuple[List[ChatMessage], Optional[str], Optional[str]]:
+        """
+        One page of a session's messages by keyset on (timestamp, id).
+
+        Without a cursor this is the newest page. `before` pages towards older
+        messages and `after` towards newer ones; messages within a page are
+        always oldest first. Returns (messages, before_cursor, after_cursor),
+        where a cursor is set only if there are messages in that direction.
+        Each page is one index range scan, however deep it is. The plain
+        timestamp bounds repeat the cursor so Postgres can prune monthly
+        partitions (it can't from the row comparison).
+        """
+        key = tuple_(ChatMessage.timestamp, ChatMessage.id)
+        query = db.query(ChatMessage).filter(ChatMessage.session_id == session_id)
+        
+        if after is not None:
+            rows = query.filter(ChatMessage.timestamp >= after[0], key > after).order_by(
+                ChatMessage.timestamp.asc(), ChatMessage.id.asc()
+            ).limit(limit + 1).all()
+            more_after, more_before = len(rows) > limit, True
+            messages = rows[:limit]
+        else:
+            if before is not None:
+                query = query.filter(ChatMessage.timestamp <= before[0], key < before)
+            rows = query.order_by(
+                ChatMessage.timestamp.desc(), ChatMessage.id.desc()
+            ).limit(limit + 1).all()
+            more_before, more_after = len(rows) > limit, before is not None
+            messages = list(reversed(rows[:limit]))
+        
+        if not messages:
+            return messages, None, None
+        before_cursor = encode_cursor(messages[0].timestamp, messages[0].id) if more_before else None
+        after_cursor = encode_cursor(messages[-1].timestamp, messages[-1].id) if more_after else None
+        return messages, before_cursor, after_cursor
+    
     async def _get_context_for_session(self, db: Session, session: ChatSession) -> str:
         """Get relevant document context for the session"""
         try:
-            from app.models import Document, DocumentChunk, DocumentScope
+            from app.models import Document, DocumentChunk, DocumentScope, ProcessingStatus
+            from sqlalchemy import or_, and_
             
-            context_chunks = []
+            # Number chunks within each document so one query can take the first few per document
+            ranked = db.query(
+                DocumentChunk.document_id.label("document_id"),
+                DocumentChunk.content.label("content"),
+                func.row_number().over(
+                    partition_by=DocumentChunk.document_id,
+                    order_by=DocumentChunk.chunk_index
+                ).label("position")
+            ).subquery()
             
-            # Get class-level documents
-            class_documents = db.query(Document).filter(
-                Document.class_id == session.class_id,
-                Document.scope == DocumentScope.CLASS,
-                Document.processing_status == "completed"
-            ).all()
+            rows = db.query(Document.original_filename, Document.scope, ranked.c.content).join(
+                ranked, ranked.c.document_id == Document.id
+            ).filter(
+                Document.processing_status == ProcessingStatus.COMPLETED,
+                or_(
+                    # Top 3 chunks per class document
+                    and_(Document.class_id == session.class_id,
+                         Document.scope == DocumentScope.CLASS,
+                         ranked.c.position <= 3),
+                    # More chunks for session-specific docs
+                    and_(Document.session_id == session.id,
+                         Document.scope == DocumentScope.CHAT,
+                         ranked.c.position <= 5)
+                )
+            ).order_by(Document.scope, Document.id, ranked.c.position).all()
             
-            for doc in class_documents:
-                chunks = db.query(DocumentChunk).filter(
-                    DocumentChunk.document_id == doc.id
-                ).limit(3).all()  # Get top 3 chunks per document
-                
-                for chunk in chunks:
-                    context_chunks.append(f"[{doc.original_filename}]: {chunk.content}")
-            
-            # Get session-specific documents
-            session_documents = db.query(Document).filter(
-                Document.session_id == session.id,
-                Document.scope == DocumentScope.CHAT,
-                Document.processing_status == "completed"
-            ).all()
-            
-            for doc in session_documents:
-                chunks = db.query(DocumentChunk).filter(
-                    DocumentChunk.document_id == doc.id
-                ).limit(5).all()  # More chunks for session-specific docs
-                
-                for chunk in chunks:
-                    context_chunks.append(f"[{doc.original_filename}]: {chunk.content}")
+            context_chunks = [f"[{filename}]: {content}" for filename, _, content in rows]
             
             # Combine context (limit to ~4000 chars to leave room for message)
             context = "\n\n".join(context_chunks)
@@ -142,50 +253,117 @@ class ChatService:
             logger.error(f"Error getting context: {e}")
             return ""
     
-    async def _record_usage(self, db: Session, session: ChatSession, user_id: int, tokens_used: int):
-        """Record usage for billing purposes"""
+    def _conversation_depth(self, session: ChatSession) -> int:
+        """Number of messages already in the session"""
+        return session.message_count or 0
+    
+    def _cache_ttl(self, class_obj: Class):
+        """Cache TTL for the class, or None if caching is off for it"""
+        if not settings.RESPONSE_CACHE_ENABLED:
+            return None
+        if class_obj is None or not class_obj.response_cache_enabled:
+            return None
+        return class_obj.response_cache_ttl_seconds or settings.RESPONSE_CACHE_TTL_SECONDS
+    
+    async def _question_embedding(self, content: str):
+        if not settings.RESPONSE_CACHE_SEMANTIC:
+            return None
+        embeddings = await self.openai_service.generate_embeddings([normalize_question(content)])
+        return embeddings[0] if embeddings else None
+    
+    async def _get_cached_response(self, class_obj: Class, content: str, context: str, model: str):
+        """
+        Return (cached answer or None, question embedding or None). The
+        embedding computed for a semantic miss is handed back so storing the
+        new answer doesn't compute it again.
+        """
+        embedding = None
         try:
-            # Determine billing
-            permission_service = PermissionService()
-            billed_user_id, is_sponsored, is_overflow = await permission_service.determine_billing(
-                db, user_id, session.class_id
-            )
+            ttl = self._cache_ttl(class_obj)
+            if ttl is None:
+                return None, None
+            
+            prompt_hash = hash_prompt(self.openai_service.build_system_message(context))
+            key = self.response_cache.make_key(model, prompt_hash, content)
+            entry = self.response_cache.get(class_obj.id, key, ttl)
+            
+            if entry is None and settings.RESPONSE_CACHE_SEMANTIC:
+                embedding = await self._question_embedding(content)
+                entry = self.response_cache.find_similar(class_obj.id, model, prompt_hash, embedding, ttl)
+            
+            return (entry.content if entry else None), embedding
             
-            # Calculate cost
-            cost = self._calculate_cost(tokens_used)
-            
-            # Create usage record
-            usage_record = UsageRecord(
-                user_id=user_id,
-                model_name="gpt-4o-mini",
-                operation_type="chat",
-                input_tokens=int(tokens_used * 0.7),  # Rough estimate
-                output_tokens=int(tokens_used * 0.3),
-                cost=cost,
-                session_id=session.id,
-                billed_to_user_id=billed_user_id,
-                is_sponsored=is_sponsored,
-                is_overflow=is_overflow
+        except Exception as e:
+            logger.error(f"Error reading response cache: {e}")
+            return None, embedding
+    
+    async def _cache_response(self, class_obj: Class, content: str, context: str,
+                              completion: CompletionResult, embedding: Optional[List[float]] = None):
+        """Store a freshly generated answer in the response cache, reusing the lookup's embedding"""
+        try:
+            if self._cache_ttl(class_obj) is None:
+                return
+            
+            prompt_hash = hash_prompt(self.openai_service.build_system_message(context))
+            key = self.response_cache.make_key(completion.model, prompt_hash, content)
+            if embedding is None:
+                embedding = await self._question_embedding(content)
+            self.response_cache.put(
+                class_obj.id, key, completion.content, completion.model, prompt_hash, embedding
             )
             
-            db.add(usage_record)
-            db.commit()
+        except Exception as e:
+            logger.error(f"Error writing response cache: {e}")
+    
+    async def _reserve_tokens(self, db: Session, permission_service: PermissionService,
+                              auth_context: ChatAuthContext, user_id: int, class_id: int, tokens: int):
+        """Reserve tokens in the database, or locally when usage is written behind"""
+        if self.usage_aggregator is None:
+            return await permission_service.reserve_tokens(
+                db, user_id, class_id, tokens,
+                membership=auth_context.membership,
+                tracker=auth_context.tracker
+            )
+        
+        membership = auth_context.membership
+        reservation = self.usage_aggregator.try_reserve(
+            user_id, class_id, tokens,
+            used=permission_service.current_usage(auth_context.tracker),
+            limits=(membership.daily_token_limit, membership.weekly_token_limit, membership.monthly_token_limit)
+        )
+        if reservation is None:
+            return None, "Token limit reached. Upgrade to continue chatting or wait for the next reset."
+        return reservation, "OK"
+    
+    def _usage_record_values(self, session_id: int, class_id: int, user_id: int, completion: CompletionResult,
+                             is_cached: bool, billing: Tuple[int, bool, bool]) -> Dict[str, Any]:
+        """Column values of the usage record for one chat turn"""
+        billed_user_id, is_sponsored, is_overflow = billing
+        return {
+            "user_id": user_id,
+            "model_name": completion.model,
+            "operation_type": "chat_cache_hit" if is_cached else "chat",
+            "input_tokens": completion.prompt_tokens,
+            "output_tokens": completion.completion_tokens,
+            # Cache hits have no tokens, so cost nothing
+            "cost": self._calculate_cost(completion),
+            "timestamp": datetime.utcnow(),
+            "session_id": session_id,
+            "class_id": class_id,
+            "billed_to_user_id": billed_user_id,
+            "is_sponsored": is_sponsored,
+            "is_overflow": is_overflow,
+        }
+    
+    async def _record_usage(self, db: Session, usage_values: Dict[str, Any]):
+        """Record usage for billing purposes (added to the caller's transaction)"""
+        try:
+            db.add(UsageRecord(**usage_values))
             
         except Exception as e:
             logger.error(f"Error recording usage: {e}")
     
-    def _calculate_cost(self, tokens_used: int) -> float:
-        """Calculate cost based on tokens used"""
-        from app.config import get_settings
-        settings = get_settings()
-        
-        # GPT-4o-mini pricing: $0.15/$0.60 per million tokens
-        input_tokens = int(tokens_used * 0.7)
-        output_tokens = int(tokens_used * 0.3)
-        
-        pricing = settings.OPENAI_PRICING["gpt-4o-mini"]
-        input_cost = (input_tokens / 1_000_000) * pricing["input"]
-        output_cost = (output_tokens / 1_000_000) * pricing["output"]
-        
-        return round(input_cost + output_cost, 6)
+    def _calculate_cost(self, completion: CompletionResult) -> float:
+        """Calculate cost from exact prompt/completion tokens and the model's pricing"""
+        return calculate_cost(completion.model, completion.prompt_tokens, completion.completion_tokens)
 
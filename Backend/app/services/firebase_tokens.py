@@ -0,0 +1,220 @@
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Callable, Dict, Optional, Tuple
+from jose import jwt, JWTError
+from app.config import get_settings
+import hashlib
+import re
+import threading
+import time
+import logging
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Used when the key endpoint doesn't send a max-age
+DEFAULT_KEY_MAX_AGE_SECONDS = 300
+
+# Unknown key ids trigger a refetch (key rotation), at most this often
+UNKNOWN_KID_REFETCH_SECONDS = 30
+
+def _max_age(headers) -> int:
+    match = re.search(r"max-age=(\d+)", headers.get("Cache-Control", ""))
+    if not match:
+        return DEFAULT_KEY_MAX_AGE_SECONDS
+    return max(int(match.group(1)) - int(headers.get("Age", 0) or 0), 0)
+
+def fetch_signing_keys(url: str) -> Tuple[Dict[str, str], int]:
+    """({kid: PEM certificate}, seconds the response may be cached)"""
+    response = requests.get(url, timeout=5)
+    response.raise_for_status()
+    return response.json(), _max_age(response.headers)
+
+class SigningKeyCache:
+    """
+    Firebase signing certificates, cached for the lifetime the key endpoint
+    advertises in Cache-Control.
+
+    Once less than `refresh_ahead_seconds` of that lifetime is left, the
+    next lookup starts a background refetch and keeps serving the current
+    keys, so verification only waits on the network at startup (see
+    prefetch) or after the keys have fully expired.
+    """
+
+    def __init__(self, url: str, refresh_ahead_seconds: float,
+                 fetch: Callable[[str], Tuple[Dict[str, str], int]] = fetch_signing_keys,
+                 clock: Callable[[], float] = time.time):
+        self.url = url
+        self.refresh_ahead_seconds = refresh_ahead_seconds
+        self.fetch = fetch
+        self.clock = clock
+        self._keys: Dict[str, str] = {}
+        self._expires_at = 0.0
+        self._last_fetch_at: Optional[float] = None
+        self._fetch_lock = threading.Lock()
+        self._refresh_thread: Optional[threading.Thread] = None
+        self.fetches = 0
+        self.failed_fetches = 0
+
+    def _refresh(self, if_expiring_before: float):
+        with self._fetch_lock:
+            # Someone else refreshed while we waited
+            if self._expires_at > if_expiring_before:
+                return
+            try:
+                keys, max_age = self.fetch(self.url)
+            except Exception:
+                self.failed_fetches += 1
+                raise
+            finally:
+                self._last_fetch_at = self.clock()
+            self._keys = keys
+            self._expires_at = self.clock() + max_age
+            self.fetches += 1
+
+    def _refresh_in_background(self):
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+
+        def run():
+            try:
+                self._refresh(self._expires_at)
+            except Exception as e:
+                logger.error(f"Background Firebase key refresh failed: {e}")
+
+        self._refresh_thread = threading.Thread(target=run, name="firebase-key-refresh", daemon=True)
+        self._refresh_thread.start()
+
+    def prefetch(self):
+        """Load the keys now (called at startup)"""
+        self._refresh(self.clock())
+
+    def get_key(self, kid: str) -> Optional[str]:
+        now = self.clock()
+        if now >= self._expires_at:
+            self._refresh(now)
+        elif now >= self._expires_at - self.refresh_ahead_seconds:
+            self._refresh_in_background()
+
+        key = self._keys.get(kid)
+        if key is None and (self._last_fetch_at is None
+                            or now - self._last_fetch_at >= UNKNOWN_KID_REFETCH_SECONDS):
+            # Probably a rotation we haven't seen yet
+            self._refresh(float("inf"))
+            key = self._keys.get(kid)
+        return key
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "keys": len(self._keys),
+            "fetches": self.fetches,
+            "failed_fetches": self.failed_fetches,
+            "expires_in_seconds": round(max(self._expires_at - self.clock(), 0.0), 1),
+        }
+
+class FirebaseTokenVerifier:
+    """
+    Verifies Firebase ID tokens against the cached signing keys, with the
+    checks Firebase documents (RS256, kid, aud, iss, sub, exp, iat,
+    auth_time).
+
+    Tokens that verified are remembered by SHA-256 digest until their `exp`,
+    so a client retrying or logging in twice with the same token skips the
+    signature check. Raises ValueError like verify_firebase_token.
+    """
+
+    def __init__(self, project_id: str, key_cache: SigningKeyCache, max_cached_tokens: int,
+                 clock: Callable[[], float] = time.time):
+        self.project_id = project_id
+        self.key_cache = key_cache
+        self.max_cached_tokens = max_cached_tokens
+        self.clock = clock
+        self._tokens: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, digest: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._tokens.get(digest)
+            if entry is not None:
+                if self.clock() < entry[0]:
+                    self._tokens.move_to_end(digest)
+                    self.hits += 1
+                    return dict(entry[1])
+                del self._tokens[digest]
+            self.misses += 1
+            return None
+
+    def _remember(self, digest: str, claims: Dict[str, Any]):
+        with self._lock:
+            self._tokens[digest] = (claims["exp"], claims)
+            while len(self._tokens) > self.max_cached_tokens:
+                self._tokens.popitem(last=False)
+
+    def verify(self, id_token: str) -> Dict[str, Any]:
+        digest = hashlib.sha256(id_token.encode()).hexdigest()
+        claims = self._cached(digest)
+        if claims is not None:
+            return claims
+
+        try:
+            header = jwt.get_unverified_header(id_token)
+        except JWTError:
+            raise ValueError("Invalid Firebase token")
+        if header.get("alg") != "RS256" or not header.get("kid"):
+            raise ValueError("Invalid Firebase token")
+
+        try:
+            key = self.key_cache.get_key(header["kid"])
+        except Exception as e:
+            logger.error(f"Could not load Firebase signing keys: {e}")
+            raise ValueError("Token verification failed")
+        if key is None:
+            raise ValueError("Invalid Firebase token")
+
+        try:
+            # Time-based claims are checked below against self.clock
+            claims = jwt.decode(
+                id_token, key, algorithms=["RS256"], audience=self.project_id,
+                issuer=f"https://securetoken.google.com/{self.project_id}",
+                options={"verify_exp": False, "verify_iat": False, "verify_nbf": False}
+            )
+        except JWTError:
+            raise ValueError("Invalid Firebase token")
+
+        now = self.clock()
+        subject = claims.get("sub")
+        if (not isinstance(subject, str) or not subject or len(subject) > 128
+                or not isinstance(claims.get("exp"), (int, float))
+                or claims.get("iat", now + 1) > now or claims.get("auth_time", now + 1) > now):
+            raise ValueError("Invalid Firebase token")
+        if claims["exp"] <= now:
+            raise ValueError("Firebase token expired")
+
+        # Same shape as firebase_admin.auth.verify_id_token
+        claims["uid"] = subject
+        self._remember(digest, claims)
+        return dict(claims)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "cached_tokens": len(self._tokens),
+            "signing_keys": self.key_cache.stats(),
+        }
+
+@lru_cache()
+def get_firebase_verifier() -> FirebaseTokenVerifier:
+    settings = get_settings()
+    return FirebaseTokenVerifier(
+        project_id=settings.FIREBASE_PROJECT_ID,
+        key_cache=SigningKeyCache(
+            url=settings.FIREBASE_SIGNING_KEYS_URL,
+            refresh_ahead_seconds=settings.FIREBASE_KEY_REFRESH_AHEAD_SECONDS
+        ),
+        max_cached_tokens=settings.FIREBASE_TOKEN_CACHE_MAX_ENTRIES
+    )
@@ -0,0 +1,168 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import and_, func, literal, not_, update
+from datetime import datetime
+from typing import Any, Dict, List
+from app.models import ClassMembership, User
+from app.schemas import MemberSelection, BulkUpdateResult, BulkEnrollmentResult
+from app.services.membership_cache import invalidate_class_memberships
+from app.utils.sql import dialect_insert
+import csv
+import io
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Largest explicit member list or roster accepted in one request
+MAX_BULK_MEMBERS = 5000
+
+# Keeps IN lists well under driver parameter limits
+LOOKUP_BATCH_SIZE = 500
+
+EMAIL_PATTERN = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+LIMIT_FIELDS = ("daily_token_limit", "weekly_token_limit", "monthly_token_limit")
+
+PERMISSION_FLAGS = ("can_read", "can_chat", "can_share_class", "can_upload_documents")
+
+class MembershipAdminService:
+    """Class-wide membership changes done as set operations rather than per member"""
+
+    def _validate_changes(self, changes: Dict[str, Any]):
+        if not changes:
+            raise ValueError("No changes given")
+        for field in LIMIT_FIELDS + ("max_concurrent_chats",):
+            if field in changes and (changes[field] is None or changes[field] <= 0):
+                raise ValueError(f"{field} must be positive")
+        for field in PERMISSION_FLAGS:
+            if field in changes and changes[field] is None:
+                raise ValueError(f"{field} must be true or false")
+        given = [changes[field] for field in LIMIT_FIELDS if field in changes]
+        if given != sorted(given):
+            raise ValueError("Daily ≤ Weekly ≤ Monthly limits")
+
+    async def bulk_update(self, db: Session, class_id: int, selection: MemberSelection,
+                          changes: Dict[str, Any]) -> BulkUpdateResult:
+        """
+        Apply `changes` to every selected membership of the class in one
+        UPDATE. Managers are left alone unless the selection includes them.
+        """
+        self._validate_changes(changes)
+        if selection.user_ids is not None and len(selection.user_ids) > MAX_BULK_MEMBERS:
+            raise ValueError(f"At most {MAX_BULK_MEMBERS} members per request")
+
+        selected = [ClassMembership.class_id == class_id]
+        if selection.user_ids is not None:
+            selected.append(ClassMembership.user_id.in_(selection.user_ids))
+        if selection.is_sponsored is not None:
+            selected.append(ClassMembership.is_sponsored == selection.is_sponsored)
+        if selection.can_chat is not None:
+            selected.append(ClassMembership.can_chat == selection.can_chat)
+        if not selection.include_managers:
+            selected.append(ClassMembership.is_manager == False)
+
+        # Limits not in the request keep their stored values, so the order is
+        # checked row by row on what each membership would end up with
+        ordered = None
+        if any(field in changes for field in LIMIT_FIELDS):
+            daily, weekly, monthly = (
+                literal(changes[field]) if field in changes else getattr(ClassMembership, field)
+                for field in LIMIT_FIELDS
+            )
+            ordered = and_(daily <= weekly, weekly <= monthly)
+
+        try:
+            if ordered is not None:
+                out_of_order = db.query(func.count(ClassMembership.id)).filter(*selected, not_(ordered)).scalar()
+                if out_of_order:
+                    raise ValueError(
+                        f"Daily ≤ Weekly ≤ Monthly limits: {out_of_order} selected members would break the order"
+                    )
+                # Also guards against limits changed between the check and the update
+                selected.append(ordered)
+            updated = db.execute(
+                update(ClassMembership).where(*selected).values(**changes)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            db.commit()
+        except ValueError:
+            db.rollback()
+            raise
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error bulk updating memberships of class {class_id}: {e}")
+            raise
+
+        invalidate_class_memberships(class_id)
+        return BulkUpdateResult(updated=updated, fields=sorted(changes))
+
+    def parse_roster(self, content: str):
+        """(normalized unique emails in file order, rows that aren't emails) from a CSV roster"""
+        emails, invalid = [], []
+        seen = set()
+        for row in csv.reader(io.StringIO(content)):
+            value = row[0].strip() if row else ""
+            if not value or value.lower() == "email":
+                continue
+            if not EMAIL_PATTERN.match(value):
+                invalid.append(value)
+                continue
+            email = value.lower()
+            if email not in seen:
+                seen.add(email)
+                emails.append(email)
+        return emails, invalid
+
+    async def enroll_emails(self, db: Session, class_id: int, content: str) -> BulkEnrollmentResult:
+        """
+        Enrol the users listed (first CSV column, optional "email" header)
+        with default member permissions. Unknown or inactive accounts are
+        only counted, never named, so an import can't be used to find out
+        which addresses have accounts. A handful of batched lookups and one
+        multi-row INSERT, whatever the roster size.
+        """
+        emails, invalid = self.parse_roster(content)
+        if len(emails) > MAX_BULK_MEMBERS:
+            raise ValueError(f"At most {MAX_BULK_MEMBERS} emails per import")
+
+        user_ids: Dict[str, int] = {}
+        for start in range(0, len(emails), LOOKUP_BATCH_SIZE):
+            batch = emails[start:start + LOOKUP_BATCH_SIZE]
+            user_ids.update({email: user_id for user_id, email in db.query(User.id, func.lower(User.email)).filter(
+                func.lower(User.email).in_(batch),
+                User.is_active == True
+            )})
+
+        found = list(user_ids.values())
+        existing = set()
+        for start in range(0, len(found), LOOKUP_BATCH_SIZE):
+            existing.update(user_id for (user_id,) in db.query(ClassMembership.user_id).filter(
+                ClassMembership.class_id == class_id,
+                ClassMembership.user_id.in_(found[start:start + LOOKUP_BATCH_SIZE])
+            ))
+
+        new_user_ids: List[int] = [user_id for user_id in found if user_id not in existing]
+        try:
+            if new_user_ids:
+                # Column defaults give the same permissions as joining by class code
+                now = datetime.utcnow()
+                db.execute(
+                    dialect_insert(db, ClassMembership).on_conflict_do_nothing(
+                        index_elements=[ClassMembership.user_id, ClassMembership.class_id]
+                    ),
+                    [{"user_id": user_id, "class_id": class_id, "joined_at": now} for user_id in new_user_ids]
+                )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error importing roster into class {class_id}: {e}")
+            raise
+
+        if new_user_ids:
+            invalidate_class_memberships(class_id)
+        return BulkEnrollmentResult(
+            enrolled=len(new_user_ids),
+            already_members=len(existing),
+            unmatched=len(emails) - len(user_ids),
+            invalid_rows=invalid
+        )
@@ -0,0 +1,198 @@
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from datetime import datetime
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Tuple
+from sqlalchemy import text
+from app.config import get_settings
+from app.models import ClassMembership
+import threading
+import select
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+MembershipKey = Tuple[int, int]  # (user_id, class_id)
+
+@dataclass(frozen=True)
+class MembershipSnapshot:
+    """Read-only copy of a membership's permission and limit columns"""
+    id: int
+    user_id: int
+    class_id: int
+    joined_at: Optional[datetime]
+    is_manager: bool
+    can_read: bool
+    can_chat: bool
+    max_concurrent_chats: int
+    can_share_class: bool
+    can_upload_documents: bool
+    is_sponsored: bool
+    daily_token_limit: int
+    weekly_token_limit: int
+    monthly_token_limit: int
+
+    @classmethod
+    def from_membership(cls, membership: ClassMembership) -> "MembershipSnapshot":
+        return cls(**{f.name: getattr(membership, f.name) for f in fields(cls)})
+
+class MembershipCache:
+    """
+    Per-process LRU of membership snapshots keyed by (user_id, class_id).
+
+    Entries (including "not a member") live for `ttl_seconds`, which bounds
+    staleness for changes this process isn't told about. Writes that change
+    memberships invalidate explicitly; see invalidate_membership and
+    invalidate_class_memberships below.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._entries: "OrderedDict[MembershipKey, Tuple[float, Optional[MembershipSnapshot]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.max_hit_age = 0.0
+        self._hit_age_total = 0.0
+
+    def get(self, user_id: int, class_id: int) -> Tuple[bool, Optional[MembershipSnapshot]]:
+        """(found, snapshot); snapshot is None for a cached "not a member" """
+        key = (user_id, class_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = self.clock() - entry[0]
+                if age < self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self._hit_age_total += age
+                    self.max_hit_age = max(self.max_hit_age, age)
+                    return True, entry[1]
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, user_id: int, class_id: int, snapshot: Optional[MembershipSnapshot]):
+        with self._lock:
+            self._entries[(user_id, class_id)] = (self.clock(), snapshot)
+            self._entries.move_to_end((user_id, class_id))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int, class_id: int):
+        with self._lock:
+            self._entries.pop((user_id, class_id), None)
+            self.invalidations += 1
+
+    def invalidate_class(self, class_id: int):
+        with self._lock:
+            for key in [key for key in self._entries if key[1] == class_id]:
+                del self._entries[key]
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "entries": len(self._entries),
+            # Staleness: how old served entries were (bounded by the TTL)
+            "mean_hit_age_seconds": round(self._hit_age_total / self.hits, 3) if self.hits else 0.0,
+            "max_hit_age_seconds": round(self.max_hit_age, 3),
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+@lru_cache()
+def get_membership_cache() -> MembershipCache:
+    settings = get_settings()
+    return MembershipCache(
+        max_entries=settings.MEMBERSHIP_CACHE_MAX_ENTRIES,
+        ttl_seconds=settings.MEMBERSHIP_CACHE_TTL_SECONDS
+    )
+
+# Cross-worker invalidation (Postgres LISTEN/NOTIFY). Payloads are
+# "<user_id>:<class_id>" for one membership or "class:<class_id>".
+
+def _apply_invalidation(payload: str):
+    cache = get_membership_cache()
+    scope, _, value = payload.partition(":")
+    if scope == "class":
+        cache.invalidate_class(int(value))
+    else:
+        cache.invalidate(int(scope), int(value))
+
+def _publish(payload: str):
+    settings = get_settings()
+    if not settings.MEMBERSHIP_CACHE_NOTIFY_CHANNEL:
+        return
+    from app.database import engine
+
+    if engine.dialect.name != "postgresql":
+        return
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"),
+                         {"channel": settings.MEMBERSHIP_CACHE_NOTIFY_CHANNEL, "payload": payload})
+            conn.commit()
+    except Exception as e:
+        # Other workers fall back to the TTL
+        logger.error(f"Error publishing membership invalidation: {e}")
+
+def invalidate_membership(user_id: int, class_id: int):
+    """Call after committing a change to one membership (permissions, limits, join/leave)"""
+    get_membership_cache().invalidate(user_id, class_id)
+    _publish(f"{user_id}:{class_id}")
+
+def invalidate_class_memberships(class_id: int):
+    """Call after committing a change that affects every membership of a class"""
+    get_membership_cache().invalidate_class(class_id)
+    _publish(f"class:{class_id}")
+
+class MembershipInvalidationListener(threading.Thread):
+    """Applies invalidations published by other workers; reconnects on failure"""
+
+    def __init__(self, channel: str, poll_seconds: float = 5.0):
+        super().__init__(name="membership-invalidation-listener", daemon=True)
+        self.channel = channel
+        self.poll_seconds = poll_seconds
+        self._stopped = threading.Event()
+
+    def run(self):
+        from app.database import engine
+
+        while not self._stopped.is_set():
+            raw = None
+            try:
+                raw = engine.raw_connection()
+                raw.driver_connection.set_isolation_level(0)  # autocommit
+                cursor = raw.cursor()
+                cursor.execute(f'LISTEN "{self.channel}"')
+                # Anything published while we weren't listening is unknown: start clean
+                get_membership_cache().clear()
+
+                connection = raw.driver_connection
+                while not self._stopped.is_set():
+                    if select.select([connection], [], [], self.poll_seconds) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        _apply_invalidation(connection.notifies.pop(0).payload)
+            except Exception as e:
+                logger.error(f"Membership invalidation listener error: {e}")
+                self._stopped.wait(self.poll_seconds)
+            finally:
+                if raw is not None:
+                    raw.close()
+
+    def stop(self):
+        self._stopped.set()
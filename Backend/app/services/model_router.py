@@ -0,0 +1,100 @@
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+from app.config import get_settings
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Phrases that usually need multi-step reasoning rather than a quick lookup
+_COMPLEX_QUESTION_RE = re.compile(
+    r"\b(why|prove|derive|derivation|compare|contrast|step[- ]by[- ]step|analy[sz]e|evaluate|justify)\b",
+    re.IGNORECASE
+)
+
+@dataclass
+class ModelTier:
+    name: str
+    model: str
+    max_tokens: int
+
+@dataclass
+class RoutingDecision:
+    tier_index: int
+    tier: ModelTier
+    reason: str
+    features: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def model(self) -> str:
+        return self.tier.model
+
+    @property
+    def max_tokens(self) -> int:
+        return self.tier.max_tokens
+
+class ModelRouter:
+    """
+    Pick a model tier per request from cheap local signals.
+
+    Each signal that suggests a harder turn (long question, large retrieved
+    context, deep conversation, reasoning-style wording) moves the request
+    one rung up the configured ladder. A class-level cap limits the top rung.
+    """
+
+    def __init__(self, ladder: List[ModelTier], long_question_tokens: int, large_context_tokens: int,
+                 deep_conversation_messages: int):
+        if not ladder:
+            raise ValueError("Model ladder must have at least one tier")
+        self.ladder = ladder
+        self.long_question_tokens = long_question_tokens
+        self.large_context_tokens = large_context_tokens
+        self.deep_conversation_messages = deep_conversation_messages
+
+    @property
+    def top_tier(self) -> int:
+        return len(self.ladder) - 1
+
+    def route(self, question: str, question_tokens: int, context_tokens: int, conversation_depth: int,
+              max_tier: Optional[int] = None) -> RoutingDecision:
+        reasons = []
+        if question_tokens > self.long_question_tokens:
+            reasons.append("long_question")
+        if context_tokens > self.large_context_tokens:
+            reasons.append("large_context")
+        if conversation_depth > self.deep_conversation_messages:
+            reasons.append("deep_conversation")
+        if _COMPLEX_QUESTION_RE.search(question or ""):
+            reasons.append("reasoning_keywords")
+
+        tier_index = min(len(reasons), self.top_tier)
+        if max_tier is not None and tier_index > max_tier:
+            tier_index = max(0, min(max_tier, self.top_tier))
+            reasons.append("capped_by_class")
+
+        return RoutingDecision(
+            tier_index=tier_index,
+            tier=self.ladder[tier_index],
+            reason=",".join(reasons) or "simple",
+            features={
+                "question_tokens": question_tokens,
+                "context_tokens": context_tokens,
+                "conversation_depth": conversation_depth,
+                "max_tier": max_tier,
+            }
+        )
+
+@lru_cache()
+def get_model_router() -> ModelRouter:
+    settings = get_settings()
+    ladder = [ModelTier(**tier) for tier in settings.OPENAI_MODEL_LADDER]
+    if not settings.MODEL_ROUTING_ENABLED:
+        # Single rung: everything goes to the default model
+        ladder = [ModelTier(name="default", model=settings.OPENAI_MODEL, max_tokens=1000)]
+    return ModelRouter(
+        ladder=ladder,
+        long_question_tokens=settings.ROUTING_LONG_QUESTION_TOKENS,
+        large_context_tokens=settings.ROUTING_LARGE_CONTEXT_TOKENS,
+        deep_conversation_messages=settings.ROUTING_DEEP_CONVERSATION_MESSAGES
+    )
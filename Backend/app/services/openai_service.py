@@ -1,6 +1,11 @@
 import openai
+from dataclasses import dataclass
+from functools import lru_cache
 from app.config import get_settings
+from app.services.admission_control import get_admission_controller, LLMOverloadedError
+from app.services.model_router import get_model_router, RoutingDecision
 import logging
+import time
 import tiktoken
 
 settings = get_settings()
@@ -9,19 +14,7 @@ logger = logging.getLogger(__name__)
 # Set OpenAI API key
 openai.api_key = settings.OPENAI_API_KEY
 
-class OpenAIService:
-    def __init__(self):
-        self.model = settings.OPENAI_MODEL
-        self.encoding = tiktoken.encoding_for_model(self.model)
-    
-    async def generate_response(self, user_message: str, context: str = None) -> tuple[str, int]:
-        """Generate AI response using GPT-4o-mini"""
-        try:
-            # Prepare messages
-            messages = []
-            
-            # System message
-            system_message = """You are StudHelper, an AI assistant designed to help students learn from uploaded course materials. 
+SYSTEM_PROMPT = """You are StudHelper, an AI assistant designed to help students learn from uploaded course materials. 
             You provide clear, educational explanations and help students understand complex topics.
             
             When answering:
@@ -30,36 +23,182 @@ class OpenAIService:
             3. Break down complex concepts into understandable parts
             4. Encourage further learning and questions
             """
+
+def _is_overload_error(error: Exception) -> bool:
+    """True if the provider rejected the call because of rate limits or overload"""
+    status_code = getattr(error, "http_status", None) or getattr(error, "status_code", None)
+    if status_code in (429, 503):
+        return True
+    return type(error).__name__ in ("RateLimitError", "ServiceUnavailableError")
+
+def _retry_after_from(error: Exception) -> float:
+    """Read the provider's Retry-After hint if it sent one"""
+    headers = getattr(error, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After") or 1)
+    except (TypeError, ValueError):
+        return 1.0
+
+@dataclass
+class CompletionResult:
+    content: str
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    """tiktoken encoding for a model, loaded once per process"""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # Encoding files unavailable (e.g. offline); fall back to a character estimate
+        logger.error(f"Could not load tiktoken encoding for {model}: {e}")
+        return None
+
+@lru_cache(maxsize=None)
+def get_model_pricing(model: str) -> dict:
+    """Per-million-token pricing for a model, looked up once from settings"""
+    pricing = settings.OPENAI_PRICING.get(model)
+    if pricing is None:
+        logger.warning(f"No pricing configured for model {model}, using {settings.OPENAI_MODEL} pricing")
+        pricing = settings.OPENAI_PRICING[settings.OPENAI_MODEL]
+    return pricing
+
+def calculate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Cost in USD for a completion"""
+    pricing = get_model_pricing(model)
+    input_cost = (prompt_tokens / 1_000_000) * pricing["input"]
+    output_cost = (completion_tokens / 1_000_000) * pricing["output"]
+    return round(input_cost + output_cost, 6)
+
+class OpenAIService:
+    def __init__(self):
+        self.model = settings.OPENAI_MODEL
+        self.encoding = get_encoding(self.model)
+        self.admission = get_admission_controller()
+        self.router = get_model_router()
+    
+    def build_system_message(self, context: str = None) -> str:
+        """System prompt with the retrieved course materials appended"""
+        system_message = SYSTEM_PROMPT
+        if context:
+            system_message += f"\n\nRelevant course materials:\n{context}"
+        return system_message
+    
+    def fit_context(self, user_message: str, context: str = None) -> str:
+        """Trim retrieved context so the prompt stays within OPENAI_MAX_PROMPT_TOKENS"""
+        if not context:
+            return context
+        
+        budget = settings.OPENAI_MAX_PROMPT_TOKENS - self.count_tokens(self.build_system_message() + user_message)
+        if self.count_tokens(context) <= budget:
+            return context
+        
+        if budget <= 0:
+            logger.warning("Prompt exceeds token budget without context, dropping context")
+            return None
+        
+        logger.info(f"Trimming context to {budget} tokens to fit prompt budget")
+        if self.encoding is None:
+            return context[:budget * 4]
+        return self.encoding.decode(self.encoding.encode(context)[:budget])
+    
+    def route(self, user_message: str, context: str = None, conversation_depth: int = 0,
+              max_tier: int = None, class_id: int = None) -> RoutingDecision:
+        """Choose the model tier for a request and log the decision"""
+        decision = self.router.route(
+            question=user_message,
+            question_tokens=self.count_tokens(user_message),
+            context_tokens=self.count_tokens(context) if context else 0,
+            conversation_depth=conversation_depth,
+            max_tier=max_tier
+        )
+        logger.info(
+            f"Model routing: class={class_id} tier={decision.tier_index}/{decision.tier.name} "
+            f"model={decision.model} max_tokens={decision.max_tokens} reason={decision.reason} "
+            f"features={decision.features}"
+        )
+        return decision
+    
+    def estimate_tokens(self, user_message: str, context: str = None, routing: RoutingDecision = None) -> int:
+        """Upper bound on tokens a request can use: trimmed prompt + max completion"""
+        routing = routing or self.route(user_message, context)
+        system_message = self.build_system_message(self.fit_context(user_message, context))
+        return self.count_tokens(system_message + user_message) + routing.max_tokens
+    
+    async def generate_response(self, user_message: str, context: str = None, class_id: int = None,
+                                routing: RoutingDecision = None) -> CompletionResult:
+        """
+        Generate AI response with the model tier chosen by the router
+        
+        Raises LLMOverloadedError when the request can't be admitted or the
+        provider is rate limiting us, so callers can answer 503 + Retry-After.
+        """
+        routing = routing or self.route(user_message, context, class_id=class_id)
+        try:
+            # Prepare messages
+            messages = []
             
-            if context:
-                system_message += f"\n\nRelevant course materials:\n{context}"
+            # System message (context trimmed before sending, not by the provider)
+            system_message = self.build_system_message(self.fit_context(user_message, context))
             
             messages.append({"role": "system", "content": system_message})
             messages.append({"role": "user", "content": user_message})
             
-            # Make API call
-            response = await openai.ChatCompletion.acreate(
-                model=self.model,
-                messages=messages,
-                max_tokens=1000,
-                temperature=0.7,
-                top_p=0.9,
-                frequency_penalty=0.1,
-                presence_penalty=0.1
-            )
+            # Reserve prompt + worst-case completion against the provider budget
+            estimated_tokens = self.count_tokens(system_message + user_message) + routing.max_tokens
             
-            # Extract response
-            ai_response = response.choices[0].message.content.strip()
+            async with self.admission.slot(class_id, estimated_tokens) as ticket:
+                started = time.time()
+                try:
+                    # Make API call
+                    response = await openai.ChatCompletion.acreate(
+                        model=routing.model,
+                        messages=messages,
+                        max_tokens=routing.max_tokens,
+                        temperature=0.7,
+                        top_p=0.9,
+                        frequency_penalty=0.1,
+                        presence_penalty=0.1
+                    )
+                except Exception as e:
+                    if _is_overload_error(e):
+                        raise LLMOverloadedError("AI provider is rate limiting requests", _retry_after_from(e))
+                    raise
+                
+                # Extract response and exact token usage (priced by the model we asked for)
+                result = CompletionResult(
+                    content=response.choices[0].message.content.strip(),
+                    model=routing.model,
+                    prompt_tokens=response.usage.prompt_tokens,
+                    completion_tokens=response.usage.completion_tokens
+                )
+                ticket["used_tokens"] = result.total_tokens
             
-            # Calculate tokens used
-            total_tokens = response.usage.total_tokens
-            
-            return ai_response, total_tokens
+            logger.info(
+                f"Model tier result: class={class_id} tier={routing.tier_index}/{routing.tier.name} "
+                f"model={routing.model} latency_ms={int((time.time() - started) * 1000)} "
+                f"prompt_tokens={result.prompt_tokens} completion_tokens={result.completion_tokens} "
+                f"cost={calculate_cost(result.model, result.prompt_tokens, result.completion_tokens)}"
+            )
+            return result
             
+        except LLMOverloadedError:
+            raise
         except Exception as e:
             logger.error(f"Error generating AI response: {e}")
-            # Return fallback response
-            return "I apologize, but I'm experiencing technical difficulties. Please try again later.", 50
+            # Return fallback response (nothing was generated, so nothing is billed)
+            return CompletionResult(
+                content="I apologize, but I'm experiencing technical difficulties. Please try again later.",
+                model=routing.model
+            )
     
     async def generate_embeddings(self, texts: list[str]) -> list[list[float]]:
         """Generate embeddings for text chunks"""
@@ -79,6 +218,8 @@ class OpenAIService:
     def count_tokens(self, text: str) -> int:
         """Count tokens in text"""
         try:
+            if self.encoding is None:
+                return len(text) // 4 + 1
             return len(self.encoding.encode(text))
         except Exception as e:
             logger.error(f"Error counting tokens: {e}")
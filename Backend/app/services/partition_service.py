@@ -0,0 +1,169 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import text, delete
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from app.config import get_settings
+from app.models import ChatMessage, UsageRecord, UsageRollupState
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# Tables range-partitioned by month on their timestamp column (see the
+# partition_usage_and_messages migration). Partitions are named
+# <table>_pYYYYMM and cover [first of month, first of next month).
+PARTITIONED_TABLES = {
+    "usage_records": UsageRecord,
+    "chat_messages": ChatMessage,
+}
+
+def month_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, 1)
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+def parse_partition_month(table: str, name: str) -> Optional[datetime]:
+    """Month a partition covers, or None for the default partition and strangers"""
+    prefix = f"{table}_p"
+    if not name.startswith(prefix):
+        return None
+    try:
+        return datetime.strptime(name[len(prefix):], "%Y%m")
+    except ValueError:
+        return None
+
+class PartitionService:
+    """
+    Keeps the monthly partitions ahead of the clock and applies retention.
+
+    On databases without declarative partitioning (SQLite in tests and
+    development) creating partitions is a no-op and retention deletes the
+    expired rows instead, so callers don't need to care which one they have.
+    """
+
+    def __init__(self):
+        self.retention_months = {
+            "usage_records": settings.USAGE_RECORD_RETENTION_MONTHS,
+            "chat_messages": settings.CHAT_MESSAGE_RETENTION_MONTHS,
+        }
+
+    def _is_partitioned(self, db: Session, table: str) -> bool:
+        if db.get_bind().dialect.name != "postgresql":
+            return False
+        relkind = db.execute(
+            text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table}
+        ).scalar()
+        return relkind == "p"
+
+    def list_partitions(self, db: Session, table: str) -> List[Tuple[str, Optional[datetime]]]:
+        """(partition name, month) of the table's attached partitions"""
+        names = db.execute(text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = to_regclass(:table) ORDER BY child.relname"
+        ), {"table": table}).scalars().all()
+        return [(name, parse_partition_month(table, name)) for name in names]
+
+    def ensure_partitions(self, db: Session, now: datetime = None) -> List[str]:
+        """Create this month's and the next PARTITION_PREMAKE_MONTHS partitions; returns the new ones"""
+        now = now or datetime.utcnow()
+        created = []
+        for table in PARTITIONED_TABLES:
+            if not self._is_partitioned(db, table):
+                continue
+            existing = {name for name, _ in self.list_partitions(db, table)}
+            for offset in range(settings.PARTITION_PREMAKE_MONTHS + 1):
+                month = add_months(month_start(now), offset)
+                name = partition_name(table, month)
+                if name in existing:
+                    continue
+                # Fails if the default partition already holds rows for the month;
+                # logged by the caller, the rows stay readable in the default
+                db.execute(text(
+                    f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table}" '
+                    f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+                ))
+                created.append(name)
+        db.commit()
+        if created:
+            logger.info(f"Created partitions: {', '.join(created)}")
+        return created
+
+    def _rollup_watermark(self, db: Session) -> int:
+        state = db.query(UsageRollupState).filter(UsageRollupState.id == 1).first()
+        return state.last_record_id if state else 0
+
+    def apply_retention(self, db: Session, now: datetime = None) -> Dict[str, int]:
+        """
+        Detach or drop whole months older than each table's retention
+        (partitions), or delete the rows (unpartitioned tables). Usage
+        records are only removed once the rollups have compacted them.
+        Returns partitions retired, or rows deleted, per table.
+        """
+        now = now or datetime.utcnow()
+        removed: Dict[str, int] = {}
+        for table, model in PARTITIONED_TABLES.items():
+            months = self.retention_months[table]
+            if months <= 0:
+                continue
+            cutoff = add_months(month_start(now), -months)
+            if self._is_partitioned(db, table):
+                removed[table] = len(self._retire_partitions(db, table, model, cutoff))
+            else:
+                removed[table] = self._delete_rows(db, table, model, cutoff)
+        return removed
+
+    def _retire_partitions(self, db: Session, table: str, model, cutoff: datetime) -> List[str]:
+        retired = []
+        watermark = self._rollup_watermark(db) if model is UsageRecord else None
+        for name, month in self.list_partitions(db, table):
+            if month is None or add_months(month, 1) > cutoff:
+                continue
+            if watermark is not None:
+                newest = db.execute(text(f'SELECT max(id) FROM "{name}"')).scalar()
+                if newest is not None and newest > watermark:
+                    logger.warning(f"Keeping {name}: not compacted into the usage rollups yet")
+                    continue
+            db.execute(text(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"'))
+            if settings.PARTITION_RETENTION_ACTION == "drop":
+                db.execute(text(f'DROP TABLE "{name}"'))
+            db.commit()
+            retired.append(name)
+        if retired:
+            action = "Dropped" if settings.PARTITION_RETENTION_ACTION == "drop" else "Detached"
+            logger.info(f"{action} expired partitions: {', '.join(retired)}")
+        return retired
+
+    def _delete_rows(self, db: Session, table: str, model, cutoff: datetime) -> int:
+        stmt = delete(model).where(model.timestamp < cutoff)
+        if model is UsageRecord:
+            stmt = stmt.where(model.id <= self._rollup_watermark(db))
+        deleted = db.execute(stmt.execution_options(synchronize_session=False)).rowcount
+        db.commit()
+        if deleted:
+            logger.info(f"Deleted {deleted} {table} rows older than {cutoff:%Y-%m}")
+        return deleted
+
+    def run_maintenance(self, db: Session, now: datetime = None):
+        self.ensure_partitions(db, now)
+        self.apply_retention(db, now)
+
+async def run_partition_maintenance(session_factory):
+    """Background loop that creates upcoming partitions and applies retention"""
+    service = PartitionService()
+    while True:
+        db = session_factory()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, service.run_maintenance, db)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Partition maintenance failed: {e}")
+        finally:
+            db.close()
+        await asyncio.sleep(settings.PARTITION_MAINTENANCE_INTERVAL_SECONDS)
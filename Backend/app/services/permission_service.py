@@ -1,59 +1,143 @@
 from sqlalchemy.orm import Session
-from datetime import date, timedelta
+from sqlalchemy import update, case, or_, and_, func
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
 from typing import Tuple, Optional
-from app.models import ClassMembership, ClassUsageTracker, ChatSession
-import pytz
+from app.models import Class, ClassMembership, ClassUsageTracker, ChatSession
+from app.config import get_settings
+from app.utils.sql import dialect_insert
+from app.utils.timezones import quota_today
+from app.services.membership_cache import MembershipSnapshot, get_membership_cache
 import logging
 
+settings = get_settings()
 logger = logging.getLogger(__name__)
 
+class TokenLimitExceeded(Exception):
+    """Raised when a request's estimated tokens don't fit in the remaining quota"""
+
+@dataclass
+class TokenReservation:
+    """Tokens held against a usage tracker for one in-flight request"""
+    tracker_id: int
+    user_id: int
+    class_id: int
+    tokens: int
+    # reserved_until of the group this reservation joined; identifies it after the group lapses
+    expires_at: datetime
+
+@dataclass
+class ChatAuthContext:
+    """Everything the chat hot path needs about a user's standing in a class, loaded in one query"""
+    membership: ClassMembership
+    class_obj: Class
+    tracker: Optional[ClassUsageTracker]
+    active_chats: int
+
 class PermissionService:
     
-    async def get_user_membership(self, db: Session, user_id: int, class_id: int) -> Optional[ClassMembership]:
-        """Get user's membership in a specific class"""
-        return db.query(ClassMembership).filter(
+    async def get_chat_context(self, db: Session, user_id: int, class_id: int) -> Optional[ChatAuthContext]:
+        """Fetch membership, class, usage tracker and active chat count in a single round trip"""
+        active_chats = db.query(func.count(ChatSession.id)).filter(
+            ChatSession.user_id == user_id,
+            ChatSession.class_id == class_id,
+            ChatSession.is_active == True
+        ).scalar_subquery()
+        
+        row = db.query(ClassMembership, Class, ClassUsageTracker, active_chats).join(
+            Class, Class.id == ClassMembership.class_id
+        ).outerjoin(
+            ClassUsageTracker, and_(
+                ClassUsageTracker.user_id == ClassMembership.user_id,
+                ClassUsageTracker.class_id == ClassMembership.class_id
+            )
+        ).filter(
             ClassMembership.user_id == user_id,
             ClassMembership.class_id == class_id
         ).first()
+        
+        if row is None:
+            return None
+        
+        membership, class_obj, tracker, active_count = row
+        if settings.MEMBERSHIP_CACHE_ENABLED:
+            get_membership_cache().put(user_id, class_id, MembershipSnapshot.from_membership(membership))
+        return ChatAuthContext(
+            membership=membership,
+            class_obj=class_obj,
+            tracker=tracker,
+            active_chats=active_count or 0
+        )
     
-    async def can_user_chat(self, db: Session, user_id: int, class_id: int) -> Tuple[bool, str]:
+    async def get_user_membership(self, db: Session, user_id: int, class_id: int) -> Optional[MembershipSnapshot]:
+        """
+        Get user's membership in a specific class, as a read-only snapshot
+        served from the membership cache when possible. Query ClassMembership
+        directly to modify it.
+        """
+        cache = get_membership_cache() if settings.MEMBERSHIP_CACHE_ENABLED else None
+        if cache is not None:
+            found, snapshot = cache.get(user_id, class_id)
+            if found:
+                return snapshot
+        
+        membership = db.query(ClassMembership).filter(
+            ClassMembership.user_id == user_id,
+            ClassMembership.class_id == class_id
+        ).first()
+        snapshot = MembershipSnapshot.from_membership(membership) if membership else None
+        
+        # A replica read may predate an invalidation; serve it but don't cache it
+        if cache is not None and not db.info.get("read_replica"):
+            cache.put(user_id, class_id, snapshot)
+        return snapshot
+    
+    async def can_user_chat(self, db: Session, user_id: int, class_id: int,
+                            context: ChatAuthContext = None) -> Tuple[bool, str]:
         """Check if user can chat in this class"""
-        membership = await self.get_user_membership(db, user_id, class_id)
+        if context is None:
+            context = await self.get_chat_context(db, user_id, class_id)
         
-        if not membership:
+        if not context:
             return False, "User not enrolled in this class"
         
+        membership = context.membership
         if not membership.can_chat:
             return False, "Chat permission disabled by class manager"
         
+        # First chat in the class: create the tracker once and keep it on the context
+        if context.tracker is None:
+            context.tracker = await self.get_usage_tracker(db, user_id, class_id)
+        
         # Check token limits
-        usage_check = await self.check_token_limits(db, user_id, class_id, membership)
+        usage_check = await self.check_token_limits(db, user_id, class_id, membership, context.tracker)
         if not usage_check[0]:
             return usage_check
         
         # Check concurrent chat limit
-        active_chats = await self.count_active_chats(db, user_id, class_id)
-        if active_chats >= membership.max_concurrent_chats:
+        if context.active_chats >= membership.max_concurrent_chats:
             return False, f"Maximum concurrent chats reached ({membership.max_concurrent_chats}). Please close some chats first."
         
         return True, "OK"
     
-    async def check_token_limits(self, db: Session, user_id: int, class_id: int, membership: ClassMembership) -> Tuple[bool, str]:
+    async def check_token_limits(self, db: Session, user_id: int, class_id: int, membership: ClassMembership,
+                                 tracker: ClassUsageTracker = None) -> Tuple[bool, str]:
         """Check if user is within token limits"""
         # Get or create usage tracker
-        tracker = await self.get_usage_tracker(db, user_id, class_id)
+        if tracker is None:
+            tracker = await self.get_usage_tracker(db, user_id, class_id)
         
-        # Reset counters if needed
-        await self.reset_usage_if_needed(db, tracker)
+        # Periods past their reset count as zero; the stored counters are reset on the next increment
+        daily_used, weekly_used, monthly_used = self.current_usage(tracker)
         
         # Check limits
-        if tracker.daily_tokens_used >= membership.daily_token_limit:
+        if daily_used >= membership.daily_token_limit:
             return False, "Daily token limit reached. Upgrade to continue chatting or wait for daily reset."
         
-        if tracker.weekly_tokens_used >= membership.weekly_token_limit:
+        if weekly_used >= membership.weekly_token_limit:
             return False, "Weekly token limit reached. Upgrade to continue chatting or wait for weekly reset."
         
-        if tracker.monthly_tokens_used >= membership.monthly_token_limit:
+        if monthly_used >= membership.monthly_token_limit:
             return False, "Monthly token limit reached. Upgrade to continue chatting or wait for monthly reset."
         
         return True, "OK"
@@ -66,12 +150,13 @@ class PermissionService:
         ).first()
         
         if not tracker:
+            today = quota_today()
             tracker = ClassUsageTracker(
                 user_id=user_id,
                 class_id=class_id,
-                last_daily_reset=date.today(),
-                last_weekly_reset=date.today(),
-                last_monthly_reset=date.today()
+                last_daily_reset=today,
+                last_weekly_reset=today,
+                last_monthly_reset=today
             )
             db.add(tracker)
             db.commit()
@@ -79,34 +164,6 @@ class PermissionService:
         
         return tracker
     
-    async def reset_usage_if_needed(self, db: Session, tracker: ClassUsageTracker):
-        """Reset usage counters based on Madrid timezone (00:00)"""
-        madrid_tz = pytz.timezone('Europe/Madrid')
-        today = date.today()
-        
-        reset_needed = False
-        
-        # Daily reset
-        if tracker.last_daily_reset != today:
-            tracker.daily_tokens_used = 0
-            tracker.last_daily_reset = today
-            reset_needed = True
-        
-        # Weekly reset (every Monday)
-        if self.is_new_week(tracker.last_weekly_reset, today):
-            tracker.weekly_tokens_used = 0
-            tracker.last_weekly_reset = today
-            reset_needed = True
-        
-        # Monthly reset (1st of month)
-        if self.is_new_month(tracker.last_monthly_reset, today):
-            tracker.monthly_tokens_used = 0
-            tracker.last_monthly_reset = today
-            reset_needed = True
-        
-        if reset_needed:
-            db.commit()
-    
     def is_new_week(self, last_reset: date, today: date) -> bool:
         """Check if we've entered a new week (Monday start)"""
         # Get Monday of last reset week
@@ -119,37 +176,224 @@ class PermissionService:
         """Check if we've entered a new month"""
         return (today.year, today.month) != (last_reset.year, last_reset.month)
     
-    async def count_active_chats(self, db: Session, user_id: int, class_id: int) -> int:
-        """Count active chat sessions for user in class"""
-        return db.query(ChatSession).filter(
-            ChatSession.user_id == user_id,
-            ChatSession.class_id == class_id,
-            ChatSession.is_active == True
-        ).count()
-    
-    async def determine_billing(self, db: Session, user_id: int, class_id: int) -> Tuple[int, bool, bool]:
+    async def determine_billing(self, db: Session, user_id: int, class_id: int,
+                                context: ChatAuthContext = None) -> Tuple[int, bool, bool]:
         """
         Determine billing for usage
         Returns: (billed_user_id, is_sponsored, is_overflow)
         """
-        membership = await self.get_user_membership(db, user_id, class_id)
+        if context is not None:
+            membership, class_obj = context.membership, context.class_obj
+        else:
+            membership, class_obj = await self.get_user_membership(db, user_id, class_id), None
         
         if membership and membership.is_sponsored:
             # Find class owner (manager who sponsors)
-            from app.models import Class
-            class_obj = db.query(Class).filter(Class.id == class_id).first()
+            if class_obj is None:
+                class_obj = db.query(Class).filter(Class.id == class_id).first()
             return class_obj.owner_id, True, False  # Manager pays, sponsored, not overflow
         else:
             return user_id, False, True  # User pays, not sponsored, is overflow
     
-    async def record_token_usage(self, db: Session, user_id: int, class_id: int, tokens_used: int):
-        """Record token usage in the tracker"""
-        tracker = await self.get_usage_tracker(db, user_id, class_id)
-        await self.reset_usage_if_needed(db, tracker)
+    def current_usage(self, tracker: Optional[ClassUsageTracker], today: date = None) -> Tuple[int, int, int]:
+        """(daily, weekly, monthly) usage as of today, treating periods that are due a reset as zero"""
+        if tracker is None:
+            return 0, 0, 0
+        today = today or quota_today()
+        daily_current = tracker.last_daily_reset == today
+        weekly_current = tracker.last_weekly_reset is not None and not self.is_new_week(tracker.last_weekly_reset, today)
+        monthly_current = tracker.last_monthly_reset is not None and not self.is_new_month(tracker.last_monthly_reset, today)
+        return (
+            (tracker.daily_tokens_used or 0) if daily_current else 0,
+            (tracker.weekly_tokens_used or 0) if weekly_current else 0,
+            (tracker.monthly_tokens_used or 0) if monthly_current else 0
+        )
+    
+    def current_usage_columns(self, today: date = None):
+        """
+        SQL counterpart of current_usage: (daily, weekly, monthly) tracker
+        columns with due resets applied virtually, 0 when there's no tracker
+        """
+        today = today or quota_today()
+        week_start = today - timedelta(days=today.weekday())
+        month_start = today.replace(day=1)
+        t = ClassUsageTracker
         
-        tracker.daily_tokens_used += tokens_used
-        tracker.weekly_tokens_used += tokens_used
-        tracker.monthly_tokens_used += tokens_used
+        def current(counter, last_reset, period_start):
+            return case((last_reset >= period_start, func.coalesce(counter, 0)), else_=0)
         
-        db.commit()
+        return (
+            current(t.daily_tokens_used, t.last_daily_reset, today),
+            current(t.weekly_tokens_used, t.last_weekly_reset, week_start),
+            current(t.monthly_tokens_used, t.last_monthly_reset, month_start)
+        )
+    
+    def usage_increment_values(self, tokens_used: int, today: date = None) -> dict:
+        """
+        SET clause that applies any due daily/weekly/monthly reset and adds
+        `tokens_used`, evaluated by the database against the current row
+        """
+        today = today or quota_today()
+        week_start = today - timedelta(days=today.weekday())
+        month_start = today.replace(day=1)
+        
+        def reset_or_add(counter, last_reset, period_start):
+            stale = or_(last_reset.is_(None), last_reset < period_start)
+            return case((stale, tokens_used), else_=counter + tokens_used)
+        
+        def reset_date(last_reset, period_start):
+            stale = or_(last_reset.is_(None), last_reset < period_start)
+            return case((stale, today), else_=last_reset)
+        
+        t = ClassUsageTracker
+        return {
+            "daily_tokens_used": reset_or_add(t.daily_tokens_used, t.last_daily_reset, today),
+            "weekly_tokens_used": reset_or_add(t.weekly_tokens_used, t.last_weekly_reset, week_start),
+            "monthly_tokens_used": reset_or_add(t.monthly_tokens_used, t.last_monthly_reset, month_start),
+            "last_daily_reset": reset_date(t.last_daily_reset, today),
+            "last_weekly_reset": reset_date(t.last_weekly_reset, week_start),
+            "last_monthly_reset": reset_date(t.last_monthly_reset, month_start),
+        }
+    
+    def increment_token_usage(self, db: Session, user_id: int, class_id: int,
+                              tokens_used: int) -> Tuple[int, int, int]:
+        """
+        Add token usage to the tracker, without committing.
+        
+        Reset and increment happen in one UPDATE ... RETURNING, so concurrent
+        writers can't lose updates; the first use of a class is an upsert.
+        Synchronous so the usage flush can run it in a worker thread.
+        Returns the new (daily, weekly, monthly) totals.
+        """
+        today = quota_today()
+        values = self.usage_increment_values(tokens_used, today)
+        counters = (
+            ClassUsageTracker.daily_tokens_used,
+            ClassUsageTracker.weekly_tokens_used,
+            ClassUsageTracker.monthly_tokens_used
+        )
+        
+        row = db.execute(
+            update(ClassUsageTracker)
+            .where(ClassUsageTracker.user_id == user_id, ClassUsageTracker.class_id == class_id)
+            .values(**values)
+            .returning(*counters)
+            .execution_options(synchronize_session=False)
+        ).first()
+        
+        if row is None:
+            # No tracker yet; another request may be creating it concurrently
+            insert_stmt = dialect_insert(db, ClassUsageTracker).values(
+                user_id=user_id,
+                class_id=class_id,
+                daily_tokens_used=tokens_used,
+                weekly_tokens_used=tokens_used,
+                monthly_tokens_used=tokens_used,
+                last_daily_reset=today,
+                last_weekly_reset=today,
+                last_monthly_reset=today,
+                reserved_tokens=0
+            )
+            row = db.execute(
+                insert_stmt.on_conflict_do_update(
+                    index_elements=[ClassUsageTracker.user_id, ClassUsageTracker.class_id],
+                    set_=values
+                ).returning(*counters)
+            ).first()
+        
+        return tuple(row)
 
+    
+    async def reserve_tokens(self, db: Session, user_id: int, class_id: int, tokens: int,
+                             membership: ClassMembership = None,
+                             tracker: ClassUsageTracker = None) -> Tuple[Optional[TokenReservation], str]:
+        """
+        Atomically reserve estimated tokens against the user's limits.
+        
+        The limit check and the reservation are a single conditional UPDATE,
+        committed straight away, so concurrent requests can't all pass the
+        check and the row lock is held only for that one statement.
+        Reserved tokens lapse TOKEN_RESERVATION_TTL_SECONDS after the
+        reservation that took the total above zero; later ones don't extend
+        that, so tokens leaked by a crashed request are freed even while the
+        user keeps chatting.
+        """
+        if membership is None:
+            membership = await self.get_user_membership(db, user_id, class_id)
+            if not membership:
+                return None, "User not enrolled in this class"
+        
+        if tracker is None:
+            tracker = await self.get_usage_tracker(db, user_id, class_id)
+        
+        now = datetime.utcnow()
+        reservation_lapsed = or_(
+            ClassUsageTracker.reserved_until.is_(None),
+            ClassUsageTracker.reserved_until < now
+        )
+        active_reserved = case((reservation_lapsed, 0), else_=ClassUsageTracker.reserved_tokens)
+        # Due resets are applied in the comparison only; reconcile performs them
+        daily_used, weekly_used, monthly_used = self.current_usage_columns()
+        
+        result = db.execute(
+            update(ClassUsageTracker)
+            .where(
+                ClassUsageTracker.id == tracker.id,
+                daily_used + active_reserved + tokens <= membership.daily_token_limit,
+                weekly_used + active_reserved + tokens <= membership.weekly_token_limit,
+                monthly_used + active_reserved + tokens <= membership.monthly_token_limit
+            )
+            .values(
+                reserved_tokens=active_reserved + tokens,
+                reserved_until=case(
+                    (active_reserved > 0, ClassUsageTracker.reserved_until),
+                    else_=now + timedelta(seconds=settings.TOKEN_RESERVATION_TTL_SECONDS)
+                )
+            )
+            .returning(ClassUsageTracker.reserved_until)
+            .execution_options(synchronize_session=False)
+        )
+        expires_at = result.scalar()
+        tracker_id = tracker.id
+        db.commit()
+        
+        if expires_at is None:
+            return None, "Token limit reached. Upgrade to continue chatting or wait for the next reset."
+        
+        return TokenReservation(tracker_id=tracker_id, user_id=user_id, class_id=class_id,
+                                tokens=tokens, expires_at=expires_at), "OK"
+    
+    async def reconcile_reservation(self, db: Session, reservation: TokenReservation, tokens_used: int,
+                                    commit: bool = True):
+        """
+        Replace a reservation with the tokens the request actually used.
+        
+        The reserved tokens are only given back while the reservation's group
+        is still the tracker's current one; once it lapsed, reserved_tokens
+        belongs to a newer group and is left alone.
+        """
+        still_held = ClassUsageTracker.reserved_until == reservation.expires_at
+        db.execute(
+            update(ClassUsageTracker)
+            .where(ClassUsageTracker.id == reservation.tracker_id)
+            .values(
+                reserved_tokens=case(
+                    (and_(still_held, ClassUsageTracker.reserved_tokens > reservation.tokens),
+                     ClassUsageTracker.reserved_tokens - reservation.tokens),
+                    (still_held, 0),
+                    else_=ClassUsageTracker.reserved_tokens
+                ),
+                **self.usage_increment_values(tokens_used)
+            )
+            .execution_options(synchronize_session=False)
+        )
+        if commit:
+            db.commit()
+    
+    async def release_reservation(self, db: Session, reservation: TokenReservation):
+        """Give back a reservation for a request that failed"""
+        try:
+            await self.reconcile_reservation(db, reservation, 0)
+        except Exception as e:
+            logger.error(f"Error releasing token reservation: {e}")
+            db.rollback()
@@ -0,0 +1,155 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+from app.config import get_settings
+from app.utils.vector_operations import VectorOperations
+import hashlib
+import re
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION_RE = re.compile(r"[\s?!.]+$")
+
+def normalize_text(text: str) -> str:
+    """Case/whitespace-insensitive form used for cache keys"""
+    return _WHITESPACE_RE.sub(" ", text or "").strip().lower()
+
+def normalize_question(question: str) -> str:
+    """Normalize a question so trivial variations ('What is X?' / 'what is x') share a key"""
+    return _TRAILING_PUNCTUATION_RE.sub("", normalize_text(question))
+
+def hash_prompt(system_prompt: str) -> str:
+    """Stable hash of the normalized system prompt (including retrieved context)"""
+    return hashlib.sha256(normalize_text(system_prompt).encode("utf-8")).hexdigest()
+
+@dataclass
+class CachedResponse:
+    content: str
+    model: str
+    prompt_hash: str
+    created_at: float
+    embedding: Optional[List[float]] = field(default=None, repr=False)
+
+class ResponseCache:
+    """
+    Per-process cache of AI answers, partitioned by class.
+
+    Exact lookups are keyed on (model, prompt hash, normalized question).
+    In semantic mode a miss falls back to the most similar cached question
+    for the same model and prompt hash, if it clears the similarity threshold.
+    Each class partition is an LRU bounded to `max_entries_per_class`, and
+    the number of partitions is bounded too.
+    """
+
+    def __init__(self, max_entries_per_class: int, max_classes: int, similarity_threshold: float,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_entries_per_class = max_entries_per_class
+        self.max_classes = max_classes
+        self.similarity_threshold = similarity_threshold
+        self.clock = clock
+        self.vector_ops = VectorOperations()
+        self._classes: "OrderedDict[int, OrderedDict[str, CachedResponse]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model: str, prompt_hash: str, question: str) -> str:
+        raw = f"{model}\x00{prompt_hash}\x00{normalize_question(question)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _partition(self, class_id: int, create: bool = False) -> Optional["OrderedDict[str, CachedResponse]"]:
+        partition = self._classes.get(class_id)
+        if partition is None and create:
+            partition = OrderedDict()
+            self._classes[class_id] = partition
+            while len(self._classes) > self.max_classes:
+                self._classes.popitem(last=False)
+        if partition is not None:
+            self._classes.move_to_end(class_id)
+        return partition
+
+    def _is_fresh(self, entry: CachedResponse, ttl_seconds: int) -> bool:
+        return self.clock() - entry.created_at < ttl_seconds
+
+    def get(self, class_id: int, key: str, ttl_seconds: int) -> Optional[CachedResponse]:
+        """Exact-match lookup"""
+        partition = self._partition(class_id)
+        entry = partition.get(key) if partition is not None else None
+        if entry is not None and not self._is_fresh(entry, ttl_seconds):
+            del partition[key]
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        partition.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def find_similar(self, class_id: int, model: str, prompt_hash: str, embedding: List[float],
+                     ttl_seconds: int) -> Optional[CachedResponse]:
+        """Near-duplicate lookup over questions asked against the same prompt"""
+        partition = self._partition(class_id)
+        if partition is None or not embedding:
+            return None
+
+        best_key, best_score = None, self.similarity_threshold
+        for key, entry in list(partition.items()):
+            if not self._is_fresh(entry, ttl_seconds):
+                del partition[key]
+                continue
+            if entry.model != model or entry.prompt_hash != prompt_hash or not entry.embedding:
+                continue
+            score = self.vector_ops.cosine_similarity(embedding, entry.embedding)
+            if score >= best_score:
+                best_key, best_score = key, score
+
+        if best_key is None:
+            return None
+
+        # Counted as a hit; the exact lookup that preceded this already counted the miss
+        self.misses -= 1
+        self.hits += 1
+        partition.move_to_end(best_key)
+        return partition[best_key]
+
+    def put(self, class_id: int, key: str, content: str, model: str, prompt_hash: str,
+            embedding: Optional[List[float]] = None):
+        partition = self._partition(class_id, create=True)
+        partition[key] = CachedResponse(
+            content=content,
+            model=model,
+            prompt_hash=prompt_hash,
+            created_at=self.clock(),
+            embedding=embedding
+        )
+        partition.move_to_end(key)
+        while len(partition) > self.max_entries_per_class:
+            partition.popitem(last=False)
+
+    def invalidate_class(self, class_id: int):
+        self._classes.pop(class_id, None)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "classes": len(self._classes),
+            "entries": sum(len(p) for p in self._classes.values()),
+        }
+
+@lru_cache()
+def get_response_cache() -> ResponseCache:
+    settings = get_settings()
+    return ResponseCache(
+        max_entries_per_class=settings.RESPONSE_CACHE_MAX_ENTRIES_PER_CLASS,
+        max_classes=settings.RESPONSE_CACHE_MAX_CLASSES,
+        similarity_threshold=settings.RESPONSE_CACHE_SIMILARITY_THRESHOLD
+    )
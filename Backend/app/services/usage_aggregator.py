@@ -0,0 +1,434 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import lru_cache
+from typing import IO, Any, Callable, Dict, List, Optional, Tuple
+from sqlalchemy import DateTime, delete, insert
+from app.config import get_settings
+from app.models import UsageRecord, UsageFlushedSegment
+import asyncio
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+UsageKey = Tuple[int, int]  # (user_id, class_id)
+
+_RECORD_DATETIME_COLUMNS = {
+    column.key for column in UsageRecord.__table__.columns if isinstance(column.type, DateTime)
+}
+
+@dataclass
+class LocalReservation:
+    """Tokens held in this process for one in-flight request"""
+    user_id: int
+    class_id: int
+    tokens: int
+
+    @property
+    def key(self) -> UsageKey:
+        return (self.user_id, self.class_id)
+
+@dataclass
+class UsageBatch:
+    """Buffered usage taken out for one write, and the journal segments holding it"""
+    pending: Dict[UsageKey, int] = field(default_factory=dict)
+    records: List[Dict[str, Any]] = field(default_factory=list)
+    segments: List[str] = field(default_factory=list)
+    attempts: int = 0
+
+    @property
+    def rows(self) -> int:
+        return len(self.pending) + len(self.records)
+
+    def add(self, user_id: int, class_id: int, tokens_used: int, usage_record: Dict[str, Any]):
+        if tokens_used:
+            key = (user_id, class_id)
+            self.pending[key] = self.pending.get(key, 0) + tokens_used
+        self.records.append(usage_record)
+
+class UsageJournal:
+    """
+    Append-only log of buffered usage, one segment file per batch.
+
+    Each turn is appended and fsynced before it is acknowledged. Once the
+    segment's batch is committed the file is deleted; the commit also
+    records the segment id in `usage_flushed_segments`, so a crash between
+    the commit and the delete doesn't replay it. A process holds an
+    exclusive flock on every segment it owns, which is how recovery tells
+    the segments of live workers from those left behind by dead ones.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._current: Optional[str] = None
+        self._held: Dict[str, IO[bytes]] = {}
+
+    def _path(self, segment_id: str) -> str:
+        return os.path.join(self.directory, f"{segment_id}.jsonl")
+
+    def _hold(self, segment_id: str, mode: str) -> IO[bytes]:
+        """Open and lock a segment; BlockingIOError if another process holds it"""
+        f = open(self._path(segment_id), mode)
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            raise
+        self._held[segment_id] = f
+        return f
+
+    def append(self, entry: Dict[str, Any]):
+        if self._current is None:
+            self._current = uuid.uuid4().hex
+            self._hold(self._current, "ab")
+        f = self._held[self._current]
+        f.write((json.dumps(entry, default=lambda value: value.isoformat()) + "\n").encode())
+        f.flush()
+        os.fsync(f.fileno())
+
+    def rotate(self) -> List[str]:
+        """End the current segment; returns it (if any) for the batch being taken out"""
+        segment_id, self._current = self._current, None
+        return [segment_id] if segment_id else []
+
+    def discard(self, segment_ids: List[str]):
+        """Delete committed segments"""
+        for segment_id in segment_ids:
+            try:
+                os.remove(self._path(segment_id))
+            except FileNotFoundError:
+                pass
+            f = self._held.pop(segment_id, None)
+            if f is not None:
+                f.close()
+
+    def set_aside(self, segment_ids: List[str]):
+        """Rename segments to <id>.dead so they are kept but never replayed"""
+        for segment_id in segment_ids:
+            try:
+                os.replace(self._path(segment_id), f"{self._path(segment_id)[:-len('.jsonl')]}.dead")
+            except FileNotFoundError:
+                pass
+            f = self._held.pop(segment_id, None)
+            if f is not None:
+                f.close()
+
+    def adopt_orphans(self) -> List[Tuple[str, List[Dict[str, Any]]]]:
+        """Take over segments nobody holds: (segment id, entries) for each"""
+        orphans = []
+        for name in sorted(os.listdir(self.directory)):
+            segment_id, extension = os.path.splitext(name)
+            if extension != ".jsonl" or segment_id in self._held:
+                continue
+            try:
+                f = self._hold(segment_id, "rb")
+            except (BlockingIOError, FileNotFoundError):
+                continue
+            entries = []
+            for line in f.read().decode().splitlines():
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # A torn last line is a turn that was never acknowledged
+                    break
+            orphans.append((segment_id, entries))
+        return orphans
+
+def _decode_record(values: Dict[str, Any]) -> Dict[str, Any]:
+    for key in _RECORD_DATETIME_COLUMNS:
+        if values.get(key) is not None:
+            values[key] = datetime.fromisoformat(values[key])
+    return values
+
+class UsageAggregator:
+    """
+    Per-process write-behind buffer for quota counters and usage records.
+
+    Chat turns add their token usage and usage record here instead of
+    writing `class_usage_trackers` and `usage_records` directly. Deltas are
+    summed per (user, class) and flushed in one transaction every
+    `flush_interval_ms`, or as soon as `flush_max_events` turns are buffered.
+
+    Limits are enforced against the tracker values last read from the
+    database plus this process's unflushed usage and in-flight
+    reservations, so a single process never lets a user exceed a limit.
+
+    Bounds and failure semantics:
+    - With P processes, a user can overshoot a limit by at most the tokens
+      they spend on the other P - 1 processes within one flush window
+      (each window is at most `flush_interval_ms` long and
+      `flush_max_events` turns deep), plus one batch flushed between the
+      request reading its tracker and reserving here.
+    - With a journal, a turn is on disk before `record` returns. A crash
+      loses nothing: the next start replays segments that weren't
+      committed and skips those that were, so nothing is counted twice.
+      Without one, a crash loses the unflushed window (an under-count,
+      never a charge for tokens that weren't used).
+    - A batch whose write fails is kept on its own and retried, so it
+      can't hold back later batches. After `max_attempts` failures, or when
+      more than `max_unsettled` batches are waiting, the oldest is moved
+      aside (journal segments renamed to .dead for an operator to replay,
+      otherwise logged and dropped). Memory is bounded by the open window
+      plus `max_unsettled` batches.
+    """
+
+    def __init__(self, session_factory: Callable, flush_interval_ms: int, flush_max_events: int,
+                 clock: Callable[[], float] = time.monotonic, journal: UsageJournal = None,
+                 max_attempts: int = 5, max_unsettled: int = 20):
+        self.session_factory = session_factory
+        self.flush_interval_ms = flush_interval_ms
+        self.flush_max_events = flush_max_events
+        self.clock = clock
+        self.journal = journal
+        self.max_attempts = max_attempts
+        self.max_unsettled = max_unsettled
+        self._lock = threading.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._open = UsageBatch()
+        self._reserved: Dict[UsageKey, int] = {}
+        # Taken out for writing and not committed yet (in flight or waiting to retry)
+        self._unsettled: List[UsageBatch] = []
+        # Committed segments whose marker rows can go with the next write
+        self._discarded_segments: List[str] = []
+        self._task: Optional[asyncio.Task] = None
+        self.events = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.set_aside_batches = 0
+        self.rows_written = 0
+        self.last_flush_at = clock()
+
+    def unflushed_tokens(self, user_id: int, class_id: int) -> int:
+        """Tokens used or reserved in this process that the database doesn't know about yet"""
+        key = (user_id, class_id)
+        with self._lock:
+            unsettled = sum(batch.pending.get(key, 0) for batch in self._unsettled)
+            return self._open.pending.get(key, 0) + unsettled + self._reserved.get(key, 0)
+
+    def try_reserve(self, user_id: int, class_id: int, tokens: int,
+                    used: Tuple[int, int, int], limits: Tuple[int, int, int]) -> Optional[LocalReservation]:
+        """
+        Reserve `tokens` if (daily, weekly, monthly) `used` from the database,
+        plus local usage, plus `tokens` stays within `limits`
+        """
+        key = (user_id, class_id)
+        local = self.unflushed_tokens(user_id, class_id)
+        with self._lock:
+            if any(u + local + tokens > limit for u, limit in zip(used, limits)):
+                return None
+            self._reserved[key] = self._reserved.get(key, 0) + tokens
+        return LocalReservation(user_id=user_id, class_id=class_id, tokens=tokens)
+
+    def _drop_reservation(self, reservation: LocalReservation):
+        remaining = self._reserved.get(reservation.key, 0) - reservation.tokens
+        if remaining > 0:
+            self._reserved[reservation.key] = remaining
+        else:
+            self._reserved.pop(reservation.key, None)
+
+    def release(self, reservation: LocalReservation):
+        """Give back a reservation for a request that failed"""
+        with self._lock:
+            self._drop_reservation(reservation)
+
+    def record(self, user_id: int, class_id: int, tokens_used: int, usage_record: Dict[str, Any],
+               reservation: LocalReservation = None) -> bool:
+        """
+        Buffer one turn's usage, settling its reservation. Returns True if a
+        flush is due. Blocks on the journal's fsync, so call it from a worker
+        thread.
+        """
+        with self._lock:
+            if self.journal is not None:
+                try:
+                    self.journal.append({"user_id": user_id, "class_id": class_id,
+                                         "tokens_used": tokens_used, "record": usage_record})
+                except OSError as e:
+                    logger.error(f"Usage journal append failed, turn is buffered in memory only: {e}")
+            if reservation is not None:
+                self._drop_reservation(reservation)
+            self._open.add(user_id, class_id, tokens_used, usage_record)
+            self.events += 1
+            return self.flush_due()
+
+    def flush_due(self) -> bool:
+        return (len(self._open.records) >= self.flush_max_events
+                or (self.clock() - self.last_flush_at) * 1000 >= self.flush_interval_ms)
+
+    def _write(self, batch: UsageBatch, discarded_segments: List[str]):
+        """Write one batch in its own session and transaction; runs in a worker thread"""
+        from app.services.permission_service import PermissionService
+
+        db = self.session_factory()
+        try:
+            permission_service = PermissionService()
+            for (user_id, class_id), tokens in batch.pending.items():
+                permission_service.increment_token_usage(db, user_id, class_id, tokens)
+            if batch.records:
+                db.execute(insert(UsageRecord), batch.records)
+            if batch.segments:
+                db.execute(insert(UsageFlushedSegment), [
+                    {"segment_id": segment_id, "flushed_at": datetime.utcnow()} for segment_id in batch.segments
+                ])
+            if discarded_segments:
+                db.execute(delete(UsageFlushedSegment).where(
+                    UsageFlushedSegment.segment_id.in_(discarded_segments)
+                ))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _set_aside(self, batch: UsageBatch, reason: str):
+        """Stop retrying a batch; called with the lock held"""
+        self._unsettled.remove(batch)
+        self.set_aside_batches += 1
+        if self.journal is not None and batch.segments:
+            self.journal.set_aside(batch.segments)
+            logger.error(f"Usage batch of {batch.rows} rows set aside as {', '.join(batch.segments)}.dead: {reason}")
+        else:
+            logger.error(f"Usage batch of {batch.rows} rows dropped: {reason}")
+
+    async def _write_batch(self, batch: UsageBatch) -> int:
+        with self._lock:
+            discarded = list(self._discarded_segments)
+        try:
+            # The database round trips stay off the event loop
+            await asyncio.get_running_loop().run_in_executor(None, self._write, batch, discarded)
+        except Exception as e:
+            self.failed_flushes += 1
+            batch.attempts += 1
+            with self._lock:
+                if batch.attempts >= self.max_attempts:
+                    self._set_aside(batch, f"failed {batch.attempts} times, last error: {e}")
+                else:
+                    logger.error(f"Usage flush failed (attempt {batch.attempts}), keeping {batch.rows} rows for retry: {e}")
+            return 0
+
+        with self._lock:
+            self._unsettled.remove(batch)
+            self._discarded_segments = [s for s in self._discarded_segments if s not in discarded]
+            if self.journal is not None and batch.segments:
+                self.journal.discard(batch.segments)
+                self._discarded_segments.extend(batch.segments)
+        self.flushes += 1
+        self.rows_written += batch.rows
+        return batch.rows
+
+    async def flush(self) -> int:
+        """Write the buffered batch and any waiting retries, each in one transaction. Returns rows written."""
+        async with self._flush_lock:
+            with self._lock:
+                if self._open.rows:
+                    batch, self._open = self._open, UsageBatch()
+                    if self.journal is not None:
+                        batch.segments = self.journal.rotate()
+                    self._unsettled.append(batch)
+                    while len(self._unsettled) > self.max_unsettled:
+                        self._set_aside(self._unsettled[0], f"more than {self.max_unsettled} batches waiting")
+                self.last_flush_at = self.clock()
+                batches = list(self._unsettled)
+
+            written = 0
+            for batch in batches:
+                written += await self._write_batch(batch)
+            return written
+
+    def _recover(self) -> int:
+        """Queue journal segments left behind by a dead process; returns the turns adopted"""
+        orphans = self.journal.adopt_orphans()
+        if not orphans:
+            return 0
+        db = self.session_factory()
+        try:
+            committed = {segment_id for (segment_id,) in db.query(UsageFlushedSegment.segment_id).filter(
+                UsageFlushedSegment.segment_id.in_([segment_id for segment_id, _ in orphans])
+            )}
+        finally:
+            db.close()
+
+        adopted = 0
+        with self._lock:
+            for segment_id, entries in orphans:
+                if segment_id in committed:
+                    self.journal.discard([segment_id])
+                    self._discarded_segments.append(segment_id)
+                    continue
+                batch = UsageBatch(segments=[segment_id])
+                for entry in entries:
+                    batch.add(entry["user_id"], entry["class_id"], entry["tokens_used"], _decode_record(entry["record"]))
+                self._unsettled.append(batch)
+                adopted += len(entries)
+        if adopted:
+            logger.info(f"Recovered {adopted} journaled usage events")
+        return adopted
+
+    async def recover(self) -> int:
+        if self.journal is None:
+            return 0
+        return await asyncio.get_running_loop().run_in_executor(None, self._recover)
+
+    async def _run(self):
+        try:
+            await self.recover()
+        except Exception as e:
+            logger.error(f"Usage journal recovery failed: {e}")
+        while True:
+            await asyncio.sleep(self.flush_interval_ms / 1000)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Usage flush loop error: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the periodic flush and write out whatever is buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            buffered_records = len(self._open.records) + sum(len(b.records) for b in self._unsettled)
+            buffered_keys = len(self._open.pending)
+            unsettled = len(self._unsettled)
+        return {
+            "events": self.events,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "set_aside_batches": self.set_aside_batches,
+            "rows_written": self.rows_written,
+            "buffered_records": buffered_records,
+            "buffered_trackers": buffered_keys,
+            "unsettled_batches": unsettled,
+        }
+
+@lru_cache()
+def get_usage_aggregator() -> UsageAggregator:
+    from app.database import SessionLocal
+
+    settings = get_settings()
+    return UsageAggregator(
+        session_factory=SessionLocal,
+        flush_interval_ms=settings.USAGE_FLUSH_INTERVAL_MS,
+        flush_max_events=settings.USAGE_FLUSH_MAX_EVENTS,
+        journal=UsageJournal(settings.USAGE_JOURNAL_DIR) if settings.USAGE_JOURNAL_DIR else None,
+        max_attempts=settings.USAGE_FLUSH_MAX_ATTEMPTS,
+        max_unsettled=settings.USAGE_MAX_UNSETTLED_BATCHES
+    )
@@ -0,0 +1,189 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import func, update
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from app.models import UsageRecord, UsageHourlyRollup, UsageDailyRollup, UsageRollupState
+from app.config import get_settings
+from app.utils.sql import dialect_insert
+import asyncio
+import logging
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = {
+    "hour": UsageHourlyRollup,
+    "day": UsageDailyRollup,
+}
+
+# Longest range a single history request may cover, per granularity
+MAX_RANGE = {
+    "hour": timedelta(days=31),
+    "day": timedelta(days=400),
+}
+
+RollupKey = Tuple[datetime, int, int, str, bool]
+
+def hour_bucket(timestamp: datetime) -> datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+def day_bucket(timestamp: datetime) -> datetime:
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+class UsageRollupService:
+    """
+    Maintains hourly and daily usage rollups from usage_records.
+
+    Compaction is incremental: usage records past the stored watermark
+    (by id) are summed per bucket and added to both rollup tables in the
+    same transaction that advances the watermark, so a record is counted
+    exactly once even with several compactors running. A batch stops at the
+    first record newer than ROLLUP_SETTLE_SECONDS, which gives transactions
+    holding lower ids time to commit before the watermark passes them.
+    Buckets are in UTC.
+    """
+
+    def _get_watermark(self, db: Session) -> int:
+        db.execute(dialect_insert(db, UsageRollupState).values(id=1, last_record_id=0).on_conflict_do_nothing())
+        return db.query(UsageRollupState.last_record_id).filter(UsageRollupState.id == 1).scalar()
+
+    def _upsert(self, db: Session, model, totals: Dict[RollupKey, Dict[str, Any]]):
+        for (bucket_start, class_id, user_id, model_name, is_sponsored), values in totals.items():
+            stmt = dialect_insert(db, model).values(
+                bucket_start=bucket_start,
+                class_id=class_id,
+                user_id=user_id,
+                model_name=model_name,
+                is_sponsored=is_sponsored,
+                **values
+            )
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=[model.bucket_start, model.class_id, model.user_id,
+                                model.model_name, model.is_sponsored],
+                set_={
+                    "request_count": model.request_count + stmt.excluded.request_count,
+                    "input_tokens": model.input_tokens + stmt.excluded.input_tokens,
+                    "output_tokens": model.output_tokens + stmt.excluded.output_tokens,
+                    "cost": model.cost + stmt.excluded.cost,
+                }
+            ))
+
+    def compact(self, db: Session, batch_size: int = None, now: datetime = None) -> int:
+        """Fold one batch of new usage records into the rollups. Returns records compacted."""
+        batch_size = batch_size or settings.ROLLUP_BATCH_SIZE
+        cutoff = (now or datetime.utcnow()) - timedelta(seconds=settings.ROLLUP_SETTLE_SECONDS)
+
+        try:
+            watermark = self._get_watermark(db)
+            records = db.query(
+                UsageRecord.id, UsageRecord.timestamp, UsageRecord.class_id, UsageRecord.user_id,
+                UsageRecord.model_name, UsageRecord.is_sponsored, UsageRecord.input_tokens,
+                UsageRecord.output_tokens, UsageRecord.cost
+            ).filter(
+                UsageRecord.id > watermark
+            ).order_by(UsageRecord.id).limit(batch_size).all()
+
+            hourly: Dict[RollupKey, Dict[str, Any]] = {}
+            daily: Dict[RollupKey, Dict[str, Any]] = {}
+            last_record = None
+
+            for record in records:
+                if record.timestamp is None or record.timestamp > cutoff:
+                    break
+
+                key = (record.class_id or 0, record.user_id, record.model_name, bool(record.is_sponsored))
+                for totals, bucket in ((hourly, hour_bucket(record.timestamp)), (daily, day_bucket(record.timestamp))):
+                    entry = totals.setdefault((bucket,) + key, {
+                        "request_count": 0, "input_tokens": 0, "output_tokens": 0, "cost": 0.0
+                    })
+                    entry["request_count"] += 1
+                    entry["input_tokens"] += record.input_tokens or 0
+                    entry["output_tokens"] += record.output_tokens or 0
+                    entry["cost"] += record.cost or 0.0
+
+                last_record = record
+
+            if last_record is None:
+                db.commit()
+                return 0
+
+            # Claim the batch: if another compactor moved the watermark first, back off
+            claimed = db.execute(
+                update(UsageRollupState)
+                .where(UsageRollupState.id == 1, UsageRollupState.last_record_id == watermark)
+                .values(
+                    last_record_id=last_record.id,
+                    last_record_timestamp=last_record.timestamp,
+                    compacted_at=datetime.utcnow()
+                )
+            ).rowcount
+            if claimed != 1:
+                db.rollback()
+                return 0
+
+            self._upsert(db, UsageHourlyRollup, hourly)
+            self._upsert(db, UsageDailyRollup, daily)
+            db.commit()
+            return sum(entry["request_count"] for entry in daily.values())
+
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error compacting usage rollups: {e}")
+            raise
+
+    def compact_all(self, db: Session, now: datetime = None, max_batches: Optional[int] = None) -> int:
+        """Compact until no settled records are left, or for at most `max_batches` batches"""
+        total = 0
+        batches = 0
+        while True:
+            compacted = self.compact(db, now=now)
+            total += compacted
+            batches += 1
+            if compacted < settings.ROLLUP_BATCH_SIZE or (max_batches is not None and batches >= max_batches):
+                return total
+
+    def lag(self, db: Session, now: datetime = None) -> Dict[str, Any]:
+        """How far the rollups trail usage_records"""
+        now = now or datetime.utcnow()
+        state = db.query(UsageRollupState).filter(UsageRollupState.id == 1).first()
+        last_record_id = state.last_record_id if state else 0
+
+        pending, oldest = db.query(func.count(UsageRecord.id), func.min(UsageRecord.timestamp)).filter(
+            UsageRecord.id > last_record_id
+        ).one()
+
+        return {
+            "pending_records": pending,
+            "lag_seconds": round((now - oldest).total_seconds(), 1) if oldest else 0.0,
+            "last_compacted_at": state.compacted_at.isoformat() if state and state.compacted_at else None,
+        }
+
+    def get_history(self, db: Session, granularity: str, start: datetime, end: datetime,
+                    class_id: Optional[int] = None, user_id: Optional[int] = None) -> List[Any]:
+        """Rollup rows in [start, end), oldest first"""
+        model = GRANULARITIES[granularity]
+        query = db.query(model).filter(model.bucket_start >= start, model.bucket_start < end)
+        if class_id is not None:
+            query = query.filter(model.class_id == class_id)
+        if user_id is not None:
+            query = query.filter(model.user_id == user_id)
+        return query.order_by(model.bucket_start, model.class_id, model.user_id, model.model_name).all()
+
+async def run_rollup_compaction(session_factory):
+    """
+    Background loop that keeps the rollups current. Each run is capped at
+    ROLLUP_MAX_BATCHES_PER_RUN batches, so a backlog (the first run
+    backfills all history) is worked off over several runs.
+    """
+    service = UsageRollupService()
+    while True:
+        await asyncio.sleep(settings.ROLLUP_INTERVAL_SECONDS)
+        db = session_factory()
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None, lambda: service.compact_all(db, max_batches=settings.ROLLUP_MAX_BATCHES_PER_RUN)
+            )
+        except Exception as e:
+            logger.error(f"Usage rollup compaction failed: {e}")
+        finally:
+            db.close()
@@ -1,8 +1,8 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, and_
 from datetime import datetime, timedelta
 from typing import List, Dict, Any
-from app.models import ClassUsageTracker, ClassMembership, User, UsageRecord, ChatMessage
+from app.models import ClassUsageTracker, ClassMembership, User, UsageRecord, ChatMessage, ChatSession
 from app.schemas import UsageStats, ClassUsageOverview
 from app.services.permission_service import PermissionService
 import logging
@@ -16,18 +16,12 @@ class UsageService:
     async def get_user_usage_by_class(self, db: Session, user_id: int) -> List[UsageStats]:
         """Get user's usage statistics for all classes they're in"""
         try:
-            # Get all user's memberships
-            memberships = db.query(ClassMembership).filter(
+            # All memberships with their trackers, resets applied at read time
+            rows = self._membership_usage_query(db).filter(
                 ClassMembership.user_id == user_id
-            ).all()
+            ).order_by(ClassMembership.class_id).all()
             
-            usage_stats = []
-            
-            for membership in memberships:
-                stats = await self.get_user_class_usage(db, user_id, membership.class_id)
-                usage_stats.append(stats)
-            
-            return usage_stats
+            return [self._build_stats(membership, *usage) for membership, *usage in rows]
             
         except Exception as e:
             logger.error(f"Error getting user usage by class: {e}")
@@ -36,27 +30,17 @@ class UsageService:
     async def get_user_class_usage(self, db: Session, user_id: int, class_id: int) -> UsageStats:
         """Get user's usage statistics for a specific class"""
         try:
-            # Get or create usage tracker
-            tracker = await self.permission_service.get_usage_tracker(db, user_id, class_id)
-            await self.permission_service.reset_usage_if_needed(db, tracker)
-            
-            # Get membership for limits
-            membership = await self.permission_service.get_user_membership(db, user_id, class_id)
+            # Read-only: a missing tracker means no usage, and due resets read as zero
+            row = self._membership_usage_query(db).filter(
+                ClassMembership.user_id == user_id,
+                ClassMembership.class_id == class_id
+            ).first()
             
-            if not membership:
+            if not row:
                 raise ValueError("User not found in class")
             
-            return UsageStats(
-                daily_tokens_used=tracker.daily_tokens_used,
-                weekly_tokens_used=tracker.weekly_tokens_used,
-                monthly_tokens_used=tracker.monthly_tokens_used,
-                daily_limit=membership.daily_token_limit,
-                weekly_limit=membership.weekly_token_limit,
-                monthly_limit=membership.monthly_token_limit,
-                daily_remaining=max(0, membership.daily_token_limit - tracker.daily_tokens_used),
-                weekly_remaining=max(0, membership.weekly_token_limit - tracker.weekly_tokens_used),
-                monthly_remaining=max(0, membership.monthly_token_limit - tracker.monthly_tokens_used)
-            )
+            membership, *usage = row
+            return self._build_stats(membership, *usage)
             
         except Exception as e:
             logger.error(f"Error getting user class usage: {e}")
@@ -73,42 +57,104 @@ class UsageService:
                 monthly_remaining=15_000_000
             )
     
-    async def get_class_usage_overview(self, db: Session, class_id: int) -> List[ClassUsageOverview]:
-        """Get usage overview for all members of a class"""
+    async def get_class_usage_overview(self, db: Session, class_id: int, limit: int = None, offset: int = 0,
+                                       sort_by: str = "name", descending: bool = False) -> List[ClassUsageOverview]:
+        """
+        Get usage overview for members of a class.
+        
+        One query: memberships joined to users, their trackers (with due
+        resets applied virtually, nothing is written) and each member's
+        latest message in the class.
+        """
         try:
-            # Get all class memberships
-            memberships = db.query(ClassMembership).join(User).filter(
-                ClassMembership.class_id == class_id
-            ).all()
+            daily_used, weekly_used, monthly_used = self.permission_service.current_usage_columns()
             
-            overview = []
+            last_activity = db.query(
+                ChatSession.user_id.label("user_id"),
+                func.max(ChatMessage.timestamp).label("last_activity")
+            ).join(
+                ChatMessage, ChatMessage.session_id == ChatSession.id
+            ).filter(
+                ChatSession.class_id == class_id
+            ).group_by(ChatSession.user_id).subquery()
             
-            for membership in memberships:
-                # Get usage stats for this member
-                usage_stats = await self.get_user_class_usage(
-                    db, membership.user_id, class_id
+            query = db.query(
+                ClassMembership,
+                User,
+                daily_used.label("daily_used"),
+                weekly_used.label("weekly_used"),
+                monthly_used.label("monthly_used"),
+                last_activity.c.last_activity
+            ).join(
+                User, User.id == ClassMembership.user_id
+            ).outerjoin(
+                ClassUsageTracker, and_(
+                    ClassUsageTracker.user_id == ClassMembership.user_id,
+                    ClassUsageTracker.class_id == ClassMembership.class_id
                 )
-                
-                # Get last activity
-                last_activity = db.query(ChatMessage.timestamp).join(
-                    ChatMessage.session
-                ).filter(
-                    ChatMessage.session.has(user_id=membership.user_id, class_id=class_id)
-                ).order_by(ChatMessage.timestamp.desc()).first()
-                
-                member_overview = ClassUsageOverview(
+            ).outerjoin(
+                last_activity, last_activity.c.user_id == ClassMembership.user_id
+            ).filter(
+                ClassMembership.class_id == class_id
+            )
+            
+            sort_columns = {
+                "name": User.name,
+                "daily_usage": daily_used,
+                "weekly_usage": weekly_used,
+                "monthly_usage": monthly_used,
+                "last_activity": last_activity.c.last_activity,
+            }
+            if sort_by not in sort_columns:
+                raise ValueError(f"Unknown sort field: {sort_by}")
+            sort_column = sort_columns[sort_by]
+            query = query.order_by(
+                sort_column.desc() if descending else sort_column.asc(),
+                ClassMembership.user_id
+            )
+            
+            if offset:
+                query = query.offset(offset)
+            if limit is not None:
+                query = query.limit(limit)
+            
+            overview = []
+            for membership, user, daily, weekly, monthly, last_active in query.all():
+                overview.append(ClassUsageOverview(
                     user_id=membership.user_id,
-                    username=membership.user.username,
-                    usage_stats=usage_stats,
+                    user_display_name=user.alias or f"{user.name} {user.surname}",
+                    usage_stats=self._build_stats(membership, daily, weekly, monthly),
                     is_sponsored=membership.is_sponsored,
-                    last_activity=last_activity[0] if last_activity else None
-                )
-                
-                overview.append(member_overview)
+                    last_activity=last_active
+                ))
             
             return overview
             
+        except ValueError:
+            raise
         except Exception as e:
             logger.error(f"Error getting class usage overview: {e}")
             return []
-
+    
+    def _membership_usage_query(self, db: Session):
+        """Memberships with (daily, weekly, monthly) current usage, never writing resets"""
+        daily_used, weekly_used, monthly_used = self.permission_service.current_usage_columns()
+        return db.query(ClassMembership, daily_used, weekly_used, monthly_used).outerjoin(
+            ClassUsageTracker, and_(
+                ClassUsageTracker.user_id == ClassMembership.user_id,
+                ClassUsageTracker.class_id == ClassMembership.class_id
+            )
+        )
+    
+    def _build_stats(self, membership: ClassMembership, daily: int, weekly: int, monthly: int) -> UsageStats:
+        return UsageStats(
+            daily_tokens_used=daily,
+            weekly_tokens_used=weekly,
+            monthly_tokens_used=monthly,
+            daily_limit=membership.daily_token_limit,
+            weekly_limit=membership.weekly_token_limit,
+            monthly_limit=membership.monthly_token_limit,
+            daily_remaining=max(0, membership.daily_token_limit - daily),
+            weekly_remaining=max(0, membership.weekly_token_limit - weekly),
+            monthly_remaining=max(0, membership.monthly_token_limit - monthly)
+        )
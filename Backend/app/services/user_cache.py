@@ -0,0 +1,83 @@
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Tuple
+from app.config import get_settings
+from app.schemas import UserResponse
+import threading
+import time
+
+class UserCache:
+    """
+    Per-process LRU of active-user snapshots for get_current_user.
+
+    An entry is keyed by user id and only serves tokens issued for the same
+    token version, so bumping `users.token_version` (deactivation, account
+    deletion) stops old tokens at the next miss. Entries live for
+    `ttl_seconds`; profile writes in this process invalidate explicitly,
+    other workers see them once the entry expires.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        # user_id -> (stored_at, token_version, snapshot)
+        self._entries: "OrderedDict[int, Tuple[float, int, UserResponse]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, user_id: int, token_version: int) -> Optional[UserResponse]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                stored_at, version, snapshot = entry
+                if self.clock() - stored_at < self.ttl_seconds and version == token_version:
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    # Callers get their own copy; the cached one stays untouched
+                    return snapshot.model_copy()
+                if self.clock() - stored_at >= self.ttl_seconds:
+                    del self._entries[user_id]
+            self.misses += 1
+            return None
+
+    def put(self, user_id: int, token_version: int, snapshot: UserResponse):
+        with self._lock:
+            self._entries[user_id] = (self.clock(), token_version, snapshot.model_copy())
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "entries": len(self._entries),
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+@lru_cache()
+def get_user_cache() -> UserCache:
+    settings = get_settings()
+    return UserCache(
+        max_entries=settings.USER_CACHE_MAX_ENTRIES,
+        ttl_seconds=settings.USER_CACHE_TTL_SECONDS
+    )
+
+def invalidate_user(user_id: int):
+    """Call after committing a change to a user's profile or status"""
+    get_user_cache().invalidate(user_id)
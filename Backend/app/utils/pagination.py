@@ -0,0 +1,22 @@
+from datetime import datetime
+from typing import Any, List
+import base64
+import json
+
+# Opaque cursors: the sort key of the last row on a page, base64-encoded JSON.
+# Datetimes are tagged so they round-trip.
+
+def encode_cursor(*values: Any) -> str:
+    payload = [{"dt": value.isoformat()} if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, size: int) -> List[Any]:
+    """Sort key values from encode_cursor; ValueError if the cursor is malformed"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        values = [datetime.fromisoformat(value["dt"]) if isinstance(value, dict) else value for value in payload]
+    except (ValueError, TypeError, KeyError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor")
+    return values
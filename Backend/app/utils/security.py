@@ -1,20 +1,32 @@
 from passlib.context import CryptContext
 from jose import JWTError, jwt
-from fastapi import HTTPException, status, Depends
+from fastapi import HTTPException, Request, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
 from app.database import get_db
 from app.config import get_settings
 from app.schemas import UserResponse
+from app.services.user_cache import get_user_cache
+import asyncio
 import logging
 import re
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing. Hashes made with a different cost report needs_update,
+# which authenticate_user uses to rehash on the next successful login.
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
+
+# bcrypt releases the GIL, so a few threads keep hashing off the event loop
+# without letting a login storm take every core
+_password_executor = ThreadPoolExecutor(
+    max_workers=settings.PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash"
+)
 
 # Security scheme
 security = HTTPBearer()
@@ -25,6 +37,21 @@ def get_password_hash(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+async def hash_password(password: str) -> str:
+    """get_password_hash on the password executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_executor, pwd_context.hash, password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verify on the password executor. Returns (valid, new_hash); new_hash is
+    set when the password is valid but the stored hash uses an outdated cost.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _password_executor, pwd_context.verify_and_update, plain_password, hashed_password
+    )
+
 def validate_password_strength(password: str) -> dict:
     """
     Validate password meets requirements:
@@ -69,10 +96,21 @@ def _get_display_name(user) -> str:
     return f"{user.name} {user.surname}"
 
 async def get_current_user(
+    request: Request,
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
 ) -> UserResponse:
-    """Get current authenticated user"""
+    """
+    Get current authenticated user.
+
+    The result is kept on request.state.current_user for the rest of the
+    request, and in the per-process user cache for USER_CACHE_TTL_SECONDS,
+    so most requests authenticate without touching the database.
+    """
+    current_user = getattr(request.state, "current_user", None)
+    if current_user is not None:
+        return current_user
+    
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -89,26 +127,37 @@ async def get_current_user(
         if user_id_str is None:
             raise credentials_exception
         
-        # Convert to integer
+        # Convert to integer; tokens issued before versioning count as version 0
         user_id = int(user_id_str)
+        token_version = int(payload.get("ver", 0))
             
     except (JWTError, ValueError):
         raise credentials_exception
     
-    # Get user from database by ID
-    from app.models import User
-    user = db.query(User).filter(User.id == user_id).first()
-    if user is None:
-        raise credentials_exception
+    cache = get_user_cache() if settings.USER_CACHE_ENABLED else None
+    user_response = cache.get(user_id, token_version) if cache else None
     
-    if not user.is_active:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Inactive user"
-        )
+    if user_response is None:
+        # Get user from database by ID
+        from app.models import User
+        user = db.query(User).filter(User.id == user_id).first()
+        if user is None:
+            raise credentials_exception
+        
+        if not user.is_active:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Inactive user"
+            )
+        
+        # Token was issued before the user's tokens were revoked
+        if user.token_version != token_version:
+            raise credentials_exception
+        
+        user_response = UserResponse.model_validate(user)
+        user_response.display_name = _get_display_name(user)
+        if cache:
+            cache.put(user_id, token_version, user_response)
     
-    user_response = UserResponse.model_validate(user)
-    user_response.display_name = _get_display_name(user)
+    request.state.current_user = user_response
     return user_response
-
-
@@ -0,0 +1,17 @@
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects import postgresql, sqlite
+
+_INSERT_BY_DIALECT = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+def dialect_insert(db: Session, model):
+    """
+    INSERT construct for the session's database that supports
+    `on_conflict_do_update` / `on_conflict_do_nothing` (Postgres and SQLite)
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect not in _INSERT_BY_DIALECT:
+        raise NotImplementedError(f"Upserts are not supported on {dialect}")
+    return _INSERT_BY_DIALECT[dialect](model)
@@ -0,0 +1,9 @@
+from datetime import date, datetime
+import pytz
+
+# Token quotas reset at 00:00 Madrid time (daily, Mondays, and the 1st of the month)
+QUOTA_TIMEZONE = pytz.timezone('Europe/Madrid')
+
+def quota_today() -> date:
+    """Current date in the quota timezone"""
+    return datetime.now(QUOTA_TIMEZONE).date()
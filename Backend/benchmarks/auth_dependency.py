@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Benchmark the per-request cost of the get_current_user dependency, with and without the user cache
+Usage: python benchmarks/auth_dependency.py [--requests N] [--users N]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datetime import timedelta
+from fastapi import Request
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from app.models import Base, User
+from app.services.user_cache import get_user_cache
+from app.utils import security
+
+def make_session_factory(path: str):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    counts = {"statements": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        counts["statements"] += 1
+
+    return sessionmaker(bind=engine), counts
+
+def create_tokens(session_factory, users: int):
+    db = session_factory()
+    try:
+        db.add_all([User(email=f"bench{i}@example.com", name="Bench", surname=str(i)) for i in range(users)])
+        db.commit()
+        return [
+            security.create_access_token({"sub": str(user.id), "ver": user.token_version}, timedelta(minutes=30))
+            for user in db.query(User).all()
+        ]
+    finally:
+        db.close()
+
+async def authenticate(session_factory, tokens, requests: int):
+    """One session and one fresh request scope per simulated request, like get_db does"""
+    for i in range(requests):
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=tokens[i % len(tokens)])
+        db = session_factory()
+        try:
+            await security.get_current_user(Request({"type": "http"}), credentials, db)
+        finally:
+            db.close()
+
+def measure(name, cache_enabled, requests, users):
+    security.settings.USER_CACHE_ENABLED = cache_enabled
+    get_user_cache().clear()
+    with tempfile.TemporaryDirectory() as tmp:
+        session_factory, counts = make_session_factory(os.path.join(tmp, "bench.db"))
+        tokens = create_tokens(session_factory, users)
+        counts["statements"] = 0
+        started = time.perf_counter()
+        asyncio.run(authenticate(session_factory, tokens, requests))
+        elapsed = time.perf_counter() - started
+    return {
+        "mode": name,
+        "statements_per_request": round(counts["statements"] / requests, 3),
+        "microseconds_per_request": round(elapsed / requests * 1_000_000, 1),
+        "requests_per_second": round(requests / elapsed, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Auth dependency benchmark")
+    parser.add_argument("--requests", type=int, default=20000, help="Authenticated requests to simulate")
+    parser.add_argument("--users", type=int, default=100, help="Distinct users sending them")
+    parser.add_argument("--json", action="store_true", help="Output results as JSON")
+    args = parser.parse_args()
+
+    results = [
+        measure("uncached", False, args.requests, args.users),
+        measure("cached", True, args.requests, args.users),
+    ]
+    speedup = results[0]["microseconds_per_request"] / max(results[1]["microseconds_per_request"], 0.1)
+
+    if args.json:
+        print(json.dumps({"results": results, "speedup": round(speedup, 1)}, indent=2))
+        return
+
+    print(f"{args.requests} requests from {args.users} users")
+    for result in results:
+        print(f"  {result['mode']:<9} {result['statements_per_request']:>6} queries/request "
+              f"{result['microseconds_per_request']:>9} us/request {result['requests_per_second']:>10} req/s")
+    print(f"  auth dependency {speedup:.1f}x faster with the user cache")
+
+if __name__ == "__main__":
+    main()
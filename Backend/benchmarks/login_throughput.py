@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Benchmark password logins alongside chat traffic: bcrypt on the event loop vs on the password executor
+Usage: python benchmarks/login_throughput.py [--logins N] [--concurrency N] [--chat-interval-ms N]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.config import get_settings
+from app.models import Base, User
+from app.services import auth_service
+from app.services.auth_service import AuthService
+from app.utils.security import pwd_context, verify_and_update_password
+
+PASSWORD = "Benchmark123"
+
+async def verify_on_loop(plain_password, hashed_password):
+    """The old behaviour: bcrypt runs inside the coroutine"""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+def make_session_factory(path: str, users: int):
+    # One connection per login in flight; a blocking pool checkout would stall the loop
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False},
+                           pool_size=users, max_overflow=0)
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    hashed = pwd_context.hash(PASSWORD)
+    db = session_factory()
+    try:
+        db.add_all([User(email=f"login{i}@example.com", name="Login", surname=str(i), hashed_password=hashed)
+                    for i in range(users)])
+        db.commit()
+    finally:
+        db.close()
+    return session_factory
+
+async def chat_traffic(stop: asyncio.Event, interval: float, latencies: list):
+    """Stand-in chat requests: each waits `interval` (an upstream call) and records how late it resumed"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        latencies.append((time.perf_counter() - started - interval) * 1000)
+
+async def run(session_factory, logins: int, concurrency: int, interval: float):
+    service = AuthService()
+    semaphore = asyncio.Semaphore(concurrency)
+    stop = asyncio.Event()
+    latencies = []
+
+    async def login(i):
+        async with semaphore:
+            db = session_factory()
+            try:
+                await service.authenticate_user(db, f"login{i % concurrency}@example.com", PASSWORD)
+            finally:
+                db.close()
+
+    chat = asyncio.create_task(chat_traffic(stop, interval, latencies))
+    started = time.perf_counter()
+    await asyncio.gather(*(login(i) for i in range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await chat
+    return elapsed, latencies
+
+def measure(name, verify, logins, concurrency, interval):
+    auth_service.verify_and_update_password = verify
+    with tempfile.TemporaryDirectory() as tmp:
+        session_factory = make_session_factory(os.path.join(tmp, "bench.db"), concurrency)
+        elapsed, latencies = asyncio.run(run(session_factory, logins, concurrency, interval))
+    latencies.sort()
+    return {
+        "mode": name,
+        "logins_per_second": round(logins / elapsed, 1),
+        "chat_requests": len(latencies),
+        "chat_delay_p50_ms": round(statistics.median(latencies), 1) if latencies else None,
+        "chat_delay_p99_ms": round(latencies[int(len(latencies) * 0.99) - 1], 1) if latencies else None,
+        "chat_delay_max_ms": round(latencies[-1], 1) if latencies else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Login throughput benchmark")
+    parser.add_argument("--logins", type=int, default=64, help="Password logins to perform")
+    parser.add_argument("--concurrency", type=int, default=16, help="Logins in flight at once")
+    parser.add_argument("--chat-interval-ms", type=float, default=5.0, help="Simulated upstream wait per chat request")
+    parser.add_argument("--json", action="store_true", help="Output results as JSON")
+    args = parser.parse_args()
+
+    interval = args.chat_interval_ms / 1000
+    results = [
+        measure("event_loop", verify_on_loop, args.logins, args.concurrency, interval),
+        measure("executor", verify_and_update_password, args.logins, args.concurrency, interval),
+    ]
+
+    if args.json:
+        print(json.dumps({"results": results, "bcrypt_rounds": get_settings().BCRYPT_ROUNDS}, indent=2))
+        return
+
+    print(f"{args.logins} logins (bcrypt cost {get_settings().BCRYPT_ROUNDS}), {args.concurrency} concurrent, chat requests every {args.chat_interval_ms} ms")
+    for result in results:
+        print(f"  {result['mode']:<10} {result['logins_per_second']:>7} logins/s "
+              f"{result['chat_requests']:>6} chat requests, delay p50 {result['chat_delay_p50_ms']} ms "
+              f"p99 {result['chat_delay_p99_ms']} ms max {result['chat_delay_max_ms']} ms")
+
+if __name__ == "__main__":
+    main()
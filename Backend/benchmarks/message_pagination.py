@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Benchmark fetching one page of chat history at increasing depth: OFFSET vs keyset cursors
+Usage: python benchmarks/message_pagination.py [--messages N] [--page-size N] [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from app.models import Base, User, Class, ChatSession, ChatMessage
+from app.services.chat_service import ChatService
+
+def make_session(path: str, messages: int):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    user = User(email="bench@example.com", name="Bench", surname="User")
+    db.add(user)
+    db.flush()
+    class_obj = Class(name="Bench", class_code="BENCH1", owner_id=user.id)
+    db.add(class_obj)
+    db.flush()
+    session = ChatSession(title="Long chat", user_id=user.id, class_id=class_obj.id)
+    db.add(session)
+    db.flush()
+    start = datetime(2026, 1, 1)
+    db.execute(insert(ChatMessage), [
+        {"session_id": session.id, "content": f"message {i} " + "x" * 200, "is_user": i % 2 == 0,
+         "timestamp": start + timedelta(seconds=i)}
+        for i in range(messages)
+    ])
+    db.commit()
+    return db, session.id
+
+def timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(samples), 3)
+
+def main():
+    parser = argparse.ArgumentParser(description="Message history pagination benchmark")
+    parser.add_argument("--messages", type=int, default=20000, help="Messages in the session")
+    parser.add_argument("--page-size", type=int, default=50, help="Messages per page")
+    parser.add_argument("--repeat", type=int, default=20, help="Fetches per measurement (median is reported)")
+    parser.add_argument("--json", action="store_true", help="Output results as JSON")
+    args = parser.parse_args()
+
+    service = ChatService.__new__(ChatService)  # get_messages_page needs no OpenAI client
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db, session_id = make_session(os.path.join(tmp, "bench.db"), args.messages)
+        rows = db.query(ChatMessage.timestamp, ChatMessage.id).filter(
+            ChatMessage.session_id == session_id
+        ).order_by(ChatMessage.timestamp, ChatMessage.id).all()
+
+        for depth in sorted({0, args.messages // 10, args.messages // 2, args.messages - args.page_size}):
+            # Depth counts from the oldest message, which is where OFFSET starts
+            cursor = tuple(rows[depth + args.page_size]) if depth + args.page_size < len(rows) else None
+
+            def offset_page():
+                db.query(ChatMessage).filter(ChatMessage.session_id == session_id).order_by(
+                    ChatMessage.timestamp, ChatMessage.id
+                ).offset(depth).limit(args.page_size).all()
+                db.expunge_all()
+
+            def keyset_page():
+                service.get_messages_page(db, session_id, args.page_size, before=cursor)
+                db.expunge_all()
+
+            results.append({
+                "depth": depth,
+                "offset_ms": timed(offset_page, args.repeat),
+                "keyset_ms": timed(keyset_page, args.repeat),
+            })
+        db.close()
+
+    if args.json:
+        print(json.dumps({"messages": args.messages, "page_size": args.page_size, "results": results}, indent=2))
+        return
+
+    print(f"{args.messages} messages, {args.page_size} per page (median of {args.repeat})")
+    print(f"  {'depth':>7} {'offset ms':>10} {'keyset ms':>10}")
+    for result in results:
+        print(f"  {result['depth']:>7} {result['offset_ms']:>10} {result['keyset_ms']:>10}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark database writes for usage accounting: synchronous vs write-behind
+Usage: python benchmarks/usage_write_qps.py [--messages N] [--users N] [--flush-events N]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from app.models import Base, UsageRecord
+from app.services.permission_service import PermissionService
+from app.services.usage_aggregator import UsageAggregator
+
+def make_session_factory(path: str):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    counts = {"statements": 0, "commits": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        counts["statements"] += 1
+
+    @event.listens_for(engine, "commit")
+    def count_commit(conn):
+        counts["commits"] += 1
+
+    return sessionmaker(bind=engine), counts
+
+def usage_values(user_id: int) -> dict:
+    return {"user_id": user_id, "model_name": "gpt-4o-mini", "operation_type": "chat",
+            "input_tokens": 400, "output_tokens": 200, "cost": 0.0002}
+
+async def run_synchronous(session_factory, messages: int, users: int):
+    """One tracker UPDATE + usage record INSERT + commit per message (the default path)"""
+    service = PermissionService()
+    db = session_factory()
+    try:
+        for i in range(messages):
+            user_id = i % users + 1
+            service.increment_token_usage(db, user_id, 1, 600)
+            db.add(UsageRecord(**usage_values(user_id)))
+            db.commit()
+    finally:
+        db.close()
+
+async def run_write_behind(session_factory, messages: int, users: int, flush_events: int):
+    """Buffer per message, flush summed deltas in batches"""
+    aggregator = UsageAggregator(session_factory, flush_interval_ms=60_000, flush_max_events=flush_events)
+    for i in range(messages):
+        user_id = i % users + 1
+        if aggregator.record(user_id, 1, 600, usage_values(user_id)):
+            await aggregator.flush()
+    await aggregator.stop()
+
+def measure(name, messages, coroutine_factory):
+    with tempfile.TemporaryDirectory() as tmp:
+        session_factory, counts = make_session_factory(os.path.join(tmp, "bench.db"))
+        started = time.perf_counter()
+        asyncio.run(coroutine_factory(session_factory))
+        elapsed = time.perf_counter() - started
+    return {
+        "mode": name,
+        "statements": counts["statements"],
+        "transactions": counts["commits"],
+        "seconds": round(elapsed, 3),
+        "messages_per_second": round(messages / elapsed, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Usage accounting write benchmark")
+    parser.add_argument("--messages", type=int, default=5000, help="Chat turns to account for")
+    parser.add_argument("--users", type=int, default=50, help="Distinct users sending them")
+    parser.add_argument("--flush-events", type=int, default=200, help="Turns buffered per flush")
+    parser.add_argument("--json", action="store_true", help="Output results as JSON")
+    args = parser.parse_args()
+
+    results = [
+        measure("synchronous", args.messages, lambda f: run_synchronous(f, args.messages, args.users)),
+        measure("write_behind", args.messages, lambda f: run_write_behind(f, args.messages, args.users, args.flush_events)),
+    ]
+    reduction = results[0]["transactions"] / max(results[1]["transactions"], 1)
+
+    if args.json:
+        print(json.dumps({"results": results, "transaction_reduction": round(reduction, 1)}, indent=2))
+        return
+
+    print(f"{args.messages} messages from {args.users} users, flush every {args.flush_events} events")
+    for result in results:
+        print(f"  {result['mode']:<13} {result['statements']:>7} statements "
+              f"{result['transactions']:>6} transactions {result['messages_per_second']:>9} msg/s")
+    print(f"  write transactions reduced {reduction:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,7 @@ import logging
 from typing import Dict, Any
 from sqlalchemy.orm import Session
 from app.database import get_db
-from app.models import User, Class, ChatSession, UsageRecord
+from app.models import User, Class, ChatSession, ChatMessage, UsageRecord
 
 logger = logging.getLogger(__name__)
 
@@ -41,8 +41,9 @@ class MetricsCollector:
             from datetime import datetime, timedelta
             yesterday = datetime.utcnow() - timedelta(days=1)
             
-            recent_messages = db.query(ChatSession).filter(
-                ChatSession.updated_at >= yesterday
+            # Time-bounded, so Postgres only reads the newest partitions
+            recent_messages = db.query(ChatMessage).filter(
+                ChatMessage.timestamp >= yesterday
             ).count()
             
             recent_usage = db.query(UsageRecord).filter(
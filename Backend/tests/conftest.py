@@ -1,16 +1,31 @@
 import pytest
 import tempfile
 import shutil
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import os
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, List, Tuple
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm import sessionmaker, Session
+from fastapi import Response
 from fastapi.testclient import TestClient
+
+# No network at startup (signing keys are fetched by the tests that need them)
+# and no usage journal on disk unless a test passes one
+os.environ.setdefault("FIREBASE_PREFETCH_KEYS_ON_STARTUP", "false")
+os.environ.setdefault("USAGE_JOURNAL_DIR", "")
+
 from app.main import app
-from app.database import get_db, Base
-from app.models import User, Class, ClassMembership
-from app.utils.security import get_password_hash
+from app.database import get_db, get_read_db, Base
+from app.models import User, Class, ClassMembership, ChatSession, ChatMessage
+from app.routes.chat import get_session_messages
+from app.schemas import UserResponse
+from app.utils.security import create_access_token
 from app.config import get_settings
+from app.services.membership_cache import get_membership_cache
+from app.services.user_cache import get_user_cache
 import uuid
-import os
 
 TEST_DB_PATH = "./test.db"
 
@@ -35,6 +50,59 @@ def override_get_db():
         db.close()
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
+
+@contextmanager
+def count_queries():
+    """Count SQL statements sent to the test database"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+# Relationships must be loaded with explicit loader options (selectinload /
+# joinedload) in the query that needs them. A lazy load emitting SQL is how
+# N+1 queries start, so any session in the test run refuses them.
+_lazy_loads_allowed = False
+
+@event.listens_for(Session, "do_orm_execute")
+def _raise_on_lazy_load(orm_execute_state):
+    if _lazy_loads_allowed or not orm_execute_state.is_select:
+        return
+    if orm_execute_state.lazy_loaded_from is not None:
+        state = orm_execute_state.lazy_loaded_from
+        raise InvalidRequestError(
+            f"Lazy load from {state.class_.__name__} (id={state.identity}); "
+            "add a loader option to the query"
+        )
+
+@contextmanager
+def allow_lazy_loads():
+    """For tests that touch relationships outside any route or service"""
+    global _lazy_loads_allowed
+    _lazy_loads_allowed = True
+    try:
+        yield
+    finally:
+        _lazy_loads_allowed = False
+
+class FakeClock:
+    """Stand-in for time.monotonic/time.time; tests move `now` by hand"""
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def fake_clock():
+    return FakeClock()
 
 @pytest.fixture(scope="session")
 def test_db_setup():
@@ -54,6 +122,10 @@ def test_db(test_db_setup):
     # Create all tables in the test database
     Base.metadata.create_all(bind=engine)
     
+    # Memberships and users are edited directly in tests, so start each one with cold caches
+    get_membership_cache().clear()
+    get_user_cache().clear()
+    
     try:
         yield db
     finally:
@@ -65,82 +137,130 @@ def client():
     with TestClient(app) as c:
         yield c
 
+class Factory:
+    """
+    Builds users, classes and memberships in a test session. Rows are
+    flushed so their ids are usable, and committed by the test when it is
+    ready; emails and class codes are unique per call.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def user(self, name: str = "Test", surname: str = "User", **fields) -> User:
+        fields.setdefault("email", f"{name.lower()}{uuid.uuid4().hex[:8]}@example.com")
+        user = User(name=name, surname=surname, **fields)
+        self.db.add(user)
+        self.db.flush()
+        return user
+
+    def class_(self, owner: User = None, name: str = "Test Class", **fields) -> Class:
+        """A class owned by `owner` (a new user if not given); the owner isn't made a member"""
+        owner = owner or self.user(surname="Owner")
+        fields.setdefault("class_code", f"T{uuid.uuid4().hex[:7].upper()}")
+        class_obj = Class(name=name, owner_id=owner.id, **fields)
+        self.db.add(class_obj)
+        self.db.flush()
+        return class_obj
+
+    def member(self, user: User, class_obj: Class, **permissions) -> ClassMembership:
+        membership = ClassMembership(user_id=user.id, class_id=class_obj.id, **permissions)
+        self.db.add(membership)
+        self.db.flush()
+        return membership
+
+@pytest.fixture
+def factory(test_db):
+    return Factory(test_db)
+
+def make_class_with_members(factory: Factory, students: int, user_fields: Callable[[int], dict] = None,
+                            member_fields: Callable[[int], dict] = None) -> Tuple[UserResponse, int, List[int]]:
+    """
+    A committed class managed by its owner, with `students` members named
+    "Student 0", "Student 1", ...; `user_fields` and `member_fields` give
+    extra columns for the i-th student. Returns (manager, class id, member
+    ids) with the session emptied, so nothing is already loaded.
+    """
+    owner = factory.user(name="Class", surname="Owner")
+    class_obj = factory.class_(owner, name="Members")
+    factory.member(owner, class_obj, is_manager=True)
+    members = []
+    for i in range(students):
+        student = factory.user(name="Student", surname=str(i), **(user_fields(i) if user_fields else {}))
+        factory.member(student, class_obj, **(member_fields(i) if member_fields else {}))
+        members.append(student.id)
+    manager, class_id = UserResponse.model_validate(owner), class_obj.id
+    factory.db.commit()
+    factory.db.expunge_all()
+    return manager, class_id, members
+
+def make_chat_session(factory: Factory, messages: int,
+                      last_message_at: datetime = datetime(2026, 10, 1)) -> Tuple[UserResponse, int]:
+    """
+    A committed chat session with `messages` alternating user/AI messages
+    ("m0", "m1", ...) ending at `last_message_at`. Pairs share a timestamp,
+    so ordering relies on the id tie-break. Returns (owner, session id).
+    """
+    user = factory.user(name="Chat")
+    class_obj = factory.class_(user, name="Chat")
+    session = ChatSession(title="Chat", user_id=user.id, class_id=class_obj.id,
+                          message_count=messages, last_message_at=last_message_at, updated_at=last_message_at)
+    factory.db.add(session)
+    factory.db.flush()
+    start = last_message_at - timedelta(minutes=messages)
+    for i in range(messages):
+        factory.db.add(ChatMessage(session_id=session.id, content=f"m{i}", is_user=i % 2 == 0,
+                                   timestamp=start + timedelta(minutes=i // 2), tokens_used=i))
+    factory.db.commit()
+    return UserResponse.model_validate(user), session.id
+
+async def fetch_messages(test_db: Session, user: UserResponse, session_id: int, read_db: Session = None, **params):
+    """Call get_session_messages with its query defaults; returns (messages, response headers)"""
+    response = Response()
+    params = {"limit": 50, "before": None, "after": None, "offset": None, **params}
+    messages = await get_session_messages(session_id, response, user, read_db or test_db, test_db, **params)
+    return messages, response.headers
+
+def bearer(user_id: int, version: int = 0) -> dict:
+    """Authorization header with an API token for `user_id`"""
+    token = create_access_token({"sub": str(user_id), "ver": version}, expires_delta=timedelta(minutes=5))
+    return {"Authorization": f"Bearer {token}"}
+
 @pytest.fixture
-def test_user(test_db):
+def test_user(test_db, factory):
     """Create a test user"""
-    user = User(
-        email=f"testuser{uuid.uuid4().hex[:8]}@example.com",
-        username=f"testuser{uuid.uuid4().hex[:8]}",
-        hashed_password=get_password_hash("testpassword"),
-        full_name="Test User",
-        is_active=True
-    )
-    test_db.add(user)
+    user = factory.user(name="Test", surname="Student")
     test_db.commit()
-    test_db.refresh(user)
     return user
 
 @pytest.fixture
-def test_teacher(test_db):
+def test_teacher(test_db, factory):
     """Create a test teacher user"""
-    teacher = User(
-        email=f"testteacher{uuid.uuid4().hex[:8]}@example.com",
-        username=f"testteacher{uuid.uuid4().hex[:8]}",
-        hashed_password=get_password_hash("testpassword"),
-        full_name="Test Teacher",
-        is_active=True
-    )
-    test_db.add(teacher)
+    teacher = factory.user(name="Test", surname="Teacher")
     test_db.commit()
-    test_db.refresh(teacher)
     return teacher
 
 @pytest.fixture
-def test_class(test_db, test_teacher):
-    """Create a test class"""
-    test_class = Class(
-        name="Test Class",
-        description="A test class for testing",
-        class_code=f"TEST{uuid.uuid4().hex[:4].upper()}",
-        owner_id=test_teacher.id,
-        is_active=True
+def test_class(test_db, factory, test_teacher):
+    """Create a test class, managed by the test teacher"""
+    test_class = factory.class_(test_teacher, description="A test class for testing")
+    factory.member(
+        test_teacher, test_class, is_manager=True, can_read=True, can_chat=True,
+        can_share_class=True, can_upload_documents=True, max_concurrent_chats=10
     )
-    test_db.add(test_class)
-    test_db.flush()
-    
-    # Add teacher as manager
-    teacher_membership = ClassMembership(
-        user_id=test_teacher.id,
-        class_id=test_class.id,
-        is_manager=True,
-        can_read=True,
-        can_chat=True,
-        can_share_class=True,
-        can_upload_documents=True,
-        max_concurrent_chats=10
-    )
-    test_db.add(teacher_membership)
     test_db.commit()
     test_db.refresh(test_class)
     return test_class
 
 @pytest.fixture
-def auth_headers_student(client, test_user):
+def auth_headers_student(test_user):
     """Get authentication headers for test student"""
-    login_data = {"username": test_user.username, "password": "testpassword"}
-    response = client.post("/api/v1/auth/login", json=login_data)
-    assert response.status_code == 200, f"Login failed: {response.json()}"
-    token = response.json()["access_token"]
-    return {"Authorization": f"Bearer {token}"}
+    return bearer(test_user.id)
 
 @pytest.fixture
-def auth_headers_teacher(client, test_teacher):
+def auth_headers_teacher(test_teacher):
     """Get authentication headers for test teacher"""
-    login_data = {"username": test_teacher.username, "password": "testpassword"}
-    response = client.post("/api/v1/auth/login", json=login_data)
-    assert response.status_code == 200, f"Login failed: {response.json()}"
-    token = response.json()["access_token"]
-    return {"Authorization": f"Bearer {token}"}
+    return bearer(test_teacher.id)
 
 @pytest.fixture
 def temp_upload_dir():
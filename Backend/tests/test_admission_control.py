@@ -0,0 +1,64 @@
+import pytest
+import asyncio
+from app.services.admission_control import AdmissionController, AIMDWindow, TokenBucket, LLMOverloadedError
+
+def make_controller(concurrency=1, rpm=600, tpm=100_000, timeout=0.5, max_queue=10):
+    window = AIMDWindow(initial=concurrency, minimum=1, maximum=concurrency, target_latency_ms=10_000)
+    return AdmissionController(rpm, tpm, window, queue_timeout=timeout, max_queue_per_class=max_queue)
+
+def test_token_bucket_refills_over_time(fake_clock):
+    """Test token bucket wait time and refill"""
+    bucket = TokenBucket(60, fake_clock)  # 1 token per second
+    bucket.take(60)
+    assert bucket.wait_time(5) == pytest.approx(5.0)
+
+    fake_clock.now = 5.0
+    assert bucket.wait_time(5) == 0
+
+def test_aimd_window_backs_off_and_recovers():
+    """Test multiplicative decrease on overload and additive increase on success"""
+    window = AIMDWindow(initial=8, minimum=1, maximum=8, target_latency_ms=1000)
+    window.on_overload()
+    assert window.limit == 4
+
+    for _ in range(20):
+        window.on_success(latency_ms=100)
+    assert window.limit > 4
+
+    window.on_success(latency_ms=5000)
+    assert window.limit < 8
+
+@pytest.mark.asyncio
+async def test_queue_is_fair_across_classes():
+    """Test that a busy class cannot starve another class"""
+    controller = make_controller(concurrency=1)
+    await controller.acquire(1, 10)
+
+    order = []
+
+    async def request(class_id):
+        await controller.acquire(class_id, 10)
+        order.append(class_id)
+
+    tasks = [asyncio.create_task(request(1)) for _ in range(3)]
+    tasks.append(asyncio.create_task(request(2)))
+    await asyncio.sleep(0)
+
+    for _ in range(4):
+        controller.release()
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+
+    assert order[:2] == [1, 2]
+
+@pytest.mark.asyncio
+async def test_queue_timeout_raises_overloaded():
+    """Test that waiting past the queue timeout yields a Retry-After hint"""
+    controller = make_controller(concurrency=1, timeout=0.05)
+    await controller.acquire(1, 10)
+
+    with pytest.raises(LLMOverloadedError) as exc_info:
+        await controller.acquire(1, 10)
+
+    assert exc_info.value.retry_after >= 1
+    assert controller.queued == 0
@@ -0,0 +1,120 @@
+import pytest
+from fastapi import HTTPException
+from starlette.datastructures import UploadFile
+from io import BytesIO
+from app.models import User, ClassMembership
+from app.routes.permissions import bulk_update_members, import_members
+from app.schemas import BulkPermissionUpdate, UserResponse
+from app.services.permission_service import PermissionService
+from tests.conftest import count_queries, make_class_with_members
+
+def sponsor_evens(i):
+    return {"is_sponsored": i % 2 == 0}
+
+def memberships(test_db, class_id):
+    test_db.expire_all()
+    return {m.user_id: m for m in test_db.query(ClassMembership).filter(ClassMembership.class_id == class_id)}
+
+@pytest.mark.asyncio
+async def test_filtered_update_is_one_statement(test_db, factory):
+    """Test that a filtered change is a single UPDATE and leaves managers alone"""
+    manager, class_id, members = make_class_with_members(factory, 6, member_fields=sponsor_evens)
+    await PermissionService().get_user_membership(test_db, manager.id, class_id)  # warm the cache
+    body = BulkPermissionUpdate.model_validate({
+        "members": {"is_sponsored": True},
+        "changes": {"can_chat": False, "daily_token_limit": 500}
+    })
+
+    with count_queries() as statements:
+        result = await bulk_update_members(class_id, body, manager, test_db)
+    assert sum(s.lstrip().upper().startswith("UPDATE") for s in statements) == 1
+    assert result.updated == 3
+    assert result.fields == ["can_chat", "daily_token_limit"]
+
+    rows = memberships(test_db, class_id)
+    assert rows[manager.id].can_chat is True
+    for i, user_id in enumerate(members):
+        assert rows[user_id].can_chat is (i % 2 == 1)
+        assert (rows[user_id].daily_token_limit == 500) is (i % 2 == 0)
+
+@pytest.mark.asyncio
+async def test_explicit_list_and_cache_invalidation(test_db, factory):
+    """Test that only listed members change and cached memberships see it"""
+    manager, class_id, members = make_class_with_members(factory, 4, member_fields=sponsor_evens)
+    service = PermissionService()
+    for user_id in members:
+        assert (await service.get_user_membership(test_db, user_id, class_id)).can_upload_documents
+
+    body = BulkPermissionUpdate.model_validate({
+        "members": {"user_ids": members[:2]},
+        "changes": {"can_upload_documents": False}
+    })
+    result = await bulk_update_members(class_id, body, manager, test_db)
+    assert result.updated == 2
+
+    uploads = [(await service.get_user_membership(test_db, user_id, class_id)).can_upload_documents
+               for user_id in members]
+    assert uploads == [False, False, True, True]
+
+@pytest.mark.asyncio
+async def test_invalid_limits_and_non_managers_are_rejected(test_db, factory):
+    """Test that out-of-order limits and null flags are a 400 and students can't bulk update"""
+    manager, class_id, members = make_class_with_members(factory, 2, member_fields=sponsor_evens)
+    body = BulkPermissionUpdate.model_validate({
+        "changes": {"daily_token_limit": 1000, "weekly_token_limit": 500}
+    })
+    with pytest.raises(HTTPException) as error:
+        await bulk_update_members(class_id, body, manager, test_db)
+    assert error.value.status_code == 400
+
+    body = BulkPermissionUpdate.model_validate({"changes": {"can_chat": None}})
+    with pytest.raises(HTTPException) as error:
+        await bulk_update_members(class_id, body, manager, test_db)
+    assert error.value.status_code == 400
+
+    student = UserResponse.model_validate(test_db.get(User, members[0]))
+    body = BulkPermissionUpdate.model_validate({"changes": {"can_chat": False}})
+    with pytest.raises(HTTPException) as error:
+        await bulk_update_members(class_id, body, student, test_db)
+    assert error.value.status_code == 403
+
+@pytest.mark.asyncio
+async def test_single_limit_is_checked_against_stored_limits(test_db, factory):
+    """Test that raising only the daily limit above the stored weekly limit is a 400"""
+    manager, class_id, members = make_class_with_members(factory, 2, member_fields=sponsor_evens)
+    before = {user_id: m.daily_token_limit for user_id, m in memberships(test_db, class_id).items()}
+    body = BulkPermissionUpdate.model_validate({"changes": {"daily_token_limit": 10**9}})
+    with pytest.raises(HTTPException) as error:
+        await bulk_update_members(class_id, body, manager, test_db)
+    assert error.value.status_code == 400
+    assert {user_id: m.daily_token_limit for user_id, m in memberships(test_db, class_id).items()} == before
+
+    weekly = memberships(test_db, class_id)[members[0]].weekly_token_limit
+    body = BulkPermissionUpdate.model_validate({"changes": {"daily_token_limit": weekly}})
+    assert (await bulk_update_members(class_id, body, manager, test_db)).updated == 2
+
+@pytest.mark.asyncio
+async def test_csv_import_summary(test_db, factory):
+    """Test that a roster import enrols new users and reports everything else"""
+    manager, class_id, members = make_class_with_members(factory, 1, member_fields=sponsor_evens)
+    existing = test_db.get(User, members[0]).email
+    newcomers = [factory.user(name="New", surname=str(i)) for i in range(3)]
+    test_db.commit()
+    new_ids = [u.id for u in newcomers]
+    await PermissionService().get_user_membership(test_db, new_ids[0], class_id)  # caches "not a member"
+
+    roster = "email\n" + "\n".join(
+        [u.email.upper() for u in newcomers] + [newcomers[0].email, existing, "ghost@example.com", "not-an-email", ""]
+    )
+    upload = UploadFile(BytesIO(roster.encode()), filename="roster.csv")
+    result = await import_members(class_id, upload, manager, test_db)
+
+    assert result.enrolled == 3
+    assert result.already_members == 1
+    assert result.unmatched == 1
+    assert "ghost@example.com" not in result.model_dump_json()
+    assert result.invalid_rows == ["not-an-email"]
+
+    rows = memberships(test_db, class_id)
+    assert all(rows[user_id].can_chat and not rows[user_id].is_manager for user_id in new_ids)
+    assert await PermissionService().get_user_membership(test_db, new_ids[0], class_id) is not None
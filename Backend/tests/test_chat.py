@@ -62,7 +62,13 @@ def test_send_message(mock_generate, client, auth_headers_student, test_user, te
     test_db.refresh(session)
     
     # Mock AI response
-    mock_generate.return_value = ("This is a test AI response", 100)
+    from app.services.openai_service import CompletionResult
+    mock_generate.return_value = CompletionResult(
+        content="This is a test AI response",
+        model="gpt-4o-mini",
+        prompt_tokens=80,
+        completion_tokens=20
+    )
     
     message_data = {"content": "What is physics?"}
     response = client.post(
@@ -74,6 +80,7 @@ def test_send_message(mock_generate, client, auth_headers_student, test_user, te
     data = response.json()
     assert data["user_message"]["content"] == message_data["content"]
     assert data["ai_response"]["content"] == "This is a test AI response"
+    assert data["ai_response"]["tokens_used"] == 100
 
 def test_get_session_messages(client, auth_headers_student, test_user, test_class, test_db):
     """Test getting messages from a session"""
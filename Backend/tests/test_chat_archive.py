@@ -0,0 +1,125 @@
+import os
+import pytest
+from unittest.mock import AsyncMock, patch
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from app.models import ChatSession, ChatMessage, Class, User
+from app.routes.chat import send_message
+from app.schemas import MessageCreate
+from app.services.chat_archive_service import ChatArchiveService, settings
+from app.services.openai_service import CompletionResult
+from tests.conftest import TEST_DB_PATH, make_chat_session, fetch_messages
+
+NOW = datetime(2027, 6, 1)
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "CHAT_ARCHIVE_IDLE_DAYS", 30)
+    monkeypatch.setattr(settings, "CHAT_ARCHIVE_MIN_MESSAGES", 4)
+    return ChatArchiveService(str(tmp_path))
+
+def blobs(archive):
+    return [name for _, _, names in os.walk(archive.storage_dir) for name in names]
+
+def hot_messages(test_db, session_id):
+    return test_db.query(ChatMessage).filter(ChatMessage.session_id == session_id).count()
+
+def test_only_idle_sessions_with_enough_messages_are_archived(test_db, factory, archive):
+    """Test that archival leaves a stub session and one blob, and skips active or short sessions"""
+    _, idle_id = make_chat_session(factory, 6, NOW - timedelta(days=40))
+    _, recent_id = make_chat_session(factory, 6, NOW - timedelta(days=5))
+    _, short_id = make_chat_session(factory, 2, NOW - timedelta(days=40))
+
+    assert idle_id in archive.idle_session_ids(test_db, NOW)
+    assert {recent_id, short_id}.isdisjoint(archive.idle_session_ids(test_db, NOW))
+    assert archive.archive_session(test_db, idle_id, NOW)
+
+    stub = test_db.get(ChatSession, idle_id)
+    assert stub.archived_at == NOW
+    assert stub.message_count == 6
+    assert os.path.exists(os.path.join(archive.storage_dir, stub.archive_key))
+    assert hot_messages(test_db, idle_id) == 0
+    assert hot_messages(test_db, recent_id) == 6
+
+def test_archiving_loses_to_a_new_message(test_db, factory, archive):
+    """Test that a session that becomes active again is not archived"""
+    _, session_id = make_chat_session(factory, 6, NOW - timedelta(days=40))
+    session = test_db.get(ChatSession, session_id)
+    # Simulates a message arriving after the idle check
+    session.last_message_at = NOW
+    test_db.commit()
+
+    assert not archive.archive_session(test_db, session_id, NOW)
+    assert hot_messages(test_db, session_id) == 6
+    assert test_db.get(ChatSession, session_id).archived_at is None
+
+@pytest.mark.asyncio
+async def test_opening_an_archived_session_rehydrates_it(test_db, factory, archive, monkeypatch):
+    """Test that history reads restore the same messages, ids and cursors"""
+    user, session_id = make_chat_session(factory, 8, NOW - timedelta(days=40))
+    before, headers = await fetch_messages(test_db, user, session_id, limit=3)
+    cursor = headers["X-Before-Cursor"]
+    archive.archive_session(test_db, session_id, NOW)
+    blob = os.path.join(archive.storage_dir, test_db.get(ChatSession, session_id).archive_key)
+
+    monkeypatch.setattr(settings, "CHAT_ARCHIVE_DIR", archive.storage_dir)
+    after, _ = await fetch_messages(test_db, user, session_id, limit=3)
+    assert [(m.id, m.content, m.timestamp, m.tokens_used) for m in after] == \
+           [(m.id, m.content, m.timestamp, m.tokens_used) for m in before]
+
+    older, _ = await fetch_messages(test_db, user, session_id, limit=3, before=cursor)
+    assert [m.content for m in older] == ["m2", "m3", "m4"]
+    assert test_db.get(ChatSession, session_id).archived_at is None
+    assert hot_messages(test_db, session_id) == 8
+    assert not os.path.exists(blob)
+
+@pytest.mark.asyncio
+async def test_rehydration_does_not_write_through_the_read_session(test_db, factory, archive, monkeypatch):
+    """Test that an archived session opened on a read-only replica is restored on the primary"""
+    user, session_id = make_chat_session(factory, 6, NOW - timedelta(days=40))
+    archive.archive_session(test_db, session_id, NOW)
+    monkeypatch.setattr(settings, "CHAT_ARCHIVE_DIR", archive.storage_dir)
+
+    replica = create_engine(f"sqlite:///file:{os.path.abspath(TEST_DB_PATH)}?mode=ro&uri=true")
+    read_db = Session(bind=replica)
+    try:
+        messages, _ = await fetch_messages(test_db, user, session_id, read_db=read_db)
+    finally:
+        read_db.close()
+        replica.dispose()
+
+    assert [m.content for m in messages] == [f"m{i}" for i in range(6)]
+    assert hot_messages(test_db, session_id) == 6
+
+def test_failed_archive_leaves_no_blob(test_db, factory, archive):
+    """Test that the blob is removed when the archiving transaction fails"""
+    _, session_id = make_chat_session(factory, 6, NOW - timedelta(days=40))
+
+    with patch.object(test_db, "commit", side_effect=RuntimeError("database unavailable")):
+        with pytest.raises(RuntimeError):
+            archive.archive_session(test_db, session_id, NOW)
+
+    assert blobs(archive) == []
+    assert test_db.get(ChatSession, session_id).archived_at is None
+    assert hot_messages(test_db, session_id) == 6
+
+@pytest.mark.asyncio
+async def test_sending_to_an_archived_session_rehydrates_it_first(test_db, factory, archive, monkeypatch):
+    """Test that a new turn lands after the restored history"""
+    now = datetime.utcnow()
+    user, session_id = make_chat_session(factory, 6, now - timedelta(days=40))
+    session = test_db.get(ChatSession, session_id)
+    factory.member(test_db.get(User, user.id), test_db.get(Class, session.class_id), is_sponsored=True)
+    test_db.commit()
+    archive.archive_session(test_db, session_id, now)
+    monkeypatch.setattr(settings, "CHAT_ARCHIVE_DIR", archive.storage_dir)
+
+    completion = CompletionResult(content="Physics is...", model="gpt-4o-mini", prompt_tokens=20, completion_tokens=10)
+    with patch("app.services.openai_service.OpenAIService.generate_response", new=AsyncMock(return_value=completion)):
+        await send_message(session_id, MessageCreate(content="What is physics?"), user, test_db)
+
+    assert test_db.get(ChatSession, session_id).archived_at is None
+    messages, _ = await fetch_messages(test_db, user, session_id)
+    assert [m.content for m in messages] == [f"m{i}" for i in range(6)] + ["What is physics?", "Physics is..."]
+    assert blobs(archive) == []
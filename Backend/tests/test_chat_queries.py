@@ -0,0 +1,62 @@
+import pytest
+from unittest.mock import AsyncMock, patch
+from app.models import ChatSession, Document, DocumentChunk, DocumentScope, ProcessingStatus
+from app.services.chat_service import ChatService
+from app.services.openai_service import CompletionResult
+from app.services.permission_service import PermissionService
+from tests.conftest import count_queries
+
+def add_documents(test_db, test_class, session, count):
+    for i in range(count):
+        doc = Document(
+            filename=f"doc{i}.txt",
+            original_filename=f"doc{i}.txt",
+            file_path=f"/tmp/doc{i}.txt",
+            file_type="txt",
+            file_size=10,
+            scope=DocumentScope.CLASS,
+            class_id=test_class.id,
+            processing_status=ProcessingStatus.COMPLETED
+        )
+        test_db.add(doc)
+        test_db.flush()
+        for j in range(4):
+            test_db.add(DocumentChunk(
+                document_id=doc.id, content=f"chunk {i}.{j}", chunk_index=j, char_start=0, char_end=10
+            ))
+    test_db.commit()
+
+async def send(test_db, user_id, session):
+    """Run the chat hot path: authorization context, permission check, send"""
+    permission_service = PermissionService()
+    auth_context = await permission_service.get_chat_context(test_db, user_id, session.class_id)
+    can_chat, _ = await permission_service.can_user_chat(test_db, user_id, session.class_id, auth_context)
+    assert can_chat
+    return await ChatService().send_message(test_db, session, "What is physics?", user_id, auth_context)
+
+@pytest.mark.asyncio
+async def test_send_message_uses_constant_round_trips(test_db, factory):
+    """Test that a chat turn issues a small, fixed number of queries"""
+    test_user = factory.user(name="Chat")
+    test_class = factory.class_(name="Physics")
+    factory.member(test_user, test_class, is_sponsored=True)
+    session = ChatSession(title="Queries", user_id=test_user.id, class_id=test_class.id)
+    test_db.add(session)
+    test_db.commit()
+
+    completion = CompletionResult(content="Physics is...", model="gpt-4o-mini", prompt_tokens=20, completion_tokens=10)
+    with patch("app.services.openai_service.OpenAIService.generate_response", new=AsyncMock(return_value=completion)):
+        # First turn creates the usage tracker
+        await send(test_db, test_user.id, session)
+
+        add_documents(test_db, test_class, session, 1)
+        with count_queries() as few_docs:
+            response = await send(test_db, test_user.id, session)
+        assert response.context_provided
+
+        add_documents(test_db, test_class, session, 5)
+        with count_queries() as many_docs:
+            await send(test_db, test_user.id, session)
+
+    assert len(many_docs) == len(few_docs)
+    assert len(few_docs) <= 12
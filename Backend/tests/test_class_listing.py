@@ -0,0 +1,79 @@
+import pytest
+from app.models import Class, ClassMembership
+from app.routes.classes import create_class, join_class, get_user_classes, get_class_details, update_class_settings
+from app.schemas import ClassCreate, ClassSettingsUpdate, JoinClassRequest, UserResponse
+from tests.conftest import count_queries
+
+def enroll(factory, student, classes: int, members_each: int):
+    """Put `student` in `classes` classes that each have `members_each` members"""
+    class_ids = []
+    for _ in range(classes):
+        class_obj = factory.class_(name="Listed")
+        factory.member(student, class_obj)
+        for _ in range(members_each - 1):
+            factory.member(factory.user(), class_obj)
+        class_ids.append(class_obj.id)
+    factory.db.commit()
+    return class_ids
+
+@pytest.mark.asyncio
+async def test_listing_cost_does_not_grow_with_classes(test_db, factory):
+    """Test that listing classes is one query however many classes there are"""
+    few, many = factory.user(), factory.user()
+    enroll(factory, few, 1, 2)
+    enroll(factory, many, 6, 3)
+    few, many = UserResponse.model_validate(few), UserResponse.model_validate(many)
+
+    with count_queries() as few_statements:
+        await get_user_classes(few, test_db)
+    with count_queries() as many_statements:
+        classes = await get_user_classes(many, test_db)
+
+    assert len(few_statements) == len(many_statements) == 1
+    assert [c.member_count for c in classes] == [3] * 6
+
+@pytest.mark.asyncio
+async def test_inactive_classes_are_hidden(test_db, factory):
+    """Test that soft-deleted classes drop out of the listing"""
+    student = factory.user()
+    class_ids = enroll(factory, student, 2, 1)
+    test_db.query(Class).filter(Class.id == class_ids[0]).update({"is_active": False})
+    test_db.commit()
+
+    classes = await get_user_classes(UserResponse.model_validate(student), test_db)
+    assert [c.id for c in classes] == [class_ids[1]]
+
+@pytest.mark.asyncio
+async def test_details_include_member_count(test_db, factory):
+    """Test that class details count members alongside the class row"""
+    student = factory.user()
+    class_id = enroll(factory, student, 1, 4)[0]
+    details = await get_class_details(class_id, UserResponse.model_validate(student), test_db)
+    assert details.member_count == 4
+
+@pytest.mark.asyncio
+async def test_manager_updates_class_settings(test_db, factory):
+    """Test that a manager's settings update succeeds and is persisted"""
+    manager = factory.user()
+    class_id = enroll(factory, manager, 1, 1)[0]
+    test_db.query(ClassMembership).filter(ClassMembership.class_id == class_id).update({"is_manager": True})
+    test_db.commit()
+
+    update = ClassSettingsUpdate(response_cache_enabled=False, response_cache_ttl_seconds=120)
+    result = await update_class_settings(class_id, update, UserResponse.model_validate(manager), test_db)
+    assert result.response_cache_enabled is False
+    assert result.response_cache_ttl_seconds == 120
+
+    test_db.expire_all()
+    class_obj = test_db.get(Class, class_id)
+    assert (class_obj.response_cache_enabled, class_obj.response_cache_ttl_seconds) == (False, 120)
+
+@pytest.mark.asyncio
+async def test_create_and_join_class(test_db, factory):
+    """Test that creating and joining a class both succeed and count members"""
+    owner, student = factory.user(), factory.user()
+    test_db.commit()
+    created = await create_class(ClassCreate(name="Physics"), UserResponse.model_validate(owner), test_db)
+    joined = await join_class(JoinClassRequest(class_code=created.class_code), UserResponse.model_validate(student), test_db)
+    assert created.member_count == 1
+    assert (joined.id, joined.member_count) == (created.id, 2)
@@ -0,0 +1,35 @@
+import pytest
+from sqlalchemy.exc import InvalidRequestError
+from app.models import ClassMembership
+from app.routes.permissions import get_class_members, update_member_permissions
+from app.schemas import PermissionUpdate
+from tests.conftest import count_queries, allow_lazy_loads, make_class_with_members
+
+@pytest.mark.asyncio
+async def test_member_list_loads_users_with_memberships(test_db, factory):
+    """Test that listing members doesn't query each member's user"""
+    manager, class_id, members = make_class_with_members(factory, 10, user_fields=lambda i: {"alias": "Nick"} if i == 0 else {})
+
+    with count_queries() as statements:
+        result = await get_class_members(class_id, manager, test_db)
+    assert len(statements) == 2  # manager check + members with users
+    assert [m.user_display_name for m in result] == ["Class Owner", "Nick"] + [f"Student {i}" for i in range(1, 10)]
+
+@pytest.mark.asyncio
+async def test_member_update_returns_display_name(test_db, factory):
+    """Test that the updated membership comes back with its user"""
+    manager, class_id, members = make_class_with_members(factory, 2)
+    result = await update_member_permissions(
+        class_id, members[1], PermissionUpdate(can_chat=False), manager, test_db
+    )
+    assert result.user_display_name == "Student 1"
+    assert result.can_chat is False
+
+def test_lazy_loads_fail_in_tests(test_db, factory):
+    """Test that touching an unloaded relationship raises instead of querying"""
+    manager, class_id, members = make_class_with_members(factory, 1)
+    membership = test_db.query(ClassMembership).filter(ClassMembership.user_id == members[0]).one()
+    with pytest.raises(InvalidRequestError):
+        membership.class_obj
+    with allow_lazy_loads():
+        assert membership.class_obj.id == class_id
@@ -0,0 +1,73 @@
+import pytest
+import threading
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from app.database import create_db_engine, settings
+from app.db_metrics import DatabaseMetrics, track_request_queries
+from app.metrics import collect_metrics
+
+@pytest.fixture
+def small_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "DB_POOL_SIZE", 1)
+    monkeypatch.setattr(settings, "DB_MAX_OVERFLOW", 0)
+    monkeypatch.setattr(settings, "DB_POOL_TIMEOUT_SECONDS", 0.2)
+    metrics = DatabaseMetrics("pool_test")
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'pool.db'}", metrics)
+    yield engine, metrics
+    engine.dispose()
+
+def test_pool_is_configured_from_settings(small_pool):
+    """Test that pool size, overflow and LIFO come from Settings"""
+    engine, metrics = small_pool
+    assert engine.pool.size() == 1
+    assert engine.pool._max_overflow == 0
+    assert engine.pool._pool.use_lifo is True
+
+def test_in_use_connections_and_checkout_waits(small_pool):
+    """Test that held connections are counted and an exhausted pool times out"""
+    engine, metrics = small_pool
+    held = engine.connect()
+    assert metrics.stats()["connections_in_use"] == 1
+
+    errors = []
+    def checkout():
+        try:
+            engine.connect().close()
+        except PoolTimeoutError as e:
+            errors.append(e)
+    worker = threading.Thread(target=checkout)
+    worker.start()
+    worker.join()
+    assert len(errors) == 1
+
+    held.close()
+    engine.connect().close()
+    stats = metrics.stats()
+    assert stats["connections_in_use"] == 0
+    assert stats["max_connections_in_use"] == 1
+    assert stats["checkouts"] == 2
+    assert stats["checkout_timeouts"] == 1
+
+def test_queries_are_attributed_to_requests(small_pool):
+    """Test that each request's query count lands in the per-request percentiles"""
+    engine, metrics = small_pool
+    for queries in (1, 3, 5):
+        with track_request_queries() as request:
+            with engine.connect() as conn:
+                for _ in range(queries):
+                    conn.execute(text("SELECT 1"))
+        assert request.count == queries
+
+    engine.connect().execute(text("SELECT 1"))  # outside any request
+    stats = metrics.stats()
+    assert stats["queries"] == 10
+    assert stats["requests"] == 3
+    assert stats["queries_per_request_p50"] == 3
+    assert stats["queries_per_request_max"] == 5
+
+def test_metrics_endpoint_reports_database(client):
+    """Test that the primary engine's stats are on the metrics endpoint"""
+    client.get("/health")
+    database = collect_metrics()["database"]
+    assert database["requests"] >= 1
+    assert "checkout_wait_ms_avg" in database
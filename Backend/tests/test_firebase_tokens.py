@@ -0,0 +1,155 @@
+import json
+import pytest
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from jose import jwt
+from app.services.firebase_tokens import SigningKeyCache, FirebaseTokenVerifier, UNKNOWN_KID_REFETCH_SECONDS
+
+PROJECT_ID = "studhelper-test"
+
+@pytest.fixture
+def clock(fake_clock):
+    """Token expiry is checked against the clock, so start it at wall-clock time"""
+    fake_clock.now = time.time()
+    return fake_clock
+
+def make_key_pair(kid: str):
+    """Private key PEM and a self-signed certificate PEM, like Google publishes"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, kid)])
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name)
+            .public_key(key.public_key()).serial_number(x509.random_serial_number())
+            .not_valid_before(datetime.utcnow() - timedelta(days=1))
+            .not_valid_after(datetime.utcnow() + timedelta(days=1))
+            .sign(key, hashes.SHA256()))
+    private_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption()).decode()
+    return private_pem, cert.public_bytes(serialization.Encoding.PEM).decode()
+
+KEYS = {kid: make_key_pair(kid) for kid in ("key-1", "key-2")}
+
+@pytest.fixture
+def key_server():
+    """Local stand-in for Google's certificate endpoint"""
+    state = {"kids": ["key-1"], "max_age": 3600, "requests": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            state["requests"] += 1
+            body = json.dumps({kid: KEYS[kid][1] for kid in state["kids"]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Cache-Control", f"public, max-age={state['max_age']}, must-revalidate")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state["url"] = f"http://127.0.0.1:{server.server_port}/certs"
+    yield state
+    server.shutdown()
+
+def make_verifier(key_server, clock):
+    key_cache = SigningKeyCache(key_server["url"], refresh_ahead_seconds=300, clock=clock)
+    return FirebaseTokenVerifier(PROJECT_ID, key_cache, max_cached_tokens=100, clock=clock)
+
+def make_token(kid="key-1", lifetime=3600, **overrides):
+    now = int(time.time())
+    claims = {
+        "iss": f"https://securetoken.google.com/{PROJECT_ID}",
+        "aud": PROJECT_ID,
+        "sub": "firebase-uid-1",
+        "iat": now - 10,
+        "auth_time": now - 10,
+        "exp": now + lifetime,
+        "email": "user@example.com",
+        "email_verified": True,
+    }
+    claims.update(overrides)
+    return jwt.encode(claims, KEYS[kid][0], algorithm="RS256", headers={"kid": kid})
+
+def test_verifies_and_caches_token(key_server, clock):
+    """Test that a valid token verifies once and is then served by digest"""
+    verifier = make_verifier(key_server, clock)
+    token = make_token()
+
+    claims = verifier.verify(token)
+    assert claims["uid"] == "firebase-uid-1"
+    assert claims["email"] == "user@example.com"
+
+    assert verifier.verify(token) == claims
+    assert verifier.stats()["hits"] == 1
+    assert key_server["requests"] == 1
+
+def test_cached_token_expires_with_exp(key_server, clock):
+    """Test that the digest cache doesn't outlive the token"""
+    verifier = make_verifier(key_server, clock)
+    token = make_token(lifetime=60)
+    verifier.verify(token)
+
+    clock.now += 61
+    with pytest.raises(ValueError, match="Firebase token expired"):
+        verifier.verify(token)
+
+@pytest.mark.parametrize("overrides, message", [
+    ({"aud": "other-project"}, "Invalid Firebase token"),
+    ({"iss": "https://securetoken.google.com/other-project"}, "Invalid Firebase token"),
+    ({"sub": ""}, "Invalid Firebase token"),
+    ({"exp": int(time.time()) - 10}, "Firebase token expired"),
+])
+def test_rejects_bad_claims(key_server, overrides, message, clock):
+    """Test the documented claim checks"""
+    verifier = make_verifier(key_server, clock)
+    with pytest.raises(ValueError, match=message):
+        verifier.verify(make_token(**overrides))
+
+def test_rejects_wrong_signature(key_server, clock):
+    """Test that a token signed by a key other than the one its kid names fails"""
+    verifier = make_verifier(key_server, clock)
+    forged = jwt.encode(jwt.get_unverified_claims(make_token()), KEYS["key-2"][0],
+                        algorithm="RS256", headers={"kid": "key-1"})
+    with pytest.raises(ValueError, match="Invalid Firebase token"):
+        verifier.verify(forged)
+
+def test_keys_follow_cache_lifetime(key_server, clock):
+    """Test that keys are reused within max-age, prefetched ahead of expiry and refetched after"""
+    key_server["max_age"] = 1000
+    verifier = make_verifier(key_server, clock)
+    key_cache = verifier.key_cache
+    key_cache.prefetch()
+    assert key_server["requests"] == 1
+
+    clock.now += 500
+    verifier.verify(make_token())
+    assert key_server["requests"] == 1
+
+    # Inside the refresh-ahead window: served from cache, refetched in the background
+    clock.now += 300
+    verifier.verify(make_token(email="other@example.com"))
+    key_cache._refresh_thread.join(timeout=5)
+    assert key_server["requests"] == 2
+    assert key_cache.stats()["expires_in_seconds"] == 1000
+
+    # Past expiry the lookup fetches inline
+    clock.now += 1001
+    verifier.verify(make_token(email="third@example.com"))
+    assert key_server["requests"] == 3
+
+def test_unknown_kid_refetches_for_rotation(key_server, clock):
+    """Test that a token signed with a newly published key verifies after one refetch"""
+    verifier = make_verifier(key_server, clock)
+    verifier.key_cache.prefetch()
+    verifier.key_cache.clock.now += UNKNOWN_KID_REFETCH_SECONDS
+
+    key_server["kids"] = ["key-1", "key-2"]
+    assert verifier.verify(make_token(kid="key-2"))["uid"] == "firebase-uid-1"
+    assert key_server["requests"] == 2
@@ -32,7 +32,13 @@ async def test_full_workflow(client, auth_headers_teacher, auth_headers_student,
     
     # 4. Student sends message (mock AI response)
     with patch('app.services.openai_service.OpenAIService.generate_response') as mock_chat:
-        mock_chat.return_value = ("AI response based on uploaded document", 150)
+        from app.services.openai_service import CompletionResult
+        mock_chat.return_value = CompletionResult(
+            content="AI response based on uploaded document",
+            model="gpt-4o-mini",
+            prompt_tokens=120,
+            completion_tokens=30
+        )
         
         message_data = {"content": "What did you learn from the document?"}
         response = client.post(
@@ -0,0 +1,67 @@
+import pytest
+from app.models import ClassMembership
+from app.services.membership_cache import (
+    MembershipCache, MembershipSnapshot, get_membership_cache,
+    invalidate_membership, invalidate_class_memberships, _apply_invalidation
+)
+from app.services.permission_service import PermissionService
+from tests.conftest import count_queries
+
+def make_member(factory, **permissions):
+    member = factory.user(name="Cache", surname="Member")
+    membership = factory.member(member, factory.class_(name="Cached"), **permissions)
+    factory.db.commit()
+    return membership.user_id, membership.class_id
+
+def test_entries_expire_and_report_staleness(fake_clock):
+    """Test TTL expiry, negative entries and hit-age metrics"""
+    cache = MembershipCache(max_entries=2, ttl_seconds=30, clock=fake_clock)
+    cache.put(1, 1, None)
+
+    fake_clock.now = 10
+    assert cache.get(1, 1) == (True, None)
+    assert cache.stats()["max_hit_age_seconds"] == 10
+
+    fake_clock.now = 31
+    assert cache.get(1, 1) == (False, None)
+    assert cache.stats()["hit_rate"] == 0.5
+
+@pytest.mark.asyncio
+async def test_lookups_are_cached_until_invalidated(test_db, factory):
+    """Test that repeat lookups skip the database and writes invalidate them"""
+    user_id, class_id = make_member(factory, can_chat=True)
+    service = PermissionService()
+
+    first = await service.get_user_membership(test_db, user_id, class_id)
+    with count_queries() as statements:
+        second = await service.get_user_membership(test_db, user_id, class_id)
+    assert statements == []
+    assert isinstance(second, MembershipSnapshot)
+    assert second == first
+
+    membership = test_db.query(ClassMembership).filter(ClassMembership.user_id == user_id).first()
+    membership.can_chat = False
+    test_db.commit()
+    assert (await service.get_user_membership(test_db, user_id, class_id)).can_chat
+
+    invalidate_membership(user_id, class_id)
+    assert not (await service.get_user_membership(test_db, user_id, class_id)).can_chat
+
+@pytest.mark.asyncio
+async def test_class_invalidation_and_notify_payloads(test_db, factory):
+    """Test class-wide invalidation and applying payloads from other workers"""
+    user_id, class_id = make_member(factory)
+    service = PermissionService()
+    cache = get_membership_cache()
+
+    await service.get_user_membership(test_db, user_id, class_id)
+    invalidate_class_memberships(class_id)
+    assert cache.get(user_id, class_id) == (False, None)
+
+    await service.get_user_membership(test_db, user_id, class_id)
+    _apply_invalidation(f"{user_id}:{class_id}")
+    assert cache.get(user_id, class_id) == (False, None)
+
+    await service.get_user_membership(test_db, user_id, class_id)
+    _apply_invalidation(f"class:{class_id}")
+    assert cache.get(user_id, class_id) == (False, None)
@@ -0,0 +1,50 @@
+import pytest
+from fastapi import HTTPException
+from tests.conftest import make_chat_session, fetch_messages
+
+@pytest.mark.asyncio
+async def test_newest_page_then_older(test_db, factory):
+    """Test that paging back with before cursors visits every message once, in order"""
+    user, session_id = make_chat_session(factory, 23)
+
+    page, headers = await fetch_messages(test_db, user, session_id, limit=5)
+    assert [m.content for m in page] == [f"m{i}" for i in range(18, 23)]
+    assert "X-After-Cursor" not in headers
+
+    seen = [m.content for m in page]
+    while "X-Before-Cursor" in headers:
+        page, headers = await fetch_messages(test_db, user, session_id, limit=5, before=headers["X-Before-Cursor"])
+        assert "X-After-Cursor" in headers
+        seen = [m.content for m in page] + seen
+    assert seen == [f"m{i}" for i in range(23)]
+
+@pytest.mark.asyncio
+async def test_after_cursor_pages_forward(test_db, factory):
+    """Test that after cursors page towards newer messages"""
+    user, session_id = make_chat_session(factory, 12)
+    _, headers = await fetch_messages(test_db, user, session_id, limit=4)
+    _, headers = await fetch_messages(test_db, user, session_id, limit=4, before=headers["X-Before-Cursor"])
+    oldest, headers = await fetch_messages(test_db, user, session_id, limit=4, before=headers["X-Before-Cursor"])
+    assert [m.content for m in oldest] == ["m0", "m1", "m2", "m3"]
+    assert "X-Before-Cursor" not in headers
+
+    newer, headers = await fetch_messages(test_db, user, session_id, limit=4, after=headers["X-After-Cursor"])
+    assert [m.content for m in newer] == ["m4", "m5", "m6", "m7"]
+    assert "X-After-Cursor" in headers
+
+@pytest.mark.asyncio
+async def test_offset_keeps_old_behaviour(test_db, factory):
+    """Test that offset still pages from the first message"""
+    user, session_id = make_chat_session(factory, 10)
+    page, headers = await fetch_messages(test_db, user, session_id, limit=3, offset=3)
+    assert [m.content for m in page] == ["m3", "m4", "m5"]
+    assert "X-Before-Cursor" not in headers
+
+@pytest.mark.asyncio
+async def test_invalid_cursor_is_rejected(test_db, factory):
+    """Test that malformed or conflicting cursors are client errors"""
+    user, session_id = make_chat_session(factory, 3)
+    for params in ({"before": "garbage"}, {"before": "a", "after": "b"}):
+        with pytest.raises(HTTPException) as error:
+            await fetch_messages(test_db, user, session_id, **params)
+        assert error.value.status_code == 400
@@ -0,0 +1,96 @@
+import os
+import pytest
+import uuid
+from datetime import datetime
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import Session
+from app.models import ChatMessage, UsageRecord, UsageRollupState
+from app.services.partition_service import (
+    PartitionService, add_months, partition_name, parse_partition_month
+)
+
+def test_month_arithmetic_and_names():
+    """Test that months roll over years and partition names round-trip"""
+    assert add_months(datetime(2026, 11, 1), 2) == datetime(2027, 1, 1)
+    assert add_months(datetime(2026, 1, 1), -1) == datetime(2025, 12, 1)
+    name = partition_name("chat_messages", datetime(2026, 3, 1))
+    assert name == "chat_messages_p202603"
+    assert parse_partition_month("chat_messages", name) == datetime(2026, 3, 1)
+    assert parse_partition_month("chat_messages", "chat_messages_default") is None
+
+def test_sqlite_has_nothing_to_partition(test_db):
+    """Test that partition creation is a no-op without declarative partitioning"""
+    assert PartitionService().ensure_partitions(test_db) == []
+
+def test_sqlite_retention_deletes_old_rows(test_db):
+    """Test that retention falls back to deletes and spares usage the rollups haven't seen"""
+    marker = uuid.uuid4().hex
+    test_db.execute(insert(ChatMessage), [
+        {"session_id": 0, "content": marker, "is_user": True, "timestamp": datetime(2026, 5, 31)},
+        {"session_id": 0, "content": marker, "is_user": True, "timestamp": datetime(2026, 7, 1)},
+    ])
+    usage = [{"user_id": 0, "model_name": marker, "operation_type": "chat", "cost": 0.0,
+              "timestamp": datetime(2026, 5, day)} for day in (1, 2)]
+    test_db.execute(insert(UsageRecord), usage)
+    ids = [r.id for r in test_db.query(UsageRecord).filter(UsageRecord.model_name == marker).order_by(UsageRecord.id)]
+    state = test_db.query(UsageRollupState).filter(UsageRollupState.id == 1).first()
+    if state is None:
+        state = UsageRollupState(id=1)
+        test_db.add(state)
+    previous_watermark = state.last_record_id or 0
+    state.last_record_id = ids[0]
+    test_db.commit()
+
+    service = PartitionService()
+    service.retention_months = {"usage_records": 3, "chat_messages": 3}
+    try:
+        service.apply_retention(test_db, now=datetime(2026, 9, 15))
+    finally:
+        state.last_record_id = previous_watermark
+        test_db.commit()
+
+    kept = test_db.query(ChatMessage.timestamp).filter(ChatMessage.content == marker).all()
+    assert [row.timestamp for row in kept] == [datetime(2026, 7, 1)]
+    remaining = [r.id for r in test_db.query(UsageRecord).filter(UsageRecord.model_name == marker)]
+    assert remaining == ids[1:]
+
+@pytest.fixture
+def postgres_session():
+    url = os.environ.get("TEST_POSTGRES_URL")
+    if not url:
+        pytest.skip("TEST_POSTGRES_URL not set")
+    schema = f"partition_test_{uuid.uuid4().hex[:8]}"
+    engine = create_engine(url)
+    conn = engine.connect()
+    conn.execute(text(f'CREATE SCHEMA "{schema}"'))
+    conn.execute(text(f'SET search_path TO "{schema}"'))
+    conn.execute(text(
+        'CREATE TABLE chat_messages (id serial, session_id int, content text, is_user bool, '
+        '"timestamp" timestamp NOT NULL, PRIMARY KEY (id, "timestamp")) PARTITION BY RANGE ("timestamp")'
+    ))
+    conn.execute(text(
+        "CREATE TABLE chat_messages_p202607 PARTITION OF chat_messages "
+        "FOR VALUES FROM ('2026-07-01') TO ('2026-08-01')"
+    ))
+    conn.commit()
+    db = Session(bind=conn)
+    try:
+        yield db
+    finally:
+        db.close()
+        conn.execute(text(f'DROP SCHEMA "{schema}" CASCADE'))
+        conn.commit()
+        conn.close()
+        engine.dispose()
+
+def test_postgres_partitions_are_created_and_retired(postgres_session):
+    """Test that upcoming months are created and expired ones detached"""
+    service = PartitionService()
+    created = service.ensure_partitions(postgres_session, now=datetime(2026, 10, 15))
+    assert created[0] == "chat_messages_p202610"
+    assert service.ensure_partitions(postgres_session, now=datetime(2026, 10, 15)) == []
+
+    service.retention_months = {"usage_records": 0, "chat_messages": 2}
+    assert service.apply_retention(postgres_session, now=datetime(2026, 10, 15)) == {"chat_messages": 1}
+    names = [name for name, _ in service.list_partitions(postgres_session, "chat_messages")]
+    assert "chat_messages_p202607" not in names
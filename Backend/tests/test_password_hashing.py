@@ -0,0 +1,55 @@
+import pytest
+import uuid
+from passlib.context import CryptContext
+from app.config import get_settings
+from app.models import User
+from app.schemas import UserCreate
+from app.services.auth_service import AuthService
+from app.utils.security import hash_password, verify_and_update_password, pwd_context
+
+settings = get_settings()
+
+@pytest.mark.asyncio
+async def test_hash_and_verify_in_executor():
+    """Test that executor hashing uses the configured cost and verifies"""
+    hashed = await hash_password("Secret123")
+    assert hashed.startswith(f"$2b${settings.BCRYPT_ROUNDS:02d}$")
+    assert await verify_and_update_password("Secret123", hashed) == (True, None)
+    assert (await verify_and_update_password("Wrong123", hashed))[0] is False
+
+@pytest.mark.asyncio
+async def test_login_rehashes_outdated_cost(test_db):
+    """Test that a successful login upgrades a hash made with another cost"""
+    email = f"rehash{uuid.uuid4().hex[:8]}@example.com"
+    cheap = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("Secret123")
+    test_db.add(User(email=email, name="Re", surname="Hash", hashed_password=cheap))
+    test_db.commit()
+
+    token = await AuthService().authenticate_user(test_db, email, "Secret123")
+    assert token.access_token
+
+    user = test_db.query(User).filter(User.email == email).first()
+    assert user.hashed_password != cheap
+    assert not pwd_context.needs_update(user.hashed_password)
+    assert pwd_context.verify("Secret123", user.hashed_password)
+
+@pytest.mark.asyncio
+async def test_wrong_password_keeps_hash(test_db):
+    """Test that a failed login neither authenticates nor rewrites the hash"""
+    email = f"rehash{uuid.uuid4().hex[:8]}@example.com"
+    cheap = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash("Secret123")
+    test_db.add(User(email=email, name="Re", surname="Hash", hashed_password=cheap))
+    test_db.commit()
+
+    with pytest.raises(ValueError, match="Incorrect password"):
+        await AuthService().authenticate_user(test_db, email, "Wrong123")
+    test_db.expire_all()
+    assert test_db.query(User.hashed_password).filter(User.email == email).scalar() == cheap
+
+@pytest.mark.asyncio
+async def test_create_user_hashes_password(test_db):
+    """Test that registration stores a verifiable hash"""
+    email = f"rehash{uuid.uuid4().hex[:8]}@example.com"
+    await AuthService().create_user(test_db, UserCreate(email=email, name="New", surname="User", password="Secret123"))
+    stored = test_db.query(User.hashed_password).filter(User.email == email).scalar()
+    assert pwd_context.verify("Secret123", stored)
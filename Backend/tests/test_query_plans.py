@@ -0,0 +1,112 @@
+"""
+EXPLAIN checks for the hot query shapes.
+
+Each query must be answered through the index added for it. Plans are
+checked on SQLite (the test database) always, and on Postgres when
+TEST_POSTGRES_URL points at a database the tests may create a scratch
+schema in. Postgres runs with enable_seqscan off: on tiny tables it would
+rather scan, and the point is whether a usable index exists.
+"""
+
+import os
+import pytest
+import uuid
+from datetime import datetime
+from sqlalchemy import create_engine, select, func, text, tuple_
+from app.models import (
+    Base, ChatMessage, ChatSession, Document, DocumentChunk, UsageRecord,
+    DocumentScope, ProcessingStatus
+)
+from tests.conftest import engine as sqlite_engine
+
+HOT_QUERIES = {
+    "session_messages": (
+        select(ChatMessage).where(ChatMessage.session_id == 1)
+        .order_by(ChatMessage.timestamp, ChatMessage.id),
+        "ix_chat_messages_session_timestamp"
+    ),
+    "session_messages_before_cursor": (
+        select(ChatMessage).where(
+            ChatMessage.session_id == 1,
+            tuple_(ChatMessage.timestamp, ChatMessage.id) < (datetime(2026, 1, 1), 100)
+        ).order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(51),
+        "ix_chat_messages_session_timestamp"
+    ),
+    "session_sidebar": (
+        select(ChatSession).where(ChatSession.user_id == 1, ChatSession.is_active == True)
+        .order_by(ChatSession.updated_at.desc()),
+        "ix_chat_sessions_user_updated_active"
+    ),
+    "active_chat_count": (
+        select(func.count(ChatSession.id)).where(
+            ChatSession.user_id == 1, ChatSession.class_id == 1, ChatSession.is_active == True
+        ),
+        "ix_chat_sessions_user_class_active"
+    ),
+    "class_documents": (
+        select(Document).where(
+            Document.class_id == 1, Document.scope == DocumentScope.CLASS,
+            Document.processing_status == ProcessingStatus.COMPLETED
+        ),
+        "ix_documents_class_scope_status"
+    ),
+    "session_documents": (
+        select(Document).where(Document.session_id == 1, Document.scope == DocumentScope.CHAT),
+        "ix_documents_session_scope"
+    ),
+    "document_chunks": (
+        select(DocumentChunk).where(DocumentChunk.document_id == 1).order_by(DocumentChunk.chunk_index),
+        "ix_document_chunks_document_chunk_index"
+    ),
+    "billed_usage": (
+        select(func.sum(UsageRecord.cost)).where(
+            UsageRecord.billed_to_user_id == 1, UsageRecord.timestamp >= datetime(2026, 1, 1)
+        ),
+        "ix_usage_records_billed_to_timestamp"
+    ),
+}
+
+def compile_query(query, dialect) -> str:
+    return str(query.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+
+@pytest.fixture(scope="module")
+def postgres():
+    url = os.environ.get("TEST_POSTGRES_URL")
+    if not url:
+        pytest.skip("TEST_POSTGRES_URL not set")
+    schema = f"plan_test_{uuid.uuid4().hex[:8]}"
+    pg_engine = create_engine(url)
+    with pg_engine.begin() as conn:
+        conn.execute(text(f'CREATE SCHEMA "{schema}"'))
+    scoped = pg_engine.execution_options(schema_translate_map={None: schema})
+    Base.metadata.create_all(bind=scoped)
+    try:
+        yield pg_engine, schema
+    finally:
+        with pg_engine.begin() as conn:
+            conn.execute(text(f'DROP SCHEMA "{schema}" CASCADE'))
+        pg_engine.dispose()
+
+@pytest.mark.parametrize("name", HOT_QUERIES)
+def test_sqlite_plan_uses_index(test_db, name):
+    """Test that SQLite answers the hot query through its index"""
+    query, index = HOT_QUERIES[name]
+    with sqlite_engine.connect() as conn:
+        plan = " ".join(row[-1] for row in conn.execute(
+            text("EXPLAIN QUERY PLAN " + compile_query(query, sqlite_engine.dialect))
+        ))
+    assert index in plan, plan
+
+@pytest.mark.parametrize("name", HOT_QUERIES)
+def test_postgres_plan_uses_index(postgres, name):
+    """Test that Postgres answers the hot query with an index scan"""
+    pg_engine, schema = postgres
+    query, index = HOT_QUERIES[name]
+    with pg_engine.connect() as conn:
+        conn.execute(text(f'SET search_path TO "{schema}"'))
+        conn.execute(text("SET enable_seqscan TO off"))
+        plan = "\n".join(row[0] for row in conn.execute(
+            text("EXPLAIN " + compile_query(query, pg_engine.dialect))
+        ))
+    assert "Seq Scan" not in plan, plan
+    assert index in plan, plan
@@ -0,0 +1,100 @@
+import pytest
+from types import SimpleNamespace
+from fastapi import Response
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.database import PrimaryPins, ReplicaSession, track_writes
+from app.models import Base, ChatSession, ClassMembership
+from app.routes.chat import get_user_sessions
+from app.schemas import UserResponse
+from app.services.membership_cache import get_membership_cache
+from app.services.permission_service import PermissionService
+
+USER = UserResponse(id=7, email="replica@example.com", name="Replica", surname="Reader",
+                    is_active=True, auth_provider="email", email_verified=True, created_at="2026-10-19T00:00:00")
+
+@pytest.fixture
+def databases(tmp_path):
+    """Primary and 'replica' SQLite files; the replica never receives the primary's writes"""
+    primary = create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    replica = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    for engine in (primary, replica):
+        Base.metadata.create_all(bind=engine)
+    now = [1000.0]
+    pins = PrimaryPins(5.0, clock=lambda: now[0])
+    PrimarySession = sessionmaker(bind=primary, autoflush=False)
+    ReadSession = sessionmaker(class_=ReplicaSession, autoflush=False, primary=primary, replica=replica, pins=pins)
+    track_writes(PrimarySession, pins)
+    track_writes(ReadSession, pins)
+    get_membership_cache().clear()
+    yield SimpleNamespace(primary=primary, replica=replica, now=now, pins=pins,
+                          PrimarySession=PrimarySession, ReadSession=ReadSession)
+    primary.dispose()
+    replica.dispose()
+
+def for_request(session_factory, user=USER):
+    db = session_factory()
+    db.info["request"] = SimpleNamespace(state=SimpleNamespace(current_user=user))
+    return db
+
+async def session_titles(db):
+    return [s.title for s in await get_user_sessions(Response(), USER, db, limit=None, cursor=None)]
+
+@pytest.mark.asyncio
+async def test_reads_follow_the_user_to_primary_after_a_write(databases):
+    """Test that listings read the replica, except for a few seconds after the user writes"""
+    with databases.replica.begin() as conn:
+        conn.execute(ChatSession.__table__.insert().values(title="Replicated", user_id=USER.id, class_id=1))
+    with databases.primary.begin() as conn:
+        conn.execute(ChatSession.__table__.insert().values(title="Replicated", user_id=USER.id, class_id=1))
+
+    writer = for_request(databases.PrimarySession)
+    writer.add(ChatSession(title="Just created", user_id=USER.id, class_id=1))
+    writer.commit()
+    writer.close()
+
+    reader = for_request(databases.ReadSession)
+    assert await session_titles(reader) == ["Just created", "Replicated"]
+    reader.close()
+
+    databases.now[0] += 6
+    reader = for_request(databases.ReadSession)
+    assert await session_titles(reader) == ["Replicated"]
+    reader.close()
+
+@pytest.mark.asyncio
+async def test_other_users_keep_reading_the_replica(databases):
+    """Test that one user's write doesn't move everyone onto the primary"""
+    writer = for_request(databases.PrimarySession)
+    writer.add(ChatSession(title="Primary only", user_id=USER.id, class_id=1))
+    writer.commit()
+    writer.close()
+
+    other = USER.model_copy(update={"id": 8})
+    reader = for_request(databases.ReadSession, other)
+    assert reader.query(ChatSession).count() == 0
+    reader.close()
+
+def test_writes_through_a_read_session_go_to_primary(databases):
+    """Test that a read session flushes to the primary and reads its own write"""
+    db = for_request(databases.ReadSession)
+    db.add(ChatSession(title="Written on read path", user_id=USER.id, class_id=1))
+    db.flush()
+    assert db.query(ChatSession).count() == 1
+    db.commit()
+    db.close()
+
+    with databases.replica.connect() as conn:
+        assert conn.execute(ChatSession.__table__.select()).first() is None
+    assert databases.pins.is_pinned(USER.id)
+
+@pytest.mark.asyncio
+async def test_replica_reads_are_not_cached(databases):
+    """Test that a possibly stale replica membership isn't stored in the membership cache"""
+    with databases.replica.begin() as conn:
+        conn.execute(ClassMembership.__table__.insert().values(user_id=9, class_id=3, can_chat=True))
+
+    reader = for_request(databases.ReadSession)
+    assert (await PermissionService().get_user_membership(reader, 9, 3)).can_chat
+    reader.close()
+    assert get_membership_cache().get(9, 3) == (False, None)
@@ -0,0 +1,68 @@
+import pytest
+import time
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+from app.services.chat_service import ChatService, settings
+from app.services.openai_service import CompletionResult
+from app.services.response_cache import ResponseCache, hash_prompt
+
+def make_cache(clock, max_entries=2):
+    return ResponseCache(
+        max_entries_per_class=max_entries,
+        max_classes=10,
+        similarity_threshold=0.95,
+        clock=clock
+    )
+
+def test_exact_hit_ignores_case_and_punctuation(fake_clock):
+    """Test that trivially different phrasings share a cache entry"""
+    cache = make_cache(fake_clock)
+    prompt_hash = hash_prompt("system prompt + context")
+    cache.put(1, cache.make_key("gpt-4o-mini", prompt_hash, "What is physics?"), "Physics is...", "gpt-4o-mini", prompt_hash)
+
+    entry = cache.get(1, cache.make_key("gpt-4o-mini", prompt_hash, "  what is   PHYSICS "), ttl_seconds=60)
+    assert entry is not None
+    assert entry.content == "Physics is..."
+
+    # Different context or class must miss
+    other_hash = hash_prompt("system prompt + other context")
+    assert cache.get(1, cache.make_key("gpt-4o-mini", other_hash, "What is physics?"), ttl_seconds=60) is None
+    assert cache.get(2, cache.make_key("gpt-4o-mini", prompt_hash, "What is physics?"), ttl_seconds=60) is None
+
+def test_entries_expire_and_are_bounded(fake_clock):
+    """Test TTL expiry and per-class LRU bound"""
+    cache = make_cache(fake_clock, max_entries=2)
+    for question in ("a", "b", "c"):
+        cache.put(1, cache.make_key("m", "h", question), question, "m", "h")
+
+    assert cache.get(1, cache.make_key("m", "h", "a"), ttl_seconds=60) is None
+    assert cache.get(1, cache.make_key("m", "h", "c"), ttl_seconds=60) is not None
+
+    fake_clock.now = 61
+    assert cache.get(1, cache.make_key("m", "h", "c"), ttl_seconds=60) is None
+
+def test_near_duplicate_lookup(fake_clock):
+    """Test semantic lookup only matches above threshold and for the same prompt"""
+    cache = make_cache(fake_clock)
+    cache.put(1, cache.make_key("m", "h", "q1"), "answer", "m", "h", embedding=[1.0, 0.0])
+
+    assert cache.find_similar(1, "m", "h", [0.99, 0.05], ttl_seconds=60).content == "answer"
+    assert cache.find_similar(1, "m", "h", [0.0, 1.0], ttl_seconds=60) is None
+    assert cache.find_similar(1, "m", "other", [1.0, 0.0], ttl_seconds=60) is None
+    assert cache.find_similar(1, "other-model", "h", [1.0, 0.0], ttl_seconds=60) is None
+
+@pytest.mark.asyncio
+async def test_miss_embeds_the_question_once(monkeypatch):
+    """Test that storing after a semantic miss reuses the lookup's embedding"""
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_SEMANTIC", True)
+    service = ChatService()
+    service.response_cache = make_cache(time.monotonic)
+    service.openai_service.generate_embeddings = AsyncMock(return_value=[[1.0, 0.0]])
+    class_obj = SimpleNamespace(id=1, response_cache_enabled=True, response_cache_ttl_seconds=60)
+
+    content, embedding = await service._get_cached_response(class_obj, "What is physics?", "ctx", "gpt-4o-mini")
+    assert content is None
+    await service._cache_response(class_obj, "What is physics?", "ctx",
+                                  CompletionResult(content="Physics is...", model="gpt-4o-mini"), embedding)
+    assert service.openai_service.generate_embeddings.await_count == 1
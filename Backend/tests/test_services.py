@@ -47,3 +47,38 @@ async def test_usage_service_get_stats(test_db, test_user, test_class):
     assert stats.daily_tokens_used >= 0
     assert stats.daily_limit > 0
 
+
+def test_calculate_cost_uses_exact_tokens_and_model_pricing():
+    """Test cost is computed from prompt/completion tokens with per-model pricing"""
+    from app.services.openai_service import calculate_cost
+    
+    # gpt-4o-mini: $0.15 input / $0.60 output per million tokens
+    assert calculate_cost("gpt-4o-mini", 1_000_000, 0) == 0.15
+    assert calculate_cost("gpt-4o-mini", 0, 1_000_000) == 0.60
+    assert calculate_cost("gpt-4o", 1_000_000, 1_000_000) == 12.50
+
+def test_model_router_escalates_and_respects_class_cap():
+    """Test routing heuristics pick higher tiers for harder turns and honour the class cap"""
+    from app.services.model_router import ModelRouter, ModelTier
+    
+    router = ModelRouter(
+        ladder=[
+            ModelTier(name="fast", model="small", max_tokens=500),
+            ModelTier(name="standard", model="small", max_tokens=1000),
+            ModelTier(name="advanced", model="large", max_tokens=1500),
+        ],
+        long_question_tokens=150,
+        large_context_tokens=1500,
+        deep_conversation_messages=20
+    )
+    
+    simple = router.route("What is a vector?", question_tokens=5, context_tokens=100, conversation_depth=2)
+    assert simple.tier.name == "fast"
+    
+    hard = router.route("Why does this derivation work?", question_tokens=200, context_tokens=3000, conversation_depth=30)
+    assert hard.model == "large"
+    
+    capped = router.route("Why does this derivation work?", question_tokens=200, context_tokens=3000,
+                          conversation_depth=30, max_tier=1)
+    assert capped.tier_index == 1
+    assert "capped_by_class" in capped.reason
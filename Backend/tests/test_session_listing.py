@@ -0,0 +1,69 @@
+import pytest
+from datetime import datetime, timedelta
+from fastapi import HTTPException, Response
+from unittest.mock import AsyncMock, patch
+from app.models import ChatSession
+from app.routes.chat import get_user_sessions, get_session_details
+from app.schemas import UserResponse
+from app.services.chat_service import ChatService
+from app.services.openai_service import CompletionResult
+from tests.conftest import count_queries
+
+def make_student(factory, sessions: int):
+    test_db = factory.db
+    student = factory.user(name="List", surname="Student")
+    class_obj = factory.class_(name="Listing")
+    factory.member(student, class_obj, is_sponsored=True)
+    start = datetime(2026, 10, 1)
+    for i in range(sessions):
+        test_db.add(ChatSession(title=f"Session {i}", user_id=student.id, class_id=class_obj.id,
+                                updated_at=start + timedelta(minutes=i), message_count=i))
+    test_db.commit()
+    return UserResponse.model_validate(student)
+
+@pytest.mark.asyncio
+async def test_listing_is_one_query(test_db, factory):
+    """Test that the sidebar doesn't count messages per session"""
+    student = make_student(factory, 20)
+
+    with count_queries() as statements:
+        sessions = await get_user_sessions(Response(), student, test_db, limit=None, cursor=None)
+    assert len(statements) == 1
+    assert [s.message_count for s in sessions] == list(range(19, -1, -1))
+
+@pytest.mark.asyncio
+async def test_cursor_pagination_walks_every_session(test_db, factory):
+    """Test that pages follow updated_at, don't overlap and end without a cursor"""
+    student = make_student(factory, 7)
+    seen, cursor = [], None
+    while True:
+        response = Response()
+        page = await get_user_sessions(response, student, test_db, limit=3, cursor=cursor)
+        seen.extend(s.title for s in page)
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert seen == [f"Session {i}" for i in range(6, -1, -1)]
+
+@pytest.mark.asyncio
+async def test_bad_cursor_is_rejected(test_db, factory):
+    """Test that a malformed cursor is a client error"""
+    student = make_student(factory, 1)
+    with pytest.raises(HTTPException) as error:
+        await get_user_sessions(Response(), student, test_db, limit=3, cursor="not-a-cursor")
+    assert error.value.status_code == 400
+
+@pytest.mark.asyncio
+async def test_send_message_maintains_counters(test_db, factory):
+    """Test that each chat turn adds both messages to the session counters"""
+    student = make_student(factory, 1)
+    session = test_db.query(ChatSession).filter(ChatSession.user_id == student.id).first()
+    session_id = session.id
+
+    completion = CompletionResult(content="Answer", model="gpt-4o-mini", prompt_tokens=5, completion_tokens=5)
+    with patch("app.services.openai_service.OpenAIService.generate_response", new=AsyncMock(return_value=completion)):
+        response = await ChatService().send_message(test_db, session, "Question?", student.id)
+
+    details = await get_session_details(session_id, student, test_db)
+    assert details.message_count == 2
+    assert details.last_message_at == response.ai_response.timestamp
@@ -0,0 +1,200 @@
+import pytest
+import asyncio
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from app.models import ClassMembership, ClassUsageTracker
+from app.services.permission_service import PermissionService, settings
+from app.utils.timezones import quota_today
+from tests.conftest import TestingSessionLocal
+
+_next_id = [10_000]
+
+def _ids():
+    """Unique user/class ids so tests don't share trackers"""
+    _next_id[0] += 1
+    return _next_id[0], _next_id[0]
+
+def make_membership(test_db, daily_limit=1000):
+    user_id, class_id = _ids()
+    membership = ClassMembership(
+        user_id=user_id,
+        class_id=class_id,
+        daily_token_limit=daily_limit,
+        weekly_token_limit=daily_limit * 5,
+        monthly_token_limit=daily_limit * 15
+    )
+    test_db.add(membership)
+    test_db.commit()
+    test_db.refresh(membership)
+    return membership
+
+def get_tracker(user_id, class_id):
+    db = TestingSessionLocal()
+    try:
+        return db.query(ClassUsageTracker).filter(
+            ClassUsageTracker.user_id == user_id,
+            ClassUsageTracker.class_id == class_id
+        ).first()
+    finally:
+        db.close()
+
+@pytest.mark.asyncio
+async def test_reservation_reconcile_and_release(test_db):
+    """Test reserving, settling and releasing tokens"""
+    membership = make_membership(test_db, daily_limit=1000)
+    service = PermissionService()
+
+    reservation, _ = await service.reserve_tokens(test_db, membership.user_id, membership.class_id, 600, membership)
+    assert reservation is not None
+
+    # Second request doesn't fit while the first is in flight
+    blocked, reason = await service.reserve_tokens(test_db, membership.user_id, membership.class_id, 600, membership)
+    assert blocked is None
+    assert "limit" in reason.lower()
+
+    await service.reconcile_reservation(test_db, reservation, 250)
+    tracker = get_tracker(membership.user_id, membership.class_id)
+    assert tracker.daily_tokens_used == 250
+    assert tracker.reserved_tokens == 0
+
+    reservation, _ = await service.reserve_tokens(test_db, membership.user_id, membership.class_id, 600, membership)
+    await service.release_reservation(test_db, reservation)
+    tracker = get_tracker(membership.user_id, membership.class_id)
+    assert tracker.daily_tokens_used == 250
+    assert tracker.reserved_tokens == 0
+
+@pytest.mark.asyncio
+async def test_new_reservations_do_not_extend_a_leaked_one(test_db):
+    """Test that reserved tokens lapse on schedule while the user keeps reserving"""
+    membership = make_membership(test_db, daily_limit=1000)
+    service = PermissionService()
+
+    leaked, _ = await service.reserve_tokens(test_db, membership.user_id, membership.class_id, 300, membership)
+    expires = get_tracker(membership.user_id, membership.class_id).reserved_until
+    reservation, _ = await service.reserve_tokens(test_db, membership.user_id, membership.class_id, 300, membership)
+    assert get_tracker(membership.user_id, membership.class_id).reserved_until == expires
+
+    # Once the window has passed, the leaked tokens no longer count
+    test_db.query(ClassUsageTracker).filter(ClassUsageTracker.id == leaked.tracker_id).update(
+        {"reserved_until": expires - timedelta(seconds=settings.TOKEN_RESERVATION_TTL_SECONDS + 1)}
+    )
+    test_db.commit()
+    fresh, _ = await service.reserve_tokens(test_db, membership.user_id, membership.class_id, 900, membership)
+    assert fresh is not None
+    tracker = get_tracker(membership.user_id, membership.class_id)
+    assert tracker.reserved_tokens == 900
+    assert tracker.reserved_until > expires
+
+@pytest.mark.asyncio
+async def test_reconcile_after_expiry_keeps_newer_reservations(test_db):
+    """Test that settling a lapsed reservation doesn't release a newer request's tokens"""
+    membership = make_membership(test_db, daily_limit=1000)
+    service = PermissionService()
+
+    stale, _ = await service.reserve_tokens(test_db, membership.user_id, membership.class_id, 300, membership)
+    # Age the reservation past its TTL
+    stale.expires_at -= timedelta(seconds=settings.TOKEN_RESERVATION_TTL_SECONDS + 1)
+    test_db.query(ClassUsageTracker).filter(ClassUsageTracker.id == stale.tracker_id).update(
+        {"reserved_until": stale.expires_at}
+    )
+    test_db.commit()
+    live, _ = await service.reserve_tokens(test_db, membership.user_id, membership.class_id, 400, membership)
+    assert live is not None
+
+    await service.reconcile_reservation(test_db, stale, 200)
+    tracker = get_tracker(membership.user_id, membership.class_id)
+    assert tracker.daily_tokens_used == 200
+    assert tracker.reserved_tokens == 400
+
+    await service.reconcile_reservation(test_db, live, 100)
+    tracker = get_tracker(membership.user_id, membership.class_id)
+    assert tracker.daily_tokens_used == 300
+    assert tracker.reserved_tokens == 0
+
+def test_concurrent_reservations_never_overshoot(test_db):
+    """Test that concurrent requests from one user can't exceed the daily limit"""
+    membership = make_membership(test_db, daily_limit=1000)
+    user_id, class_id = membership.user_id, membership.class_id
+    daily_limit = membership.daily_token_limit
+
+    # Create the tracker up front so workers only race on the reservation
+    asyncio.run(PermissionService().get_usage_tracker(test_db, user_id, class_id))
+
+    def worker(_):
+        db = TestingSessionLocal()
+        try:
+            member = db.query(ClassMembership).filter(ClassMembership.id == membership.id).first()
+            reservation, _ = asyncio.run(
+                PermissionService().reserve_tokens(db, user_id, class_id, 300, member)
+            )
+            return reservation is not None
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(worker, range(20)))
+
+    assert sum(results) == 3
+    tracker = get_tracker(user_id, class_id)
+    assert tracker.reserved_tokens == 900
+    assert tracker.daily_tokens_used + tracker.reserved_tokens <= daily_limit
+
+def test_concurrent_usage_recording_loses_no_updates(test_db):
+    """Test that concurrent increment_token_usage calls all land, including the first-use upsert"""
+    membership = make_membership(test_db, daily_limit=100_000)
+    user_id, class_id = membership.user_id, membership.class_id
+
+    def worker(_):
+        db = TestingSessionLocal()
+        try:
+            PermissionService().increment_token_usage(db, user_id, class_id, 7)
+            db.commit()
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(worker, range(50)))
+
+    tracker = get_tracker(user_id, class_id)
+    assert tracker.daily_tokens_used == 350
+    assert tracker.weekly_tokens_used == 350
+    assert tracker.monthly_tokens_used == 350
+
+@pytest.mark.asyncio
+async def test_increment_token_usage_resets_stale_periods(test_db):
+    """Test that a stale day/week/month is reset in the same statement as the increment"""
+    membership = make_membership(test_db)
+    service = PermissionService()
+    tracker = await service.get_usage_tracker(test_db, membership.user_id, membership.class_id)
+    long_ago = quota_today() - timedelta(days=40)
+    tracker.daily_tokens_used = tracker.weekly_tokens_used = tracker.monthly_tokens_used = 900
+    tracker.last_daily_reset = tracker.last_weekly_reset = tracker.last_monthly_reset = long_ago
+    test_db.commit()
+
+    totals = service.increment_token_usage(test_db, membership.user_id, membership.class_id, 25)
+    test_db.commit()
+
+    assert totals == (25, 25, 25)
+    assert get_tracker(membership.user_id, membership.class_id).last_daily_reset == quota_today()
+
+@pytest.mark.asyncio
+async def test_reset_is_applied_on_next_increment(test_db):
+    """Test that yesterday's exhausted quota allows a reservation and is reset by the settle"""
+    membership = make_membership(test_db, daily_limit=1000)
+    service = PermissionService()
+    tracker = await service.get_usage_tracker(test_db, membership.user_id, membership.class_id)
+    tracker.daily_tokens_used = 1000
+    tracker.last_daily_reset = quota_today() - timedelta(days=1)
+    test_db.commit()
+
+    can_chat, _ = await service.check_token_limits(test_db, membership.user_id, membership.class_id, membership, tracker)
+    assert can_chat
+    assert get_tracker(membership.user_id, membership.class_id).daily_tokens_used == 1000
+
+    reservation, _ = await service.reserve_tokens(test_db, membership.user_id, membership.class_id, 600, membership)
+    assert reservation is not None
+    await service.reconcile_reservation(test_db, reservation, 200)
+
+    tracker = get_tracker(membership.user_id, membership.class_id)
+    assert tracker.daily_tokens_used == 200
+    assert tracker.last_daily_reset == quota_today()
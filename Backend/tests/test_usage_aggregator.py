@@ -0,0 +1,129 @@
+import pytest
+from datetime import datetime
+from unittest.mock import MagicMock
+from app.models import ClassUsageTracker, UsageRecord, UsageFlushedSegment
+from app.services.usage_aggregator import UsageAggregator, UsageJournal
+from tests.conftest import TestingSessionLocal
+
+def usage_record(user_id):
+    return {"user_id": user_id, "model_name": "gpt-4o-mini", "operation_type": "chat",
+            "input_tokens": 5, "output_tokens": 5, "cost": 0.0}
+
+def make_aggregator(clock, session_factory=TestingSessionLocal, max_events=100, **options):
+    return UsageAggregator(session_factory, flush_interval_ms=1000, flush_max_events=max_events, clock=clock, **options)
+
+def test_limits_include_unflushed_and_in_flight_usage(fake_clock):
+    """Test that local usage counts against limits before it is flushed"""
+    aggregator = make_aggregator(fake_clock)
+    limits = (1000, 5000, 15000)
+
+    first = aggregator.try_reserve(1, 1, 400, used=(300, 300, 300), limits=limits)
+    assert first is not None
+    assert aggregator.try_reserve(1, 1, 400, used=(300, 300, 300), limits=limits) is None
+
+    aggregator.record(1, 1, 100, usage_record(1), reservation=first)
+    assert aggregator.unflushed_tokens(1, 1) == 100
+    assert aggregator.try_reserve(1, 1, 400, used=(300, 300, 300), limits=limits) is not None
+
+def test_flush_is_due_after_max_events_or_interval(fake_clock):
+    """Test the event-count and time-based flush triggers"""
+    aggregator = make_aggregator(fake_clock, max_events=3)
+    assert not aggregator.record(1, 1, 10, usage_record(1))
+    assert not aggregator.record(1, 1, 10, usage_record(1))
+    assert aggregator.record(1, 1, 10, usage_record(1))
+
+    aggregator = make_aggregator(fake_clock, max_events=3)
+    fake_clock.now = 1.5
+    assert aggregator.record(1, 1, 10, usage_record(1))
+
+@pytest.mark.asyncio
+async def test_flush_batches_writes_and_retries_after_failure(test_db, fake_clock):
+    """Test that deltas are summed per tracker and kept for retry when a flush fails"""
+    user_id, class_id = 20_001, 20_001
+    failing_session = MagicMock()
+    failing_session.commit.side_effect = RuntimeError("database unavailable")
+    aggregator = make_aggregator(fake_clock, session_factory=lambda: failing_session)
+
+    for _ in range(5):
+        aggregator.record(user_id, class_id, 30, usage_record(user_id))
+
+    assert await aggregator.flush() == 0
+    assert aggregator.stats()["buffered_records"] == 5
+    assert aggregator.unflushed_tokens(user_id, class_id) == 150
+
+    aggregator.session_factory = TestingSessionLocal
+    assert await aggregator.flush() == 6  # one tracker upsert + five usage records
+    assert aggregator.unflushed_tokens(user_id, class_id) == 0
+
+    tracker = test_db.query(ClassUsageTracker).filter(
+        ClassUsageTracker.user_id == user_id, ClassUsageTracker.class_id == class_id
+    ).first()
+    assert tracker.daily_tokens_used == 150
+    assert test_db.query(UsageRecord).filter(UsageRecord.user_id == user_id).count() == 5
+
+def crash(aggregator):
+    """Drop a journal's segment locks the way a dead process would"""
+    for f in aggregator.journal._held.values():
+        f.close()
+
+@pytest.mark.asyncio
+async def test_journaled_usage_is_replayed_once_after_crash(test_db, fake_clock, tmp_path):
+    """Test that unflushed journal segments are replayed and committed ones are skipped"""
+    user_id, class_id = 20_002, 20_002
+    crashed = make_aggregator(fake_clock, journal=UsageJournal(str(tmp_path)))
+    record = dict(usage_record(user_id), timestamp=datetime(2026, 10, 19, 12, 0))
+    for _ in range(3):
+        crashed.record(user_id, class_id, 40, record)
+
+    # Live segments are locked by their owner and never adopted
+    assert make_aggregator(fake_clock, journal=UsageJournal(str(tmp_path)))._recover() == 0
+    crash(crashed)
+
+    restarted = make_aggregator(fake_clock, journal=UsageJournal(str(tmp_path)))
+    assert await restarted.recover() == 3
+    assert restarted.unflushed_tokens(user_id, class_id) == 40 * 3
+    assert await restarted.flush() == 4
+    assert list(tmp_path.iterdir()) == []
+
+    # A segment whose batch committed before the crash is only cleaned up
+    stale = make_aggregator(fake_clock, journal=UsageJournal(str(tmp_path)))
+    stale.record(user_id, class_id, 40, record)
+    test_db.add(UsageFlushedSegment(segment_id=stale.journal._current))
+    test_db.commit()
+    crash(stale)
+    assert await make_aggregator(fake_clock, journal=UsageJournal(str(tmp_path))).recover() == 0
+    assert list(tmp_path.iterdir()) == []
+
+    tracker = test_db.query(ClassUsageTracker).filter(
+        ClassUsageTracker.user_id == user_id, ClassUsageTracker.class_id == class_id
+    ).first()
+    assert tracker.daily_tokens_used == 120
+    records = test_db.query(UsageRecord).filter(UsageRecord.user_id == user_id).all()
+    assert [r.timestamp for r in records] == [datetime(2026, 10, 19, 12, 0)] * 3
+
+@pytest.mark.asyncio
+async def test_failing_batch_is_set_aside_without_blocking_later_ones(test_db, fake_clock, tmp_path):
+    """Test that a batch is moved aside after max_attempts and the buffer stays bounded"""
+    user_id, class_id = 20_003, 20_003
+    failing_session = MagicMock()
+    failing_session.commit.side_effect = RuntimeError("bad batch")
+    aggregator = make_aggregator(fake_clock, session_factory=lambda: failing_session,
+                                 journal=UsageJournal(str(tmp_path)), max_attempts=2, max_unsettled=2)
+
+    aggregator.record(user_id, class_id, 10, usage_record(user_id))
+    assert await aggregator.flush() == 0
+    assert await aggregator.flush() == 0
+    assert aggregator.stats()["set_aside_batches"] == 1
+    assert aggregator.unflushed_tokens(user_id, class_id) == 0
+    assert [p.suffix for p in tmp_path.iterdir()] == [".dead"]
+
+    aggregator.max_attempts = 10
+    for _ in range(3):
+        aggregator.record(user_id, class_id, 10, usage_record(user_id))
+        await aggregator.flush()
+    assert aggregator.stats()["unsettled_batches"] == 2
+    assert aggregator.stats()["set_aside_batches"] == 2
+
+    aggregator.session_factory = TestingSessionLocal
+    assert await aggregator.flush() == 4
+    assert aggregator.unflushed_tokens(user_id, class_id) == 0
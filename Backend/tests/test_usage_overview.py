@@ -0,0 +1,94 @@
+import pytest
+from datetime import datetime, timedelta
+from app.models import ClassUsageTracker, ChatSession, ChatMessage
+from app.services.usage_service import UsageService
+from app.utils.timezones import quota_today
+from tests.conftest import count_queries
+
+def class_with_usage(factory, members):
+    test_db = factory.db
+    class_obj = factory.class_(name="Overview")
+    users = []
+    for i in range(members):
+        user = factory.user(name=f"Member{i:02d}")
+        factory.member(user, class_obj)
+        test_db.add(ClassUsageTracker(
+            user_id=user.id, class_id=class_obj.id,
+            daily_tokens_used=i * 10, weekly_tokens_used=i * 10, monthly_tokens_used=i * 10
+        ))
+        session = ChatSession(title="s", user_id=user.id, class_id=class_obj.id)
+        test_db.add(session)
+        test_db.flush()
+        test_db.add(ChatMessage(session_id=session.id, content="hi", is_user=True,
+                                timestamp=datetime(2026, 10, 1) + timedelta(minutes=i)))
+        users.append(user)
+    test_db.commit()
+    return class_obj, users
+
+@pytest.mark.asyncio
+async def test_overview_is_one_query_regardless_of_class_size(test_db, factory):
+    """Test that the overview doesn't issue per-member queries"""
+    small_id = class_with_usage(factory, 2)[0].id
+    large_id = class_with_usage(factory, 20)[0].id
+    service = UsageService()
+
+    with count_queries() as small_queries:
+        assert len(await service.get_class_usage_overview(test_db, small_id)) == 2
+    with count_queries() as large_queries:
+        overview = await service.get_class_usage_overview(test_db, large_id)
+
+    assert len(overview) == 20
+    assert len(small_queries) == len(large_queries) == 1
+    assert overview[5].last_activity == datetime(2026, 10, 1, 0, 5)
+
+@pytest.mark.asyncio
+async def test_overview_applies_resets_without_writing(test_db, factory):
+    """Test that stale counters read as zero and the tracker is left untouched"""
+    class_obj, users = class_with_usage(factory, 3)
+    tracker = test_db.query(ClassUsageTracker).filter(ClassUsageTracker.user_id == users[2].id).first()
+    tracker.last_daily_reset = quota_today() - timedelta(days=1)
+    test_db.commit()
+
+    overview = await UsageService().get_class_usage_overview(test_db, class_obj.id)
+    stats = next(member.usage_stats for member in overview if member.user_id == users[2].id)
+
+    assert stats.daily_tokens_used == 0
+    test_db.refresh(tracker)
+    assert tracker.daily_tokens_used == 20
+
+@pytest.mark.asyncio
+async def test_overview_sorts_and_paginates_by_usage(test_db, factory):
+    """Test sorting by usage and offset/limit paging"""
+    class_obj, users = class_with_usage(factory, 10)
+    service = UsageService()
+
+    first_page = await service.get_class_usage_overview(
+        test_db, class_obj.id, limit=3, sort_by="daily_usage", descending=True
+    )
+    second_page = await service.get_class_usage_overview(
+        test_db, class_obj.id, limit=3, offset=3, sort_by="daily_usage", descending=True
+    )
+
+    assert [m.usage_stats.daily_tokens_used for m in first_page] == [90, 80, 70]
+    assert [m.usage_stats.daily_tokens_used for m in second_page] == [60, 50, 40]
+
+    with pytest.raises(ValueError):
+        await service.get_class_usage_overview(test_db, class_obj.id, sort_by="email")
+
+@pytest.mark.asyncio
+async def test_usage_reads_never_write(test_db, factory):
+    """Test that reading usage across a reset boundary issues no writes"""
+    class_obj, users = class_with_usage(factory, 1)
+    user_id, class_id = users[0].id, class_obj.id
+    tracker = test_db.query(ClassUsageTracker).filter(ClassUsageTracker.user_id == user_id).first()
+    tracker.last_daily_reset = tracker.last_weekly_reset = tracker.last_monthly_reset = quota_today() - timedelta(days=40)
+    test_db.commit()
+
+    service = UsageService()
+    with count_queries() as statements:
+        stats = await service.get_user_class_usage(test_db, user_id, class_id)
+        by_class = await service.get_user_usage_by_class(test_db, user_id)
+
+    assert stats.daily_tokens_used == stats.monthly_tokens_used == 0
+    assert by_class[0].weekly_remaining == by_class[0].weekly_limit
+    assert all(statement.lstrip().upper().startswith("SELECT") for statement in statements)
@@ -0,0 +1,86 @@
+import pytest
+from datetime import datetime, timedelta
+from app.models import UsageRecord, UsageRollupState, UsageHourlyRollup, UsageDailyRollup
+from app.services.usage_rollup_service import UsageRollupService, settings
+
+USER_ID, CLASS_ID = 30_001, 30_001
+
+@pytest.fixture
+def rollup_db(test_db):
+    """Start from empty rollups and a zero watermark"""
+    for model in (UsageRecord, UsageHourlyRollup, UsageDailyRollup, UsageRollupState):
+        test_db.query(model).delete()
+    test_db.commit()
+    return test_db
+
+def add_record(db, timestamp, tokens=100, model_name="gpt-4o-mini", is_sponsored=False):
+    db.add(UsageRecord(
+        user_id=USER_ID, class_id=CLASS_ID, model_name=model_name, operation_type="chat",
+        input_tokens=tokens, output_tokens=tokens, cost=0.01, timestamp=timestamp, is_sponsored=is_sponsored
+    ))
+    db.commit()
+
+def test_compaction_buckets_by_hour_and_day(rollup_db):
+    """Test that records are summed into hourly and daily buckets exactly once"""
+    day = datetime(2026, 10, 1)
+    add_record(rollup_db, day.replace(hour=9, minute=5))
+    add_record(rollup_db, day.replace(hour=9, minute=55))
+    add_record(rollup_db, day.replace(hour=14))
+    add_record(rollup_db, day.replace(hour=14), model_name="gpt-4o")
+
+    service = UsageRollupService()
+    assert service.compact_all(rollup_db, now=day + timedelta(days=1)) == 4
+    assert service.compact_all(rollup_db, now=day + timedelta(days=1)) == 0
+
+    hourly = service.get_history(rollup_db, "hour", day, day + timedelta(days=1), class_id=CLASS_ID)
+    assert [(row.bucket_start.hour, row.model_name, row.request_count) for row in hourly] == [
+        (9, "gpt-4o-mini", 2), (14, "gpt-4o", 1), (14, "gpt-4o-mini", 1)
+    ]
+
+    daily = service.get_history(rollup_db, "day", day, day + timedelta(days=1), user_id=USER_ID)
+    mini = next(row for row in daily if row.model_name == "gpt-4o-mini")
+    assert mini.request_count == 3
+    assert mini.input_tokens == 300
+
+def test_unsettled_records_wait_for_next_run(rollup_db):
+    """Test that compaction stops at records inside the settle window and reports lag"""
+    now = datetime(2026, 10, 2, 12, 0, 0)
+    add_record(rollup_db, now - timedelta(minutes=10))
+    add_record(rollup_db, now - timedelta(seconds=5))
+
+    service = UsageRollupService()
+    assert service.compact_all(rollup_db, now=now) == 1
+
+    lag = service.lag(rollup_db, now=now)
+    assert lag["pending_records"] == 1
+    assert lag["lag_seconds"] == 5.0
+
+    assert service.compact_all(rollup_db, now=now + timedelta(minutes=1)) == 1
+    assert service.lag(rollup_db, now=now)["pending_records"] == 0
+
+def test_competing_compactors_do_not_double_count(rollup_db):
+    """Test that a compactor that read a stale watermark backs off instead of re-adding"""
+    day = datetime(2026, 10, 3)
+    add_record(rollup_db, day.replace(hour=8))
+    service = UsageRollupService()
+    assert service.compact_all(rollup_db, now=day + timedelta(days=1)) == 1
+
+    # A second compactor that read the watermark before the first one moved it
+    stale = UsageRollupService()
+    stale._get_watermark = lambda db: 0
+    assert stale.compact(rollup_db, now=day + timedelta(days=1)) == 0
+
+    daily = service.get_history(rollup_db, "day", day, day + timedelta(days=1), class_id=CLASS_ID)
+    assert [row.request_count for row in daily] == [1]
+
+def test_compaction_run_is_capped(rollup_db, monkeypatch):
+    """Test that a capped run leaves the rest of a backlog for later runs"""
+    monkeypatch.setattr(settings, "ROLLUP_BATCH_SIZE", 1)
+    day = datetime(2026, 10, 4)
+    for hour in (8, 9, 10):
+        add_record(rollup_db, day.replace(hour=hour))
+
+    service = UsageRollupService()
+    assert service.compact_all(rollup_db, now=day + timedelta(days=1), max_batches=2) == 2
+    assert service.lag(rollup_db, now=day + timedelta(days=1))["pending_records"] == 1
+    assert service.compact_all(rollup_db, now=day + timedelta(days=1), max_batches=2) == 1
@@ -0,0 +1,61 @@
+from app.models import User
+from app.schemas import UserResponse
+from app.services.user_cache import UserCache, get_user_cache
+from tests.conftest import bearer, count_queries
+
+ME_URL = "/api/v1/auth/me"
+
+def test_entries_expire_and_require_matching_version(fake_clock):
+    """Test TTL expiry and that a different token version misses"""
+    cache = UserCache(max_entries=10, ttl_seconds=10, clock=fake_clock)
+    snapshot = UserResponse(id=1, email="a@example.com", name="A", surname="B", created_at="2026-01-01T00:00:00",
+                            is_active=True, auth_provider="email", email_verified=False)
+    cache.put(1, 0, snapshot)
+
+    assert cache.get(1, 0) == snapshot
+    assert cache.get(1, 1) is None
+
+    fake_clock.now = 10
+    assert cache.get(1, 0) is None
+    assert cache.stats()["hits"] == 1
+
+def test_repeat_requests_skip_the_database(client, test_db, factory):
+    """Test that a cached user authenticates without any query"""
+    user_id = factory.user(name="Auth").id
+    test_db.commit()
+    headers = bearer(user_id)
+
+    assert client.get(ME_URL, headers=headers).status_code == 200
+    with count_queries() as statements:
+        response = client.get(ME_URL, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["id"] == user_id
+    assert statements == []
+
+def test_profile_update_invalidates(client, test_db, factory):
+    """Test that the next request after a profile update sees the new name"""
+    user_id = factory.user(name="Auth").id
+    test_db.commit()
+    headers = bearer(user_id)
+    client.get(ME_URL, headers=headers)
+
+    response = client.put("/api/v1/auth/profile", headers=headers, json={"alias": "Renamed"})
+    assert response.status_code == 200
+    assert client.get(ME_URL, headers=headers).json()["display_name"] == "Renamed"
+
+def test_account_deletion_revokes_tokens(client, test_db, factory):
+    """Test that deleting the account rejects tokens issued before, even if cached"""
+    user_id = factory.user(name="Auth").id
+    test_db.commit()
+    headers = bearer(user_id)
+    client.get(ME_URL, headers=headers)
+
+    assert client.delete("/api/v1/auth/account", headers=headers).status_code == 200
+    assert client.get(ME_URL, headers=headers).status_code == 401
+
+    # Reactivated accounts still don't accept the old tokens
+    test_db.query(User).filter(User.id == user_id).update({"is_active": True})
+    test_db.commit()
+    get_user_cache().clear()
+    assert client.get(ME_URL, headers=headers).status_code == 401
+    assert client.get(ME_URL, headers=bearer(user_id, version=1)).status_code == 200